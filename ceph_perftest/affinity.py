@@ -0,0 +1,102 @@
+import os
+from pathlib import Path
+
+SYSFS_ROOT = '/sys'
+
+# Run unpinned, pinned to each device's NUMA-local CPUs, or both to
+# compare them.
+AFFINITY_MODES = ['off', 'numa', 'compare']
+DEFAULT_AFFINITY = 'off'
+
+def disk_name(device, sysfs_root=SYSFS_ROOT):
+    """
+    Name of device's disk under sysfs block/, going from a partition
+    (e.g. sda1, nvme0n1p1) to the disk it is on.
+    """
+    name = os.path.basename(os.path.realpath(device))
+    block = Path(sysfs_root).joinpath('block')
+    if block.joinpath(name).exists():
+        return name
+    for disk in block.glob('*/{name}'.format(name=name)):
+        return disk.parent.name
+    return None
+
+def read_sysfs(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def device_locality(device, sysfs_root=SYSFS_ROOT):
+    """
+    NUMA node and local CPU list of the bus device (HBA, NVMe controller)
+    behind device, found by walking up from block/<disk>/device to the
+    first parent with a numa_node. The node is None on hosts without
+    NUMA, the CPU list None if sysfs has nothing for the device.
+    """
+    name = disk_name(device, sysfs_root)
+    if name is None:
+        return {'numa_node': None, 'cpus': None}
+    root = Path(sysfs_root).resolve()
+    path = Path(sysfs_root).joinpath('block', name, 'device').resolve()
+    while path != root and path.parent != path:
+        numa_node = read_sysfs(path.joinpath('numa_node'))
+        if numa_node is not None:
+            node = int(numa_node)
+            cpus = read_sysfs(path.joinpath('local_cpulist'))
+            if cpus is None and node >= 0:
+                cpus = read_sysfs(
+                    Path(sysfs_root).joinpath('devices/system/node/node{node}/cpulist'.format(node=node))
+                    )
+            return {'numa_node': node if node >= 0 else None, 'cpus': cpus or None}
+        path = path.parent
+    return {'numa_node': None, 'cpus': None}
+
+def affinity_options(locality):
+    """
+    fio options pinning a device's job to its local CPUs and NUMA node.
+    """
+    options = []
+    if locality['cpus'] is not None:
+        options.append('cpus_allowed={cpus}'.format(cpus=locality['cpus']))
+    if locality['numa_node'] is not None:
+        options.append('numa_cpu_nodes={node}'.format(node=locality['numa_node']))
+    return options
+
+def device_placement(devices, sysfs_root=SYSFS_ROOT):
+    """
+    {device: fio options} placing each of devices on its NUMA-local
+    CPUs, reporting where each goes. Devices sysfs has no locality for
+    are left unpinned.
+    """
+    placement = {}
+    for device in devices:
+        locality = device_locality(device, sysfs_root)
+        placement[device] = affinity_options(locality)
+        if placement[device]:
+            print("{device}: NUMA node {node}, CPUs {cpus}".format(
+                device=device,
+                node='-' if locality['numa_node'] is None else locality['numa_node'],
+                cpus=locality['cpus'] or 'any'
+                )
+            )
+        else:
+            print("{device}: no NUMA locality in {sysfs_root}, left unpinned".format(
+                device=device,
+                sysfs_root=sysfs_root
+                )
+            )
+    return placement
+
+def affinity_runs(affinity):
+    """
+    The placements to sweep for an affinity mode, unpinned first.
+    """
+    return ['off', 'numa'] if affinity == 'compare' else [affinity]
+
+def affinity_tag(affinity):
+    """
+    File name suffix for the outputs of a pinned run.
+    """
+    return '' if affinity == 'off' else '-{affinity}'.format(affinity=affinity)
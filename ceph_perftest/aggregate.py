@@ -0,0 +1,32 @@
+import numpy as np
+
+def pivot(summary, entity_key, varname, entities=None, counts=None):
+    """
+    Pivot summary rows ({'count': ..., entity_key: ..., varname: ...})
+    into a dense count x entity matrix in a single pass.
+
+    entities and counts default to the order in which entities first
+    appear and the sorted counts present. Missing cells are zero.
+    Returns (counts, entities, matrix).
+    """
+    if entities is None:
+        entities = list(dict.fromkeys(i[entity_key] for i in summary))
+    if counts is None:
+        counts = sorted(set(i['count'] for i in summary))
+    entity_idx = {entity: idx for idx, entity in enumerate(entities)}
+    count_idx = {count: idx for idx, count in enumerate(counts)}
+
+    matrix = np.zeros((len(counts), len(entities)))
+    for i in summary:
+        row = count_idx.get(i['count'])
+        col = entity_idx.get(i[entity_key])
+        if row is not None and col is not None:
+            matrix[row, col] = i[varname]
+
+    return counts, entities, matrix
+
+def stack_bottoms(matrix):
+    """
+    Bottom of each entity's bar segment when stacking across entities.
+    """
+    return np.cumsum(matrix, axis=1) - matrix
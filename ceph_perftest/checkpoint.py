@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import sys
+from pathlib import PurePath
+
+MANIFEST_NAME = 'checkpoint-{name}.json'
+
+CHECKSUM_CHUNK = 1024 * 1024
+
+def file_checksum(fn):
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class Checkpoint:
+    """
+    Manifest of the completed steps of a sweep in its output directory,
+    each with its parameters and the checksums of its output files (all
+    in the output directory), so an interrupted sweep can be resumed
+    without re-running them.
+
+    Without resume the manifest is started afresh and every step runs.
+    """
+    def __init__(self, outdir, name, resume=False):
+        self.manifest_fn = PurePath(outdir).joinpath(MANIFEST_NAME.format(name=name))
+        self.steps = {}
+        if resume:
+            try:
+                with open(self.manifest_fn) as f:
+                    self.steps = json.load(f)['steps']
+            except (OSError, ValueError, KeyError):
+                print("No usable checkpoint manifest at {manifest_fn}, running every step".format(
+                    manifest_fn=self.manifest_fn
+                    )
+                )
+
+    def completed(self, key, params):
+        """
+        The data recorded with step key if it completed with the same
+        params and all of its output files are intact, otherwise None.
+        """
+        step = self.steps.get(key)
+        if step is None:
+            return None
+        # Round-trip through JSON so tuples compare equal to lists
+        if step['params'] != json.loads(json.dumps(params)):
+            print("Re-running step {key}: parameters changed".format(key=key))
+            return None
+        for output_fn, checksum in step['outputs'].items():
+            try:
+                valid = file_checksum(self.manifest_fn.parent.joinpath(output_fn)) == checksum
+            except OSError:
+                valid = False
+            if not valid:
+                print("Re-running step {key}: {output_fn} missing or corrupt".format(
+                    key=key,
+                    output_fn=output_fn
+                    )
+                )
+                return None
+        print("Skipping completed step {key}".format(key=key))
+        return step['data']
+
+    def record(self, key, params, output_fns, data=None):
+        self.steps[key] = {
+            'params': params,
+            # Relative to the output directory so that it can be moved
+            'outputs': {PurePath(i).name: file_checksum(i) for i in output_fns},
+            'data': data
+            }
+        tmp_fn = "{manifest_fn}.tmp".format(manifest_fn=self.manifest_fn)
+        with open(tmp_fn, 'w') as f:
+            json.dump({'steps': self.steps}, f, indent=1)
+        os.replace(tmp_fn, self.manifest_fn)
+
+def check_resume(resume, cleanup):
+    if resume and cleanup:
+        sys.exit("--resume needs the output files that --cleanup removes")
@@ -1,12 +1,19 @@
 import click
 from shutil import which
 from sys import exit
-from .mixed_io.run import run_mixed_io
-from .fs_aggregate.run import run_aggregate_performance
-from .single_device.run import run_single_device
-from .single_host.run import run_single_host
-from .send_file.runclient import run_sendfile_client
-from .send_file.runserver import run_sendfile_server, stop_sendfile_server
+# Option choices and defaults are needed to build the commands. The
+# modules they come from import only the standard library at the top
+# (render defers matplotlib and its process pool, trials statistics,
+# engine socket, results_db sqlite3), which test_startup keeps within
+# its import budget.
+from .render import DEFAULT_PLOT_FORMAT, PLOT_FORMATS
+from .trials import DEFAULT_ERROR_BARS, ERROR_BARS, REPEAT_CV_THRESHOLD
+from .send_file.engine import DEFAULT_CHUNK_SIZE, DEFAULT_ENGINE, ENGINES
+from .affinity import AFFINITY_MODES, DEFAULT_AFFINITY, SYSFS_ROOT
+from .results_db import DEFAULT_RESULTS_DB, EXPORT_FORMATS, RESULTS_DB_ENV
+
+# Runner modules pull in pandas, plotnine and matplotlib, so each
+# subcommand imports its runner only when it is invoked.
 
 def is_exe(exe):
     """
@@ -20,8 +27,18 @@ def is_exe(exe):
     return which(exe)
 
 @click.group()
-def cli():
-    pass
+@click.option('--results-db',
+              type=click.Path(dir_okay=False, resolve_path=True),
+              default=DEFAULT_RESULTS_DB,
+              envvar=RESULTS_DB_ENV,
+              help="SQLite database every benchmark run is recorded in [Default: ~/.ceph-perftest/results.db, or ${env}].".format(
+                  env=RESULTS_DB_ENV))
+@click.option('--no-results-db',
+              is_flag=True,
+              help="Do not record results in the results database [Default: no].")
+@click.pass_context
+def cli(ctx, results_db, no_results_db):
+    ctx.obj = {'results_db': None if no_results_db else results_db}
 
 @cli.command()
 @click.argument('fio_output_json',
@@ -42,14 +59,121 @@ def cli():
               type=str,
               default='',
               help="Additional plot annotation [Default: ''].")
+@click.option('-j',
+              '--jobs',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Number of worker processes used to parse fio JSON files and render plots [Default: 1].")
+@click.option('--no-cache',
+              is_flag=True,
+              help="Re-parse all fio JSON files instead of using the parsed-results cache in OUTDIR [Default: no].")
+@click.option('--format', 'plot_format',
+              type=click.Choice(PLOT_FORMATS),
+              default=DEFAULT_PLOT_FORMAT,
+              help="Plot format: full resolution png, low resolution png preview, or vector svg/pdf [Default: png].")
 @click.pass_context
-def mixed_io(ctx, fio_output_json, outdir, output_file_prefix, annotation):
+def mixed_io(ctx, fio_output_json, outdir, output_file_prefix, annotation, jobs, no_cache, plot_format):
     """
     Plot Mixed IO fio JSON output.
 
     FIO_OUTPUT_JSON: fio output JSON file. May be supplied many times.
     """
-    run_mixed_io(fio_output_json, outdir, output_file_prefix, annotation)
+    from .mixed_io.run import run_mixed_io
+    run_mixed_io(fio_output_json, outdir, output_file_prefix, annotation, jobs, no_cache, plot_format,
+                 ctx.obj['results_db'])
+
+@cli.command()
+@click.argument('fio_client',
+                type=str,
+                nargs=-1)
+@click.option('-d', '--directory',
+              type=str,
+              required=True,
+              help="Directory (e.g. a CephFS mount) in which fio creates its files, on every client.")
+@click.option('-c', '--cleanup',
+              is_flag=True,
+              help="Clean up fio job and output JSON files [Default: no]." )
+@click.option('-o', '--outdir',
+              type=str,
+              default='.',
+              help="Output directory for plots and fio job and json files [Default: .].")
+@click.option('-p',
+              '--output-file-prefix',
+              type=str,
+              default='',
+              help="Prefix for output plots filenames [Default: ''].")
+@click.option('-a',
+              '--annotation',
+              type=str,
+              default='',
+              help="Additional plot annotation [Default: ''].")
+@click.option('-b', '--bs',
+              type=str,
+              multiple=True,
+              default=['4k', '1M'],
+              help='fio bs parameter, may be supplied many times [Default: 4k, 1M].')
+@click.option('-R', '--rwmixread',
+              type=click.IntRange(min=0, max=100),
+              multiple=True,
+              default=[0, 50, 100],
+              help='fio rwmixread parameter, may be supplied many times [Default: 0, 50, 100].')
+@click.option('-P', '--percentage-random',
+              type=click.IntRange(min=0, max=100),
+              multiple=True,
+              default=[0, 50, 100],
+              help='fio percentage_random parameter, may be supplied many times [Default: 0, 50, 100].')
+@click.option('-r', '--cell-time',
+              type=click.IntRange(min=1),
+              default=60,
+              help='Time budget for each cell of the matrix in seconds, including the ramp time [Default: 60].')
+@click.option('--ramp-time',
+              type=click.IntRange(min=0),
+              default=10,
+              help='fio ramp_time parameter in seconds, excluded from the results [Default: 10].')
+@click.option('-n', '--numjobs',
+              type=int,
+              default=1,
+              help='fio numjobs parameter per client [Default: 1].')
+@click.option('-i', '--iodepth',
+              type=int,
+              default=16,
+              help='fio iodepth parameter [Default: 16].')
+@click.option('-f', '--filesize',
+              type=str,
+              default='2G',
+              help='fio size parameter [Default: 2G].')
+@click.option('--nrfiles',
+              type=int,
+              default=1,
+              help='fio nrfiles parameter [Default: 1].')
+@click.option('-j',
+              '--jobs',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Number of worker processes used to parse fio JSON files and render plots [Default: 1].")
+@click.option('--format', 'plot_format',
+              type=click.Choice(PLOT_FORMATS),
+              default=DEFAULT_PLOT_FORMAT,
+              help="Plot format: full resolution png, low resolution png preview, or vector svg/pdf [Default: png].")
+@click.pass_context
+def mixed_io_run(ctx, fio_client, directory, cleanup, outdir, output_file_prefix, annotation,
+                 bs, rwmixread, percentage_random, cell_time, ramp_time, numjobs, iodepth,
+                 filesize, nrfiles, jobs, plot_format):
+    """
+    Run the mixed IO matrix (every bs, rwmixread and percentage_random
+    combination), locally or on all clients at once with fio
+    client/server mode, then plot it as mixed-io does.
+
+    \b
+    FIO_CLIENT: Host running fio --server, as HOST or HOST,PORT (may be specified many times).
+                Runs fio locally if none are given.
+    """
+    fio_exe = is_exe("fio")
+
+    from .mixed_io.run import run_mixed_io_fio
+    run_mixed_io_fio(fio_exe, fio_client, directory, cleanup, outdir, output_file_prefix, annotation,
+                     bs, rwmixread, percentage_random, cell_time, ramp_time, numjobs, iodepth,
+                     filesize, nrfiles, jobs, plot_format, ctx.obj['results_db'])
 
 @cli.command()
 @click.argument('fio_output_json',
@@ -65,15 +189,111 @@ def mixed_io(ctx, fio_output_json, outdir, output_file_prefix, annotation):
               type=str,
               default='',
               help="Prefix for output plots filenames [Default: ''].")
+@click.option('-j',
+              '--jobs',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Number of worker processes used to parse fio JSON files and render plots [Default: 1].")
+@click.option('--no-cache',
+              is_flag=True,
+              help="Re-parse all fio JSON files instead of using the parsed-results cache in OUTDIR [Default: no].")
+@click.option('--format', 'plot_format',
+              type=click.Choice(PLOT_FORMATS),
+              default=DEFAULT_PLOT_FORMAT,
+              help="Plot format: full resolution png, low resolution png preview, or vector svg/pdf [Default: png].")
 @click.pass_context
-def aggregate_performance(ctx, fio_output_json, outdir, output_file_prefix):
+def aggregate_performance(ctx, fio_output_json, outdir, output_file_prefix, jobs, no_cache, plot_format):
     """
     Plot Aggregate Performance fio JSON output.
 
     FIO_OUTPUT_JSON: fio output JSON file. May be supplied many times.
     """
 
-    run_aggregate_performance(fio_output_json, outdir, output_file_prefix)
+    from .fs_aggregate.run import run_aggregate_performance
+    run_aggregate_performance(fio_output_json, outdir, output_file_prefix, jobs, no_cache, plot_format,
+                              ctx.obj['results_db'])
+
+@cli.command()
+@click.argument('fio_client',
+                type=str,
+                nargs=-1)
+@click.option('-d', '--directory',
+              type=str,
+              required=True,
+              help="Directory on the clients (e.g. a CephFS mount) in which fio creates its files.")
+@click.option('-c', '--cleanup',
+              is_flag=True,
+              help="Clean up fio job and output JSON files [Default: no]." )
+@click.option('-o', '--outdir',
+              type=str,
+              default='.',
+              help="Output directory for plots and fio job and json files [Default: .].")
+@click.option('-p',
+              '--output-file-prefix',
+              type=str,
+              default='',
+              help="Prefix for output plots filenames [Default: ''].")
+@click.option('-b', '--bs',
+              type=str,
+              multiple=True,
+              default=['4k'],
+              help='fio bs parameter, may be supplied many times [Default: 4k].')
+@click.option('-m', '--mode',
+              type=str,
+              multiple=True,
+              default=['write'],
+              help='fio rw parameter, may be supplied many times [Default: write].')
+@click.option('-r', '--runtime',
+              type=str,
+              default='30',
+              help='fio runtime parameter in seconds [Default: 30].')
+@click.option('-n', '--numjobs',
+              type=int,
+              default=1,
+              help='fio numjobs parameter per client [Default: 1].')
+@click.option('-i', '--iodepth',
+              type=int,
+              default=16,
+              help='fio iodepth parameter [Default: 16].')
+@click.option('-f', '--filesize',
+              type=str,
+              default='2G',
+              help='fio size parameter [Default: 2G].')
+@click.option('--nrfiles',
+              type=int,
+              default=1,
+              help='fio nrfiles parameter [Default: 1].')
+@click.option('-j',
+              '--jobs',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Number of worker processes used to parse fio JSON files and render plots [Default: 1].")
+@click.option('--format', 'plot_format',
+              type=click.Choice(PLOT_FORMATS),
+              default=DEFAULT_PLOT_FORMAT,
+              help="Plot format: full resolution png, low resolution png preview, or vector svg/pdf [Default: png].")
+@click.pass_context
+def aggregate_performance_run(ctx, fio_client, directory, cleanup, outdir, output_file_prefix,
+                              bs, mode, runtime, numjobs, iodepth, filesize, nrfiles, jobs, plot_format):
+    """
+    Use fio client/server mode to test aggregate filesystem performance
+    from 1..N clients, then plot it as aggregate-performance does.
+
+    \b
+    FIO_CLIENT: Host running fio --server, as HOST or HOST,PORT (may be specified many times).
+    """
+
+    # Show help and quit if no clients are specified.
+    if len(fio_client) == 0:
+        click.echo(ctx.get_help())
+        ctx.exit()
+
+    fio_exe = is_exe("fio")
+
+    from .fs_aggregate.run import run_aggregate_fio
+    run_aggregate_fio(fio_exe, fio_client, directory, cleanup, outdir, output_file_prefix,
+                      bs, mode, runtime, numjobs, iodepth, filesize, nrfiles, jobs, plot_format,
+                      ctx.obj['results_db'])
 
 @cli.command()
 @click.argument('block_device', 
@@ -82,19 +302,22 @@ def aggregate_performance(ctx, fio_output_json, outdir, output_file_prefix):
                 type=int)
 @click.option('-c', '--cleanup', 
               is_flag=True, 
-              help="Clean up fio job and output JSON files [Default: no]." )
+              help="Don't write fio job and output JSON files to OUTDIR; jobs are piped to fio and its output read from the pipe [Default: no]." )
 @click.option('-o', '--outdir', 
               type=str, 
               default='.', 
               help="Output directory for plots and fio job and json files [Default: .].")
 @click.option('-b', '--bs',
               type=str,
-              default='8k',
-              help='fio bs parameter [Default: 8k].')
+              multiple=True,
+              default=['8k'],
+              help='fio bs parameter, may be supplied many times to sweep every bs and mode '
+                   'combination in one run [Default: 8k].')
 @click.option('-m', '--mode',
               type=str,
-              default='write',
-              help='fio rw parameter [Default: write].')
+              multiple=True,
+              default=['write'],
+              help='fio rw parameter, may be supplied many times [Default: write].')
 @click.option('-r', '--runtime',
               type=str,
               default='30',
@@ -103,9 +326,59 @@ def aggregate_performance(ctx, fio_output_json, outdir, output_file_prefix):
               type=str,
               default='2G',
               help='fio filesize parameter [Default: 2G].')
+@click.option('-a', '--adaptive',
+              is_flag=True,
+              help="Search for the saturation point on a coarse numjobs grid instead of running every value [Default: no].")
+@click.option('-t', '--saturation-threshold',
+              type=float,
+              default=0.05,
+              help="Minimum relative IOPS gain that still counts as scaling in adaptive mode [Default: 0.05].")
+@click.option('-j',
+              '--jobs',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Number of worker processes used to render plots [Default: 1].")
+@click.option('--format', 'plot_format',
+              type=click.Choice(PLOT_FORMATS),
+              default=DEFAULT_PLOT_FORMAT,
+              help="Plot format: full resolution png, low resolution png preview, or vector svg/pdf [Default: png].")
+@click.option('--steady-state',
+              is_flag=True,
+              help="End each fio step early once IOPS reach steady state; runtime is the upper bound [Default: no].")
+@click.option('--steady-window',
+              type=click.IntRange(min=2),
+              default=5,
+              help="Number of 1s status intervals IOPS must be steady for [Default: 5].")
+@click.option('--steady-tolerance',
+              type=float,
+              default=0.05,
+              help="Maximum relative deviation from the window mean that counts as steady [Default: 0.05].")
+@click.option('--repeat',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Maximum number of trials of each step [Default: 1].")
+@click.option('--shuffle',
+              is_flag=True,
+              help="Run the steps of each round of trials in random order [Default: no].")
+@click.option('--cv-threshold',
+              type=float,
+              default=REPEAT_CV_THRESHOLD,
+              help="Stop repeating a step once the coefficient of variation of its IOPS across trials is below this [Default: 0.05].")
+@click.option('--error-bars',
+              type=click.Choice(ERROR_BARS),
+              default=DEFAULT_ERROR_BARS,
+              help="Error bars drawn on repeated steps: standard deviation or min-max range [Default: std].")
+@click.option('--resume',
+              is_flag=True,
+              help="Skip steps already completed in OUTDIR's checkpoint manifest whose output files are intact [Default: no].")
+@click.option('--dry-run',
+              is_flag=True,
+              help="Print the planned steps, job files and estimated run time and IO volume, then exit without running anything [Default: no].")
 @click.pass_context
 def single_device(ctx, block_device, max_numjobs, cleanup,
-                  outdir, bs, mode, runtime, filesize):
+                  outdir, bs, mode, runtime, filesize, adaptive, saturation_threshold,
+                  jobs, plot_format, steady_state, steady_window, steady_tolerance,
+                  repeat, shuffle, cv_threshold, error_bars, resume, dry_run):
     """
     Use fio to test a single device with multiple jobs.
     
@@ -115,8 +388,12 @@ def single_device(ctx, block_device, max_numjobs, cleanup,
     """
 
     fio_exe = is_exe("fio")
+    from .single_device.run import run_single_device
     run_single_device(fio_exe, block_device, max_numjobs, cleanup, 
-                          outdir, bs, mode, runtime, filesize)
+                          outdir, bs, mode, runtime, filesize,
+                          adaptive, saturation_threshold, plot_format, jobs,
+                          steady_state, steady_window, steady_tolerance, ctx.obj['results_db'],
+                          repeat, shuffle, cv_threshold, error_bars, resume, dry_run)
 
 @cli.command()
 @click.argument('block_device',
@@ -124,19 +401,22 @@ def single_device(ctx, block_device, max_numjobs, cleanup,
                 nargs=-1)
 @click.option('-c', '--cleanup',
               is_flag=True,
-              help="Clean up fio job and output JSON files [Default: no]." )
+              help="Don't write fio job and output JSON files to OUTDIR; jobs are piped to fio and its output read from the pipe [Default: no]." )
 @click.option('-o', '--outdir',
               type=str,
               default='.',
               help="Output directory for plots and fio job and json files [Default: .].")
 @click.option('-b', '--bs',
               type=str,
-              default='8k',
-              help='fio bs parameter [Default: 8k].')
+              multiple=True,
+              default=['8k'],
+              help='fio bs parameter, may be supplied many times to sweep every bs and mode '
+                   'combination in one run [Default: 8k].')
 @click.option('-m', '--mode',
               type=str,
-              default='read',
-              help='fio rw parameter [Default: write].')
+              multiple=True,
+              default=['read'],
+              help='fio rw parameter, may be supplied many times [Default: read].')
 @click.option('-r', '--runtime',
               type=str,
               default='30',
@@ -145,8 +425,60 @@ def single_device(ctx, block_device, max_numjobs, cleanup,
               type=str,
               default='2G',
               help='fio filesize parameter [Default: 2G].')
+@click.option('-j',
+              '--jobs',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Number of worker processes used to render plots [Default: 1].")
+@click.option('--format', 'plot_format',
+              type=click.Choice(PLOT_FORMATS),
+              default=DEFAULT_PLOT_FORMAT,
+              help="Plot format: full resolution png, low resolution png preview, or vector svg/pdf [Default: png].")
+@click.option('--steady-state',
+              is_flag=True,
+              help="End each fio step early once IOPS reach steady state; runtime is the upper bound [Default: no].")
+@click.option('--steady-window',
+              type=click.IntRange(min=2),
+              default=5,
+              help="Number of 1s status intervals IOPS must be steady for [Default: 5].")
+@click.option('--steady-tolerance',
+              type=float,
+              default=0.05,
+              help="Maximum relative deviation from the window mean that counts as steady [Default: 0.05].")
+@click.option('--repeat',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Maximum number of trials of each step [Default: 1].")
+@click.option('--shuffle',
+              is_flag=True,
+              help="Run the steps of each round of trials in random order [Default: no].")
+@click.option('--cv-threshold',
+              type=float,
+              default=REPEAT_CV_THRESHOLD,
+              help="Stop repeating a step once the coefficient of variation of its IOPS across trials is below this [Default: 0.05].")
+@click.option('--error-bars',
+              type=click.Choice(ERROR_BARS),
+              default=DEFAULT_ERROR_BARS,
+              help="Error bars drawn on repeated steps: standard deviation or min-max range [Default: std].")
+@click.option('--resume',
+              is_flag=True,
+              help="Skip steps already completed in OUTDIR's checkpoint manifest whose output files are intact [Default: no].")
+@click.option('--dry-run',
+              is_flag=True,
+              help="Print the planned steps, job files and estimated run time and IO volume, then exit without running anything [Default: no].")
+@click.option('--affinity',
+              type=click.Choice(AFFINITY_MODES),
+              default=DEFAULT_AFFINITY,
+              help="Pin each device's fio jobs to the CPUs and NUMA node local to it (numa), or sweep unpinned and pinned and plot them side by side (compare) [Default: off].")
+@click.option('--sysfs-root',
+              type=click.Path(exists=True, file_okay=False),
+              default=SYSFS_ROOT,
+              hidden=True,
+              help="Where to read device NUMA locality from, for testing placement against a fake sysfs tree.")
 @click.pass_context
-def single_host(ctx, block_device, cleanup, outdir, bs, mode, runtime, filesize):
+def single_host(ctx, block_device, cleanup, outdir, bs, mode, runtime, filesize,
+                jobs, plot_format, steady_state, steady_window, steady_tolerance,
+                repeat, shuffle, cv_threshold, error_bars, resume, dry_run, affinity, sysfs_root):
     """
     Use fio to test all devices on a host.
 
@@ -161,7 +493,92 @@ def single_host(ctx, block_device, cleanup, outdir, bs, mode, runtime, filesize)
 
     fio_exe = is_exe("fio")
 
-    run_single_host(fio_exe, block_device, cleanup, outdir, bs, mode, runtime, filesize)
+    from .single_host.run import run_single_host
+    run_single_host(fio_exe, block_device, cleanup, outdir, bs, mode, runtime, filesize, plot_format, jobs,
+                    steady_state, steady_window, steady_tolerance, ctx.obj['results_db'],
+                    repeat, shuffle, cv_threshold, error_bars, resume, dry_run, affinity, sysfs_root)
+
+@cli.command()
+@click.option('--run-id',
+              type=str,
+              help="Only results from this run.")
+@click.option('-s', '--subcommand',
+              type=str,
+              help="Only results recorded by this subcommand, e.g. single-host.")
+@click.option('-H', '--host',
+              type=str,
+              help="Only results for this host.")
+@click.option('-t', '--target',
+              type=str,
+              help="Only results for this device or client.")
+@click.option('-m', '--mode',
+              type=str,
+              help="Only results for this fio rw mode.")
+@click.option('-b', '--bs',
+              type=str,
+              help="Only results for this block size.")
+@click.option('--since',
+              type=click.DateTime(),
+              help="Only results from this date/time onwards.")
+@click.option('--until',
+              type=click.DateTime(),
+              help="Only results before this date/time.")
+@click.option('-n', '--limit',
+              type=click.IntRange(min=1),
+              help="Maximum number of results to show.")
+@click.option('--format', 'output_format',
+              type=click.Choice(EXPORT_FORMATS),
+              default='table',
+              help="Output format [Default: table].")
+@click.option('-o', '--output',
+              type=click.File('w'),
+              default='-',
+              help="File to export results to [Default: stdout].")
+@click.pass_context
+def results(ctx, run_id, subcommand, host, target, mode, bs, since, until, limit, output_format, output):
+    """
+    Query and export results recorded by previous runs.
+    """
+    from .results_db import export_results, query_results
+    results_db = ctx.obj['results_db']
+    if results_db is None:
+        exit("No results database to query")
+    columns, rows = query_results(
+        results_db, run_id, subcommand, host, target, mode, bs,
+        None if since is None else since.timestamp(),
+        None if until is None else until.timestamp(),
+        limit
+        )
+    export_results(columns, rows, output_format, output)
+
+@cli.command()
+@click.argument('baseline',
+                type=str)
+@click.argument('candidate',
+                type=str)
+@click.option('-t', '--threshold',
+              type=float,
+              default=0.05,
+              help="Minimum relative change in throughput or tail latency that counts as a regression [Default: 0.05].")
+@click.option('--confidence',
+              type=click.FloatRange(min=0, max=1, min_open=True, max_open=True),
+              default=0.95,
+              help="Confidence level of the interval a regression must lie outside of zero [Default: 0.95].")
+@click.pass_context
+def compare(ctx, baseline, candidate, threshold, confidence):
+    """
+    Compare two sets of benchmark results step by step and exit non-zero
+    on any statistically significant throughput or tail latency
+    regression.
+
+    \b
+    BASELINE: Output directory of fio/iperf3 JSON files, or run id(s) in the
+              results database (comma-separated for repeated runs).
+    CANDIDATE: As BASELINE, for the results under test.
+    """
+    from .compare import run_compare
+    if run_compare(baseline, candidate, ctx.obj['results_db'], threshold, confidence):
+        exit(1)
 
 @cli.group()
 @click.pass_context
@@ -175,7 +592,7 @@ def send_file(ctx):
 @click.pass_context
 def server(ctx):
     """
-    Start and stop multiple iperf3 servers.
+    Start and stop multiple iperf3 servers, or a single sink server.
     """
     pass
 
@@ -187,24 +604,35 @@ def server(ctx):
               type=int,
               default=5201,
               help="First iperf3 server port (assumed consecutive after this) [Default: 5201]." )
+@click.option('--sink',
+              is_flag=True,
+              help="Receive on every port in one asyncio process instead of an iperf3 server per port, for --engine sendfile clients [Default: no].")
+@click.option('--control-port',
+              type=int,
+              help="Port on which the sink serves its JSON receive summary, for client --sink-control [Default: PORT_START - 1].")
 @click.pass_context
-def sendfile_server_start(ctx, server_count, port_start):
-    """Start a series of iperf3 servers listening on consecutive ports.
+def sendfile_server_start(ctx, server_count, port_start, sink, control_port):
+    """Start a series of iperf3 servers listening on consecutive ports,
+    and wait until every one of them accepts connections.
 
     \b
-    SERVER_COUNT: Number of iperf3 servers to start.
+    SERVER_COUNT: Number of iperf3 servers (or sink ports) to start.
     """
-    iperf_exe = is_exe("iperf3")
-    run_sendfile_server(iperf_exe, server_count, port_start)
+    # The sink is part of this package and needs no iperf3
+    iperf_exe = None if sink else is_exe("iperf3")
+    from .send_file.runserver import run_sendfile_server
+    run_sendfile_server(iperf_exe, server_count, port_start, sink, control_port)
 
 @server.command('stop')
 @click.pass_context
 def sendfile_server_start(ctx):
     """
     \b
-    Stop iperf3 servers started by
+    Stop iperf3 or sink servers started by
     ceph-perftest sendfile server start
+    with SIGTERM, killing any still running after 5s.
     """
+    from .send_file.runserver import stop_sendfile_server
     stop_sendfile_server()
 
 @send_file.command('client')
@@ -231,8 +659,37 @@ def sendfile_server_start(ctx):
 @click.option('-n', '--network-line-rate',
               type=int,
               help="Network line rate in Gbit" )
+@click.option('--format', 'plot_format',
+              type=click.Choice(PLOT_FORMATS),
+              default=DEFAULT_PLOT_FORMAT,
+              help="Plot format: full resolution png, low resolution png preview, or vector svg/pdf [Default: png].")
+@click.option('--resume',
+              is_flag=True,
+              help="Skip steps already completed in OUTDIR's checkpoint manifest whose output files are intact [Default: no].")
+@click.option('--dry-run',
+              is_flag=True,
+              help="Print the planned steps, job files and estimated run time and IO volume, then exit without running anything [Default: no].")
+@click.option('-e', '--engine',
+              type=click.Choice(ENGINES),
+              default=DEFAULT_ENGINE,
+              help="Stream each device with an iperf3 client, or natively with os.sendfile into a TCP socket [Default: iperf3].")
+@click.option('--chunk-size',
+              type=click.IntRange(min=4096),
+              default=DEFAULT_CHUNK_SIZE,
+              help="Bytes per sendfile call with --engine sendfile [Default: 4194304].")
+@click.option('--loopback',
+              is_flag=True,
+              help="Receive the sendfile streams in-process on 127.0.0.1 instead of at IPERF_SERVER [Default: no].")
+@click.option('--sink-control',
+              type=int,
+              help="Control port of a sink server at IPERF_SERVER; save its receive summary after each device count [Default: none].")
+@click.option('-O', '--omit',
+              type=click.IntRange(min=0),
+              default=0,
+              help="Seconds of warm-up (TCP slow start, readahead ramp) to leave out of each stream's bandwidth; the timeline plots still show them [Default: 0].")
 @click.pass_context
-def sendfile_client(ctx, iperf_server, block_device, port_start, cleanup, outdir, runtime, network_line_rate):
+def sendfile_client(ctx, iperf_server, block_device, port_start, cleanup, outdir, runtime, network_line_rate, plot_format,
+                    resume, dry_run, engine, chunk_size, loopback, sink_control, omit):
     """Plot the aggregated network read bandwidth of a set
     of block devices using iperf3.
 
@@ -250,7 +707,10 @@ def sendfile_client(ctx, iperf_server, block_device, port_start, cleanup, outdir
         click.echo(ctx.get_help())
         ctx.exit()
     
-    iperf_exe = is_exe("iperf3")
+    # The sendfile engine streams in-process and needs no iperf3
+    iperf_exe = is_exe("iperf3") if engine == 'iperf3' else None
     
-    run_sendfile_client(iperf_exe, iperf_server, block_device, port_start, cleanup, outdir, runtime, network_line_rate)
+    from .send_file.runclient import run_sendfile_client
+    run_sendfile_client(iperf_exe, iperf_server, block_device, port_start, cleanup, outdir, runtime, network_line_rate, plot_format,
+                        ctx.obj['results_db'], resume, dry_run, engine, chunk_size, loopback, sink_control, omit)
 
@@ -0,0 +1,308 @@
+import json
+from pathlib import Path
+import re
+import sys
+import ijson
+import numpy as np
+from binary import BinaryUnits, DecimalUnits, convert_units
+from .latency import merge_bins, stats_bins
+from .fio_json import load_fio_output
+from .results_db import query_results
+
+# Throughput metrics regress when they drop, tail latency when it rises.
+COMPARE_METRICS = [
+    {'name': 'bw', 'label': 'bw (MB/s)', 'higher_is_better': True},
+    {'name': 'iops', 'label': 'iops', 'higher_is_better': True},
+    {'name': 'p99', 'label': 'p99 (us)', 'higher_is_better': False, 'percentile': 99},
+    {'name': 'p99.99', 'label': 'p99.99 (us)', 'higher_is_better': False, 'percentile': 99.99},
+    ]
+
+REGRESSION_THRESHOLD = 0.05
+CONFIDENCE = 0.95
+BOOTSTRAP_SAMPLES = 2000
+
+# Companion files written next to fio output, not results in their own right
+SKIP_SUFFIXES = ['.status.json', '.telemetry.json']
+
+# Repeated steps (--repeat) write one output per trial, named like the
+# step's single output with this before the extensions
+TRIAL_SUFFIX = '-trial\\d+(?=\\.)'
+
+def new_step():
+    return {'samples': {}, 'bins': None}
+
+def fio_step(jsonfile):
+    """
+    Step totals from a fio json/json+ output file: bw and iops samples
+    from the per-interval status series written alongside it when there
+    is one (otherwise the single final figure), plus the merged clat
+    histogram for tail latency.
+    """
+    data = load_fio_output(jsonfile, latency_bins=True)
+    stats = [i for i in data.get('client_stats', []) if i['jobname'] != 'All clients']
+    if not stats:
+        stats = data.get('jobs', [])
+    step = new_step()
+    bw, _ = convert_units(
+        sum(i[io_type]['bw'] for i in stats for io_type in ['read', 'write']),
+        unit=BinaryUnits.KB,
+        to=DecimalUnits.MB
+        )
+    step['samples']['bw'] = [bw]
+    step['samples']['iops'] = [
+        sum(i[io_type]['iops'] for i in stats for io_type in ['read', 'write'])
+        ]
+
+    status_fn = Path(str(jsonfile).replace('.output.json', '.status.json'))
+    if status_fn != Path(jsonfile) and status_fn.exists():
+        with open(status_fn) as f:
+            series = json.load(f)
+        if len(series) > 1:
+            step['samples']['bw'] = [i['bw'] for i in series]
+            step['samples']['iops'] = [i['iops'] for i in series]
+
+    latencies, counts = merge_bins(stats_bins(stats, 'read') + stats_bins(stats, 'write'))
+    if counts.sum() > 0:
+        step['bins'] = (latencies / 1000, counts.astype(np.int64))
+    return step
+
+def iperf_step(data):
+    step = new_step()
+    step['samples']['bw'] = [
+        i['sum']['bits_per_second'] / 8000000 for i in data.get('intervals', [])
+        ] or [data['end']['sum_sent']['bits_per_second'] / 8000000]
+    return step
+
+def output_type(jsonfile):
+    """
+    'fio' or 'iperf3' from the top-level keys of a JSON output file, or
+    None for anything else. Reading stops as soon as fio's stats start,
+    so a large json+ output is only parsed in full by fio_step.
+    """
+    keys = set()
+    try:
+        with open(jsonfile, 'rb') as f:
+            for prefix, event, value in ijson.parse(f):
+                if prefix != '':
+                    continue
+                if event == 'map_key':
+                    if value in ['jobs', 'client_stats']:
+                        return 'fio'
+                    keys.add(value)
+                elif event != 'start_map' and event != 'end_map':
+                    return None
+    except ijson.JSONError:
+        return None
+    if 'end' in keys and 'error' not in keys:
+        return 'iperf3'
+    return None
+
+def pool_step(step, trial):
+    """
+    Add the samples and clat histogram of another trial of a step to it.
+    """
+    for name, samples in trial['samples'].items():
+        step['samples'].setdefault(name, []).extend(samples)
+    if trial['bins'] is None:
+        return
+    if step['bins'] is None:
+        step['bins'] = trial['bins']
+        return
+    latencies, inverse = np.unique(
+        np.concatenate([step['bins'][0], trial['bins'][0]]), return_inverse=True
+        )
+    counts = np.bincount(inverse, weights=np.concatenate([step['bins'][1], trial['bins'][1]]))
+    step['bins'] = (latencies, counts.astype(np.int64))
+
+def load_directory(outdir):
+    """
+    Steps from every fio or iperf3 JSON output in outdir, keyed by file
+    name so that the same step lines up across two output directories.
+    The trials of a repeated step are pooled into one step.
+    """
+    steps = {}
+    for jsonfile in sorted(Path(outdir).glob('*.json')):
+        if any(jsonfile.name.endswith(i) for i in SKIP_SUFFIXES):
+            continue
+        kind = output_type(jsonfile)
+        if kind == 'fio':
+            try:
+                step = fio_step(jsonfile)
+            except ijson.JSONError:
+                # Truncated by an interrupted run
+                continue
+        elif kind == 'iperf3':
+            # iperf3 output is small enough to load whole
+            with open(jsonfile) as f:
+                step = iperf_step(json.load(f))
+        else:
+            continue
+        key = re.sub(TRIAL_SUFFIX, '', jsonfile.name)
+        if key in steps:
+            pool_step(steps[key], step)
+        else:
+            steps[key] = step
+    return steps
+
+def load_runs(results_db, run_ids):
+    """
+    Steps from runs stored in the results database, keyed by what was
+    measured. Each run contributes one sample per step, so repeated runs
+    on either side give the spread.
+    """
+    steps = {}
+    for run_id in run_ids:
+        columns, rows = query_results(results_db, run_id=run_id)
+        if not rows:
+            sys.exit("No results for run {run_id} in {results_db}".format(
+                run_id=run_id,
+                results_db=results_db
+                )
+            )
+        for row in rows:
+            row = dict(zip(columns, row))
+            key = "{subcommand} {target} {mode} bs={bs} numjobs={numjobs} count={count}".format(**row)
+            step = steps.setdefault(key, new_step())
+            for metric in COMPARE_METRICS:
+                value = row.get(metric['name'].replace('.', '_'))
+                if value is not None:
+                    step['samples'].setdefault(metric['name'], []).append(value)
+    return steps
+
+def bootstrap_means(samples, rng, n=BOOTSTRAP_SAMPLES):
+    samples = np.asarray(samples, dtype=float)
+    return samples[rng.integers(0, len(samples), size=(n, len(samples)))].mean(axis=1)
+
+def bootstrap_percentile(bins, percentile, rng, n=BOOTSTRAP_SAMPLES):
+    """
+    Percentile of n histograms resampled from bins, giving the sampling
+    uncertainty of a tail latency estimated from a single run.
+    """
+    latencies, counts = bins
+    total = counts.sum()
+    draws = rng.multinomial(total, counts / total, size=n).cumsum(axis=1)
+    idx = (draws >= percentile / 100 * total).argmax(axis=1)
+    return latencies[idx]
+
+def metric_draws(step, metric, rng):
+    """
+    Point estimate and bootstrap draws for metric in step, or None if
+    there are too few samples to estimate its spread.
+    """
+    if 'percentile' in metric and step['bins'] is not None:
+        draws = bootstrap_percentile(step['bins'], metric['percentile'], rng)
+        latencies, counts = step['bins']
+        cumulative = counts.cumsum()
+        estimate = latencies[
+            min(np.searchsorted(cumulative, metric['percentile'] / 100 * cumulative[-1]), len(latencies) - 1)
+            ]
+        return float(estimate), draws
+    samples = step['samples'].get(metric['name'], [])
+    if len(samples) < 2:
+        return (samples[0] if samples else None), None
+    return float(np.mean(samples)), bootstrap_means(samples, rng)
+
+def compare_steps(baseline, candidate, threshold=REGRESSION_THRESHOLD, confidence=CONFIDENCE,
+                  metrics=COMPARE_METRICS, seed=0):
+    """
+    Relative change of each metric for every step present in both
+    baseline and candidate, with a bootstrap confidence interval.
+
+    A change is a regression when it is worse than threshold and its
+    whole confidence interval lies on the worse side of zero.
+    """
+    rng = np.random.default_rng(seed)
+    tail = (1 - confidence) / 2 * 100
+    comparisons = []
+    for key in [i for i in baseline if i in candidate]:
+        for metric in metrics:
+            base, base_draws = metric_draws(baseline[key], metric, rng)
+            cand, cand_draws = metric_draws(candidate[key], metric, rng)
+            if base is None or cand is None or base == 0:
+                continue
+            comparison = {
+                'step': key,
+                'metric': metric['label'],
+                'baseline': base,
+                'candidate': cand,
+                'delta': cand / base - 1,
+                'low': None,
+                'high': None,
+                'regression': False,
+                'improvement': False
+                }
+            if base_draws is not None and cand_draws is not None:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    deltas = cand_draws / base_draws - 1
+                deltas = deltas[np.isfinite(deltas)]
+                if len(deltas):
+                    low, high = np.percentile(deltas, [tail, 100 - tail])
+                    comparison['low'] = float(low)
+                    comparison['high'] = float(high)
+                    worse = -comparison['delta'] if metric['higher_is_better'] else comparison['delta']
+                    if metric['higher_is_better']:
+                        worse_ci = high < 0
+                        better_ci = low > 0
+                    else:
+                        worse_ci = low > 0
+                        better_ci = high < 0
+                    comparison['regression'] = bool(worse > threshold and worse_ci)
+                    comparison['improvement'] = bool(-worse > threshold and better_ci)
+            comparisons.append(comparison)
+    return comparisons
+
+def print_comparisons(comparisons, baseline, candidate):
+    only_baseline = [i for i in baseline if i not in candidate]
+    only_candidate = [i for i in candidate if i not in baseline]
+    rows = [['step', 'metric', 'baseline', 'candidate', 'delta', 'CI', '']]
+    for i in comparisons:
+        rows.append([
+            i['step'],
+            i['metric'],
+            '{value:.2f}'.format(value=i['baseline']),
+            '{value:.2f}'.format(value=i['candidate']),
+            '{delta:+.1%}'.format(delta=i['delta']),
+            'n/a' if i['low'] is None else '[{low:+.1%}, {high:+.1%}]'.format(low=i['low'], high=i['high']),
+            'REGRESSION' if i['regression'] else 'improved' if i['improvement'] else ''
+            ])
+    widths = [max(len(row[idx]) for row in rows) for idx in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+    if only_baseline or only_candidate:
+        print("\nUnmatched steps: {baseline} only in baseline, {candidate} only in candidate".format(
+            baseline=len(only_baseline),
+            candidate=len(only_candidate)
+            )
+        )
+    regressions = [i for i in comparisons if i['regression']]
+    print("\n{regressions} significant regression(s) in {steps} matched step(s)".format(
+        regressions=len(regressions),
+        steps=len(set(i['step'] for i in comparisons))
+        )
+    )
+    return regressions
+
+def load_results(source, results_db):
+    """
+    Steps from an output directory, or from a comma-separated list of
+    run ids in the results database.
+    """
+    if Path(source).is_dir():
+        return load_directory(source)
+    if results_db is None:
+        sys.exit("{source} is not a directory and there is no results database".format(
+            source=source
+            )
+        )
+    return load_runs(results_db, source.split(','))
+
+def run_compare(baseline, candidate, results_db=None, threshold=REGRESSION_THRESHOLD,
+                confidence=CONFIDENCE):
+    """
+    Compare two result sets; returns True if the candidate has any
+    statistically significant regression.
+    """
+    baseline_steps = load_results(baseline, results_db)
+    candidate_steps = load_results(candidate, results_db)
+    comparisons = compare_steps(baseline_steps, candidate_steps, threshold, confidence)
+    return bool(print_comparisons(comparisons, baseline_steps, candidate_steps))
@@ -0,0 +1,49 @@
+import re
+import shlex
+import textwrap
+
+# fio reads its job file from stdin when it is named '-'
+STDIN_JOB = '-'
+
+def render_section(template, **values):
+    """
+    Job file lines for one section (or [global]) from a template of
+    format strings such as GLOBAL_CONFIG or DEVICE_CONFIG.
+    """
+    return [line.format(**values) for line in template]
+
+def render_job_config(template, config, jobname):
+    """
+    Job file for one fio client from a template with a single job
+    section named {jobname}, such as the aggregate and mixed IO
+    GLOBAL_CONFIG, filled in from config.
+    """
+    return textwrap.dedent(template).lstrip().format(jobname=jobname, **config)
+
+def client_jobname(host):
+    # fio client specs may carry a port ("host,8765"); keep job (and so
+    # file) names unique per client on a shared filesystem.
+    return re.sub('[^A-Za-z0-9]+', '-', host)
+
+def job_text(lines):
+    return ''.join(line + '\n' for line in lines)
+
+def write_job_file(fn, lines):
+    with open(fn, 'w') as f:
+        f.write(job_text(lines))
+
+def fio_command(fio_exe, options=None, job_fn=STDIN_JOB):
+    """
+    fio command line for a job file, by default the job piped to fio on
+    stdin, with json+ output.
+    """
+    return [fio_exe] + list(options or []) + [str(job_fn), '--output-format=json+']
+
+def format_command(fio_cmd, job_fn=None):
+    """
+    fio_cmd for printing, showing where a job on stdin comes from.
+    """
+    command = shlex.join(str(i) for i in fio_cmd)
+    if job_fn is not None and STDIN_JOB in fio_cmd:
+        command += ' < {job_fn}'.format(job_fn=job_fn)
+    return command
@@ -0,0 +1,83 @@
+from concurrent.futures import ProcessPoolExecutor
+import ijson
+from .results_cache import cache_key, cache_get, cache_put, cache_evict
+
+# Per-client/per-job fields we read from fio output. Everything else
+# (notably the json+ clat_ns bins, unless asked for) is skipped while
+# parsing so it never makes it into memory.
+STATS_SECTIONS = ['client_stats', 'jobs']
+STATS_FIELDS = ['hostname', 'jobname']
+STATS_IO_TYPES = ['read', 'write']
+TOP_LEVEL_FIELDS = ['timestamp']
+
+def _keep(path, latency_bins):
+    if path == '':
+        return True
+    if path in TOP_LEVEL_FIELDS:
+        return True
+    parts = path.split('.')
+    if parts[0] == 'global options':
+        return True
+    if parts[0] not in STATS_SECTIONS:
+        return False
+    # The stats array itself and each of its items
+    if len(parts) <= 2:
+        return True
+    if parts[2] in STATS_FIELDS:
+        return len(parts) == 3
+    if parts[2] in STATS_IO_TYPES:
+        return latency_bins or 'bins' not in parts[3:]
+    return False
+
+def load_fio_output(jsonfile, latency_bins=False):
+    """
+    Incrementally parse a fio json/json+ output file, keeping only the
+    run timestamp, 'global options' and the hostname, jobname, read and
+    write entries of 'client_stats' and 'jobs'. Latency histogram bins are dropped
+    unless latency_bins is set.
+    """
+    builder = ijson.ObjectBuilder()
+    with open(jsonfile, 'rb') as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if event == 'map_key':
+                path = prefix + '.' + value if prefix else value
+            else:
+                path = prefix
+            if _keep(path, latency_bins):
+                builder.event(event, value)
+    return builder.value
+
+def map_fio_outputs(func, fio_output_json, jobs=1, cache_dir=None):
+    """
+    Apply func to each fio output file, using a pool of jobs worker
+    processes when jobs > 1. Results are returned in input order.
+
+    func must return a list of flat records. If cache_dir is given,
+    results for unchanged files are read from the cache there instead
+    of being parsed again.
+    """
+    namespace = func.__module__ + '.' + func.__name__
+    results = [None] * len(fio_output_json)
+    keys = [None] * len(fio_output_json)
+    if cache_dir is not None:
+        for idx, jsonfile in enumerate(fio_output_json):
+            keys[idx] = cache_key(namespace, jsonfile)
+            results[idx] = cache_get(cache_dir, keys[idx])
+
+    todo = [idx for idx, result in enumerate(results) if result is None]
+    files = [fio_output_json[idx] for idx in todo]
+    if jobs <= 1 or len(files) <= 1:
+        parsed = [func(jsonfile) for jsonfile in files]
+    else:
+        chunksize = max(1, len(files) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            parsed = list(pool.map(func, files, chunksize=chunksize))
+
+    for idx, result in zip(todo, parsed):
+        results[idx] = result
+        if cache_dir is not None:
+            cache_put(cache_dir, keys[idx], result)
+    if cache_dir is not None and todo:
+        cache_evict(cache_dir)
+
+    return results
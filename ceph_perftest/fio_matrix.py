@@ -0,0 +1,66 @@
+import sys
+
+# Joins the block sizes or modes of a matrix run in file names
+MATRIX_SEPARATOR = '+'
+
+def combinations(bs, mode):
+    """
+    Every (bs, mode) combination of a sweep, block size major. bs and
+    mode may each be a single value or a sequence of values.
+    """
+    if isinstance(bs, str):
+        bs = [bs]
+    if isinstance(mode, str):
+        mode = [mode]
+    return [(b, m) for b in bs for m in mode]
+
+def matrix_name(values):
+    return MATRIX_SEPARATOR.join(dict.fromkeys(values))
+
+def io_type(mode):
+    """
+    The read or write section of fio's output that holds mode's results.
+    """
+    if mode == 'randread':
+        return 'read'
+    if mode == 'randwrite':
+        return 'write'
+    return mode
+
+def section_name(name, combo, combos):
+    """
+    Job section name for one combination, unchanged when there is only
+    one so that single-combination job files look as they always have.
+    """
+    if len(combos) == 1:
+        return name
+    bs, mode = combo
+    return '{name}-{mode}-{bs}'.format(name=name, mode=mode, bs=bs)
+
+def section_options(combos, combo_idx, section_idx=0):
+    """
+    Extra options for the section_idx'th section of the combo_idx'th
+    combination in a matrix job file: its block size and, on the first
+    section of every combination after the first, a stonewall so that
+    each combination runs on its own, back-to-back in one fio process.
+    """
+    if len(combos) == 1:
+        return []
+    options = ['bs={bs}'.format(bs=combos[combo_idx][0])]
+    if combo_idx > 0 and section_idx == 0:
+        options.append('stonewall')
+    return options
+
+def check_matrix(combos, **single_only):
+    """
+    Exit if an option that needs one fio process per combination is
+    used with more than one combination.
+    """
+    if len(combos) == 1:
+        return
+    for option, value in single_only.items():
+        if value:
+            sys.exit("--{option} needs a single --bs and --mode".format(
+                option=option.replace('_', '-')
+                )
+            )
@@ -0,0 +1,136 @@
+import json
+import signal
+import subprocess
+import time
+
+STATUS_INTERVAL = 1
+
+# A step is steady once the last STEADY_WINDOW interval IOPS samples all
+# lie within STEADY_TOLERANCE (relative) of their mean.
+STEADY_WINDOW = 5
+STEADY_TOLERANCE = 0.05
+
+# fio pretty-prints its JSON, so only the closing brace of a top-level
+# object sits at the start of a line.
+JSON_OBJECT_END = b"\n}\n"
+
+def iter_json_stream(stream):
+    """
+    Yield each JSON object from a binary stream of concatenated fio JSON
+    status reports as soon as it is complete, skipping any non-JSON
+    lines fio prints between them.
+    """
+    buf = bytearray()
+    # Where to resume looking for the end of an object, so that each
+    # byte is only scanned once however many reads an object spans
+    scan = 0
+    while True:
+        chunk = stream.read1(65536)
+        if not chunk:
+            break
+        buf += chunk
+        while True:
+            end = buf.find(JSON_OBJECT_END, scan)
+            if end == -1:
+                # The end marker may straddle this read and the next
+                scan = max(0, len(buf) - len(JSON_OBJECT_END) + 1)
+                break
+            stop = end + len(JSON_OBJECT_END)
+            start = buf.find(b'{', 0, end)
+            data = None
+            if start != -1:
+                try:
+                    data = json.loads(buf[start:stop])
+                except ValueError:
+                    pass
+            del buf[:stop]
+            scan = 0
+            if data is not None:
+                yield data
+
+def status_totals(data, io_type):
+    """
+    Bytes and IOs done so far over every job, for io_type ('read' or
+    'write') or a list of them.
+    """
+    io_types = [io_type] if isinstance(io_type, str) else io_type
+    jobs = data.get('jobs', [])
+    return (
+        sum(i[t]['io_bytes'] for i in jobs for t in io_types),
+        sum(i[t]['total_ios'] for i in jobs for t in io_types)
+        )
+
+def is_steady(values, window=STEADY_WINDOW, tolerance=STEADY_TOLERANCE):
+    if len(values) < window:
+        return False
+    recent = values[-window:]
+    mean = sum(recent) / window
+    if mean <= 0:
+        return False
+    return max(abs(i - mean) for i in recent) <= tolerance * mean
+
+def run_fio_streaming(fio_cmd, output_fn, io_type, steady_state=False,
+                      steady_window=STEADY_WINDOW, steady_tolerance=STEADY_TOLERANCE, job=None):
+    """
+    Run fio_cmd (without --output) with periodic JSON status on stdout,
+    building a per-interval bandwidth (MB/s) and IOPS time series as it
+    runs. With steady_state set, fio is interrupted once IOPS have been
+    steady for steady_window intervals; the job runtime is the upper
+    bound either way. job is the job file text for fio_cmd to read on
+    stdin, if any. fio's final report is written to output_fn unless it
+    is None.
+
+    Returns the time series, whether steady state ended the step and
+    fio's final report.
+    """
+    proc = subprocess.Popen(
+        fio_cmd + ['--status-interval={interval}'.format(interval=STATUS_INTERVAL)],
+        stdin=subprocess.DEVNULL if job is None else subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+        )
+    if job is not None:
+        # fio reads the whole job file before it starts any IO
+        try:
+            proc.stdin.write(job.encode())
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+    start = time.monotonic()
+    series = []
+    final = None
+    previous = None
+    steady = False
+    for data in iter_json_stream(proc.stdout):
+        final = data
+        now = time.monotonic() - start
+        io_bytes, total_ios = status_totals(data, io_type)
+        if previous is not None:
+            elapsed = now - previous[0]
+            # fio's final report can land straight after a status report;
+            # too short an interval only adds noise.
+            if elapsed < STATUS_INTERVAL / 2:
+                continue
+            series.append(
+                {
+                    'time': round(now, 3),
+                    'bw': (io_bytes - previous[1]) / elapsed / 1000 / 1000,
+                    'iops': (total_ios - previous[2]) / elapsed
+                }
+            )
+        previous = (now, io_bytes, total_ios)
+
+        if steady_state and not steady and proc.poll() is None and is_steady(
+                # The first interval includes ramp-up, so leave it out
+                [i['iops'] for i in series[1:]], steady_window, steady_tolerance):
+            print("Steady state reached after {time:.0f}s".format(time=now))
+            steady = True
+            # fio finishes the step and prints its final report on SIGINT
+            proc.send_signal(signal.SIGINT)
+    proc.wait()
+
+    if final is not None and output_fn is not None:
+        with open(output_fn, 'w') as f:
+            json.dump(final, f)
+
+    return series, steady, final
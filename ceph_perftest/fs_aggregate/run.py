@@ -1,8 +1,16 @@
-import json
 import matplotlib.pyplot as plt
 from pathlib import Path, PurePath
+import subprocess
 import sys
+import time
 from binary import BinaryUnits, DecimalUnits, convert_units
+from ..fio_job import client_jobname, render_job_config
+from ..fio_json import load_fio_output, map_fio_outputs
+from ..results_cache import cache_dir_for
+from ..latency import PERCENTILES, clat_percentiles, percentile_name, plot_latency, stats_bins
+from ..aggregate import pivot, stack_bottoms
+from ..render import DEFAULT_PLOT_FORMAT, render_plots, save_figure
+from ..results_db import latency_columns, record_run
 
 PLOTS = [
         {
@@ -19,6 +27,8 @@ PLOTS = [
 	}
         ]
 
+LATENCY_TITLE = "Multiple Clients\nCompletion Latency\nmode: {mode}, BS: {bs}\nclient threads: {threads}"
+
 RW_LOOKUP = {
             'randwrite': 'write',
             'randread' : 'read',
@@ -36,7 +46,7 @@ GLOBAL_CONFIG = """
     group_reporting
     runtime={runtime}
     numjobs={numjobs}
-    rw={mode}
+    rw={rw}
     size={size}
     directory={directory}
     nrfiles={nrfiles}
@@ -63,82 +73,144 @@ def generate_fio_configs(bs, iodepth, direct, ioengine, runtime, numjobs, rw, si
             )
     return fio_configs
 
-def slurp_fio_output(fio_output_json):   
+def slurp_fio_file(jsonfile):
+    """
+    A row per client in a fio output file, each carrying the completion
+    latency percentiles over all of the file's clients so that the file
+    is parsed (and cached) once for both.
+    """
     results_summary = []
-    all_hosts = []
-    for jsonfile in fio_output_json:
-        f = open(jsonfile, "r")
-        data = json.load(f)
-        clients = [ i for i in data['client_stats'] if i['jobname'] != "All clients" ]
-        
-        rw = RW_LOOKUP.get(data['global options']['rw'])
-        if rw == None:
-            print("Unsupported rw mode")
-            sys.exit(1)
-
-        n_clients = len(clients)
-        for client in clients:
-                bw, _ = convert_units(
-                    int(client[rw]['bw']),
-                    unit=BinaryUnits.KB, 
-                    to=DecimalUnits.MB
-                    )
-                results_summary.append(
-                    {
-                        'count': n_clients,
-                        'hostname': client['hostname'],
-                        'bw': bw,
-                        'iops': int(client[rw]['iops']),
-                        'numjobs': data['global options']['numjobs'],
-                        'bs': data['global options']['bs'],
-                        'rw': data['global options']['rw']
-                    }
-                )
-                if client['hostname'] not in all_hosts:
-                    all_hosts.append(client['hostname'])
+    data = load_fio_output(jsonfile, latency_bins=True)
+    clients = [ i for i in data['client_stats'] if i['jobname'] != "All clients" ]
+
+    rw = RW_LOOKUP.get(data['global options']['rw'])
+    if rw == None:
+        print("Unsupported rw mode")
+        sys.exit(1)
+
+    latency = clat_percentiles(stats_bins(clients, rw))
+    n_clients = len(clients)
+    for client in clients:
+        bw, _ = convert_units(
+            int(client[rw]['bw']),
+            unit=BinaryUnits.KB, 
+            to=DecimalUnits.MB
+            )
+        results_summary.append(
+            {
+                'count': n_clients,
+                'hostname': client['hostname'],
+                'bw': bw,
+                'iops': int(client[rw]['iops']),
+                'numjobs': data['global options']['numjobs'],
+                'bs': data['global options']['bs'],
+                'rw': data['global options']['rw'],
+                'iodepth': data['global options'].get('iodepth'),
+                'timestamp': data.get('timestamp')
+            }
+        )
+        results_summary[-1].update(latency)
+
+    return results_summary
+
+def file_latency(file_summaries):
+    """
+    The latency record of each fio output file from its client rows.
+    """
+    return [
+        dict(
+            {'count': file_summary[0]['count']},
+            **{percentile_name(p): file_summary[0][percentile_name(p)] for p in PERCENTILES}
+            )
+        for file_summary in file_summaries if file_summary
+        ]
+
+def pad_fio_summary(file_summaries):
+    """
+    Combine per-file client rows, adding zero rows for clients that were
+    not active at each client count.
+    """
+    results_summary = []
+    # Insertion-ordered set of hosts
+    all_hosts = {}
+    for file_summary in file_summaries:
+        for client in file_summary:
+            results_summary.append(client)
+            all_hosts[client['hostname']] = None
+    seen = set((i['count'], i['hostname']) for i in results_summary)
     for count in range(1, 1+len(all_hosts)):
-        count_hosts = [i['hostname'] for i in results_summary if i['count'] == count]
         for host in all_hosts:
-            if host not in count_hosts:
+            if (count, host) not in seen:
                 results_summary.append(
                     {
                         'count': count,
                         'hostname': host,
                         'bw': 0,
                         'iops': 0,
-                        'numjobs': data['global options']['numjobs'],
-                        'bs': data['global options']['bs'],
-                        'rw': data['global options']['rw']
+                        'numjobs': results_summary[-1]['numjobs'],
+                        'bs': results_summary[-1]['bs'],
+                        'rw': results_summary[-1]['rw']
                     }
                 )
 
     return sorted(results_summary, key=lambda k: (k['count'], k['hostname']))
 
-def plot_bar(summary, outdir, output_file_prefix, plot):
-    all_hosts = set([i['hostname'] for i in summary])
-    labels = [str(i) for i in range(1, len(all_hosts) + 1)]
+def slurp_fio_output(fio_output_json, jobs=1, cache_dir=None):
+    return pad_fio_summary(
+        map_fio_outputs(slurp_fio_file, fio_output_json, jobs, cache_dir)
+        )
+
+def results_rows(file_summaries, latency):
+    """
+    Results database rows for the clients active in each fio output,
+    with that run's latency percentiles.
+    """
+    latency = {i['count']: latency_columns(i) for i in latency}
+    rows = []
+    for file_summary in file_summaries:
+        for client in file_summary:
+            row = {
+                'host': client['hostname'],
+                'target': client['hostname'],
+                'mode': client['rw'],
+                'bs': client['bs'],
+                'numjobs': client['numjobs'],
+                'iodepth': client['iodepth'],
+                'count': client['count'],
+                'bw': client['bw'],
+                'iops': client['iops'],
+                'timestamp': client['timestamp']
+                }
+            row.update(latency.get(client['count'], {}))
+            rows.append(row)
+    return rows
+
+def plot_bar(summary, outdir, output_file_prefix, plot, plot_format=DEFAULT_PLOT_FORMAT):
+    all_hosts = list(dict.fromkeys(i['hostname'] for i in summary))
+    counts, _, values = pivot(
+        summary, 'hostname', plot['varname'], all_hosts,
+        list(range(1, len(all_hosts) + 1))
+        )
+    labels = [str(i) for i in counts]
     fig, ax = plt.subplots()
-    cum_size = [0] * len(all_hosts)
+    bottoms = stack_bottoms(values)
     
-    for host in all_hosts:
-        values = [i[plot['varname']] for i in summary if i['hostname'] == host]
-        ax.bar(labels, values, bottom=cum_size, width=0.9, label=host)
-
-        for a in range(len(cum_size)):
-            cum_size[a] += values[a]
+    for idx, host in enumerate(all_hosts):
+        ax.bar(labels, values[:, idx], bottom=bottoms[:, idx], width=0.9, label=host)
 
     client_threads = summary[0]['numjobs']
     bs = summary[0]['bs']
     rw = summary[0]['rw']
 
+    # Totals per client count, truncating each client's value as before
+    total_bw = pivot(summary, 'hostname', 'bw', all_hosts, counts)[2].astype(int).sum(axis=1)
+    total_iops = pivot(summary, 'hostname', 'iops', all_hosts, counts)[2].astype(int).sum(axis=1)
     max_perf = {'clients': 0, 'bw': 0, 'iops': 0}
-    for k in range(1, len(all_hosts)):
-        total_bw = sum([int(i['bw']) for i in summary if i['count'] == k])
-        total_iops = sum([int(i['iops']) for i in summary if i['count'] == k])
-        if total_bw > max_perf['bw']:
-            max_perf['bw'] = total_bw
-            max_perf['clients'] = k
-            max_perf['iops'] = total_iops
+    if len(counts) and total_bw.max() > 0:
+        best = int(total_bw.argmax())
+        max_perf['bw'] = int(total_bw[best])
+        max_perf['clients'] = counts[best]
+        max_perf['iops'] = int(total_iops[best])
 
     ax.tick_params(axis='x', which='major', labelsize=4)
     ax.set_title(plot['title'].format(
@@ -152,7 +224,8 @@ def plot_bar(summary, outdir, output_file_prefix, plot):
     ax.set_ylabel(plot['y_label'])
     ax.set_xlabel('Clients active')
     ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
-    fig.savefig(
+    save_figure(
+        fig,
         PurePath(
             outdir
             ).joinpath(
@@ -162,9 +235,8 @@ def plot_bar(summary, outdir, output_file_prefix, plot):
                 name=plot['name'],
                 bs=bs
                 )
-            ), 
-            dpi=1000, 
-            bbox_inches='tight'
+            ),
+        plot_format
         )
 
     
@@ -175,8 +247,122 @@ def make_output_directory(outdir):
 
     return p
 
-def run_aggregate_performance(fio_output_json, outdir, output_file_prefix):
+def run_aggregate_performance(fio_output_json, outdir, output_file_prefix, jobs=1, no_cache=False,
+                              plot_format=DEFAULT_PLOT_FORMAT, results_db=None):
+    started = time.time()
     outdir = make_output_directory(outdir)
-    summary = slurp_fio_output(fio_output_json)
-    for plot in PLOTS:
-     	plot_bar(summary, outdir, output_file_prefix, plot)
+    cache_dir = None if no_cache else cache_dir_for(outdir)
+    file_summaries = map_fio_outputs(slurp_fio_file, fio_output_json, jobs, cache_dir)
+    summary = pad_fio_summary(file_summaries)
+    latency = file_latency(file_summaries)
+    if results_db is not None:
+        record_run(results_db, 'aggregate-performance', results_rows(file_summaries, latency), started)
+    calls = [
+        (plot_bar, (summary, outdir, output_file_prefix, plot, plot_format))
+        for plot in PLOTS
+        ]
+    calls.append((plot_latency, (
+        latency,
+        LATENCY_TITLE.format(
+            bs=summary[0]['bs'],
+            mode=summary[0]['rw'],
+            threads=summary[0]['numjobs']
+            ),
+        'Clients active',
+        PurePath(outdir).joinpath(
+            '{prefix}-aggregate-{mode}-{bs}-latency.png'.format(
+                prefix=output_file_prefix,
+                mode=summary[0]['rw'],
+                bs=summary[0]['bs']
+                )
+            ),
+        plot_format
+        )))
+    render_plots(calls, jobs)
+
+def run_fio(fio_exe, hosts, fio_configs, cleanup, outdir, output_file_prefix):
+    """
+    Drive fio --client against 1..N of hosts for each config, returning
+    the output JSON files grouped per config. Client counts for which
+    fio fails are reported and left out.
+    """
+    outputs = []
+    for config in fio_configs:
+        config_outputs = []
+        for count in range(1, 1 + len(hosts)):
+            print("Client count: {count}\nClients included: {hosts}".format(
+                count=count,
+                hosts=",".join(hosts[:count])
+                )
+            )
+            output_fn = PurePath(outdir).joinpath(
+                "{prefix}-aggregate-{mode}-{bs}-{count}.json".format(
+                    prefix=output_file_prefix,
+                    mode=config['rw'],
+                    bs=config['bs'],
+                    count=count
+                    )
+                )
+            fio_cmd = [
+                fio_exe,
+                "--output-format=json+",
+                "--output={output_fn}".format(output_fn=output_fn)
+                ]
+            config_fns = []
+            for host in hosts[:count]:
+                config_fn = PurePath(outdir).joinpath(
+                    "{prefix}-aggregate-{mode}-{bs}-{count}-{jobname}.fio".format(
+                        prefix=output_file_prefix,
+                        mode=config['rw'],
+                        bs=config['bs'],
+                        count=count,
+                        jobname=client_jobname(host)
+                        )
+                    )
+                with open(config_fn, "w") as f:
+                    f.write(render_job_config(GLOBAL_CONFIG, config, client_jobname(host)))
+                config_fns.append(config_fn)
+                fio_cmd += ["--client={host}".format(host=host), str(config_fn)]
+
+            print("Running fio...")
+            print(" ".join(fio_cmd))
+            result = subprocess.run(
+                fio_cmd,
+                stderr = subprocess.PIPE,
+                stdout = subprocess.DEVNULL
+                )
+
+            if cleanup:
+                for config_fn in config_fns:
+                    Path(config_fn).unlink()
+            # An unreachable client fails the whole fio run
+            if result.returncode != 0 or not Path(output_fn).exists():
+                print("fio failed with {count} client(s), skipping it (exit code {returncode}):\n  {stderr}".format(
+                    count=count,
+                    returncode=result.returncode,
+                    stderr=result.stderr.decode(errors='replace').strip() or "no output"
+                    )
+                )
+                continue
+            config_outputs.append(output_fn)
+        if config_outputs:
+            outputs.append(config_outputs)
+
+    return outputs
+
+def run_aggregate_fio(fio_exe, hosts, directory, cleanup, outdir, output_file_prefix,
+                      bs, mode, runtime, numjobs, iodepth, size, nrfiles, jobs=1,
+                      plot_format=DEFAULT_PLOT_FORMAT, results_db=None):
+    outdir = make_output_directory(outdir)
+    fio_configs = generate_fio_configs(
+        bs, iodepth, 1, 'libaio', runtime, numjobs, mode, size, nrfiles, directory
+        )
+    outputs = run_fio(fio_exe, hosts, fio_configs, cleanup, outdir, output_file_prefix)
+    if not outputs:
+        sys.exit("No fio runs completed, nothing to plot")
+    for config_outputs in outputs:
+        run_aggregate_performance(config_outputs, outdir, output_file_prefix, jobs,
+                                  no_cache=True, plot_format=plot_format, results_db=results_db)
+        if cleanup:
+            for output_fn in config_outputs:
+                Path(output_fn).unlink()
@@ -0,0 +1,72 @@
+import matplotlib.pyplot as plt
+import numpy as np
+from pathlib import PurePath
+from .render import DEFAULT_PLOT_FORMAT, save_figure
+
+PERCENTILES = [50, 99, 99.9, 99.99]
+
+def percentile_name(percentile):
+    return 'p{percentile:g}'.format(percentile=percentile)
+
+def merge_bins(bins_list):
+    """
+    Merge fio json+ clat_ns 'bins' histograms ({latency_ns: count}) into
+    sorted arrays of latencies and summed counts.
+    """
+    bins_list = [bins for bins in bins_list if bins]
+    if not bins_list:
+        return np.array([]), np.array([])
+    latencies = np.concatenate(
+        [np.fromiter(bins.keys(), dtype=np.int64, count=len(bins)) for bins in bins_list]
+        )
+    counts = np.concatenate(
+        [np.fromiter(bins.values(), dtype=np.int64, count=len(bins)) for bins in bins_list]
+        )
+    merged, inverse = np.unique(latencies, return_inverse=True)
+    return merged, np.bincount(inverse, weights=counts)
+
+def clat_percentiles(bins_list, percentiles=PERCENTILES):
+    """
+    Completion latency percentiles in microseconds from a list of fio
+    clat_ns bins histograms, e.g. one per job or client.
+    """
+    latencies, counts = merge_bins(bins_list)
+    if counts.sum() == 0:
+        return {percentile_name(p): 0 for p in percentiles}
+    cumulative = np.cumsum(counts)
+    idx = np.searchsorted(
+        cumulative,
+        np.array(percentiles) / 100 * cumulative[-1]
+        )
+    idx = np.minimum(idx, len(latencies) - 1)
+    return {
+        percentile_name(p): float(latencies[i]) / 1000
+        for p, i in zip(percentiles, idx)
+        }
+
+def stats_bins(stats, io_type):
+    """
+    clat_ns bins for io_type from each fio job or client stats entry.
+    """
+    return [i[io_type].get('clat_ns', {}).get('bins', {}) for i in stats]
+
+def plot_latency(summary, title, xlabel, output_fn, plot_format=DEFAULT_PLOT_FORMAT):
+    print("Making latency plot")
+    summary = sorted(summary, key=lambda k: k['count'])
+    labels = [str(i['count']) for i in summary]
+    fig, ax = plt.subplots()
+    for p in PERCENTILES:
+        name = percentile_name(p)
+        ax.plot(labels, [i[name] for i in summary], marker='o', label=name)
+
+    ax.set_yscale('log')
+    ax.tick_params(axis='x', which='major', labelsize=4)
+    ax.set_title(title)
+    ax.set_ylabel('Completion latency (us)')
+    ax.set_xlabel(xlabel)
+    ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
+    save_figure(
+        fig,
+        PurePath(output_fn),
+        plot_format
+        )
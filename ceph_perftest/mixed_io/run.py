@@ -1,59 +1,120 @@
 from plotnine import ggplot, geom_col, aes, \
                     facet_grid, theme_bw, scale_fill_hue, \
                     ylab, xlab, labs, labeller
-import json
-
 from pathlib import Path, PurePath
 import re
+import subprocess
+import sys
+import time
 import pandas as pd
 from binary import BinaryUnits, DecimalUnits, convert_units
+from ..fio_job import client_jobname, render_job_config
+from ..fio_json import load_fio_output, map_fio_outputs
+from ..results_cache import cache_dir_for
+from ..render import DEFAULT_PLOT_FORMAT, plot_output, render_plots
+from ..results_db import record_run
+
+GLOBAL_CONFIG = """
+    [global]
+    bs={bs}
+    rw=randrw
+    rwmixread={rwmixread}
+    percentage_random={percentage_random}
+    iodepth={iodepth}
+    direct=1
+    ioengine=libaio
+    time_based
+    group_reporting
+    ramp_time={ramp_time}
+    runtime={runtime}
+    numjobs={numjobs}
+    size={size}
+    directory={directory}
+    nrfiles={nrfiles}
+    [{jobname}]
+    """
 
-def slurp_fio_output(fio_output_json):   
+def slurp_fio_file(jsonfile):
     results_summary = []
-    for jsonfile in fio_output_json:
-
-        f = open(jsonfile, "r")
-        data = json.load(f)
-
-        if len(data['client_stats']) == 1:
-            all_clients = data['client_stats']
-        else:
-            all_clients = [ i for i in data['client_stats'] if i['jobname'] == 'All clients']
-
-        for client in all_clients:
-            for io_type in ['read', 'write']:
-                for measure in ['iops', 'bw']:
-                    bs_val, bs_unit = re.findall('[A-Za-z]+|\\d+', data['global options']['bs'])
-                    if bs_unit.upper() == "M":
-                        bs = int(bs_val) * 1000 * 1000
-                    elif bs_unit.upper() == "K":
-                        bs = int(bs_val) * 1000
-
-                    client_data = {
-                            'count': len([ i for i in data['client_stats'] if i['jobname'] != 'All clients']),
-                            'random_io_pct': data['global options']['percentage_random'],
-                            'read_io_pct': data['global options']['rwmixread'],
-                            'bs': bs,
-                            'numjobs': data['global options']['numjobs'],
-                            'io_type': io_type,
-                            'measure': measure
-                        }
-                    
-                    if measure == 'bw':
-                        bw, _ = convert_units(
-                            int(client[io_type]['bw']),
-                            unit=BinaryUnits.KB, 
-                            to=DecimalUnits.MB
-                            )
-                        client_data['value'] = bw
-
-                    else:
-                        client_data['value'] = int(client[io_type]['iops'])
-
-                    results_summary.append(client_data)
+
+    data = load_fio_output(jsonfile)
+
+    if 'client_stats' not in data:
+        # A local run: group_reporting leaves a single job
+        data['client_stats'] = data['jobs']
+
+    if len(data['client_stats']) == 1:
+        all_clients = data['client_stats']
+    else:
+        all_clients = [ i for i in data['client_stats'] if i['jobname'] == 'All clients']
+
+    for client in all_clients:
+        for io_type in ['read', 'write']:
+            for measure in ['iops', 'bw']:
+                client_data = {
+                        'count': len([ i for i in data['client_stats'] if i['jobname'] != 'All clients']),
+                        'random_io_pct': data['global options']['percentage_random'],
+                        'read_io_pct': data['global options']['rwmixread'],
+                        'bs': data['global options']['bs'],
+                        'numjobs': data['global options']['numjobs'],
+                        'iodepth': data['global options'].get('iodepth'),
+                        'timestamp': data.get('timestamp'),
+                        'io_type': io_type,
+                        'measure': measure
+                    }
+                
+                if measure == 'bw':
+                    bw, _ = convert_units(
+                        int(client[io_type]['bw']),
+                        unit=BinaryUnits.KB, 
+                        to=DecimalUnits.MB
+                        )
+                    client_data['value'] = bw
+
+                else:
+                    client_data['value'] = int(client[io_type]['iops'])
+
+                results_summary.append(client_data)
     
+    return results_summary
+
+def slurp_fio_output(fio_output_json, jobs=1, cache_dir=None):
+    results_summary = []
+    for file_summary in map_fio_outputs(slurp_fio_file, fio_output_json, jobs, cache_dir):
+        results_summary.extend(file_summary)
+
     return pd.DataFrame(results_summary)
 
+def results_rows(summary):
+    """
+    Results database rows, one per workload and IO type with its
+    bandwidth and IOPS, from the long-form summary.
+    """
+    rows = {}
+    for record in summary.to_dict('records'):
+        key = (
+            record['count'], record['random_io_pct'], record['read_io_pct'],
+            record['bs'], record['numjobs'], record['io_type']
+            )
+        if key not in rows:
+            rows[key] = {
+                # Aggregated over all clients, so no single host
+                'host': None,
+                'target': 'All clients',
+                'mode': record['io_type'],
+                'bs': record['bs'],
+                'numjobs': record['numjobs'],
+                'iodepth': record['iodepth'],
+                'count': record['count'],
+                'timestamp': record['timestamp'],
+                'workload': 'rwmixread={read},percentage_random={random}'.format(
+                    read=record['read_io_pct'],
+                    random=record['random_io_pct']
+                    )
+                }
+        rows[key][record['measure']] = record['value']
+    return list(rows.values())
+
 def make_output_directory(outdir):
     p = Path(outdir).resolve()
 
@@ -65,14 +126,24 @@ def label_col_facets(s):
     return 'Random IO (%): ' + s
 
 def label_row_facets(s):
-    i = int(s)
-    if i >= 1000 * 1000:
-        units = "M"
-        value = i / 1000 / 1000
-    elif i > 1000:
-        units = "K"
-        value = i / 1000 
-    return 'IO Blocksize: {value}{units}'.format(value=int(value), units=units)
+    return 'IO Blocksize: ' + s
+
+def bs_bytes(bs):
+    """
+    Bytes in a fio block size such as 4k, 64KiB or 512b (the first of
+    a read/write pair such as 1M/4k), or None if it is not one.
+    """
+    size = re.match('(\\d+)([kmgtp]?)(i?b)?', bs, re.IGNORECASE)
+    if size is None:
+        return None
+    return int(size.group(1)) * 1024 ** ' kmgtp'.index(size.group(2).lower() or ' ')
+
+def order_bs_categories(s):
+    # Block sizes that don't parse go last, in name order
+    return sorted(
+        set(s),
+        key=lambda bs: (bs_bytes(bs) is None, bs_bytes(bs) or 0, bs)
+        )
 
 def order_numerical_categories(s):
     return [
@@ -85,7 +156,54 @@ def order_numerical_categories(s):
             )
         ]
 
-def make_plots(summary, outdir, output_file_prefix, annotation):
+def make_plot(summary, measure, outdir, output_file_prefix, annotation,
+              n_clients, client_threads, plot_format=DEFAULT_PLOT_FORMAT):
+    if measure == 'bw':
+        var = "bandwidth"
+        y_label = "Bandwidth (MB/s)"
+    else:
+        var = y_label = measure
+    p = (ggplot(
+        summary.loc[summary['measure'] == measure], 
+        aes(x='read_io_pct', y='value', fill='io_type')
+        ) 
+        + geom_col(stat='identity')
+        + facet_grid('bs ~ random_io_pct', 
+                      scales='free_y', 
+                      labeller=labeller(
+                        cols=label_col_facets, 
+                        rows=label_row_facets)
+                      )
+        + scale_fill_hue(name="IO Type")
+        + ylab(y_label)
+        + xlab("Read IO mix (%)")
+        + theme_bw()
+        + labs(
+            title="Filesystem aggregate " +var+ " under varying IO workloads",
+            caption="Clients: {clients} | Client Threads: {client_threads} | {annotation}".format(
+                clients=n_clients,
+                client_threads=client_threads,
+                annotation=annotation
+            )
+        )
+    )
+
+    output_fn, dpi = plot_output(
+        PurePath(
+            outdir
+            ).joinpath(
+                '{prefix}.{measure}.mixed-io.png'.format(
+                    prefix=output_file_prefix, measure=measure
+                    )
+                ),
+        plot_format,
+        300
+        )
+    save_kwargs = {} if dpi is None else {'dpi': dpi}
+    p.save(output_fn, width=12, height=8, verbose=False, **save_kwargs)
+
+def make_plots(summary, outdir, output_file_prefix, annotation,
+               plot_format=DEFAULT_PLOT_FORMAT, jobs=1):
     summary['read_io_pct'] = pd.Categorical(
         summary['read_io_pct'], 
         categories=order_numerical_categories(summary['read_io_pct'])
@@ -94,55 +212,147 @@ def make_plots(summary, outdir, output_file_prefix, annotation):
         summary['random_io_pct'], 
         categories=order_numerical_categories(summary['random_io_pct'])
         )
+    summary['bs'] = pd.Categorical(
+        summary['bs'],
+        categories=order_bs_categories(summary['bs'])
+        )
     
     n_clients = summary['count'].values[0]
 
     client_threads = summary['numjobs'].values[0]
 
-    for measure in set(summary['measure']):
-        if measure == 'bw':
-            var = "bandwidth"
-            y_label = "Bandwidth (MB/s)"
-        else:
-            var = y_label = measure
-        p = (ggplot(
-            summary.loc[summary['measure'] == measure], 
-            aes(x='read_io_pct', y='value', fill='io_type')
-            ) 
-            + geom_col(stat='identity')
-            + facet_grid('bs ~ random_io_pct', 
-                          scales='free_y', 
-                          labeller=labeller(
-                            cols=label_col_facets, 
-                            rows=label_row_facets)
-                          )
-            + scale_fill_hue(name="IO Type")
-            + ylab(y_label)
-            + xlab("Read IO mix (%)")
-            + theme_bw()
-            + labs(
-                title="Filesystem aggregate " +var+ " under varying IO workloads",
-                caption="Clients: {clients} | Client Threads: {client_threads} | {annotation}".format(
-                    clients=n_clients,
-                    client_threads=client_threads,
-                    annotation=annotation
+    render_plots(
+        [
+            (make_plot, (summary, measure, outdir, output_file_prefix, annotation,
+                         n_clients, client_threads, plot_format))
+            for measure in sorted(set(summary['measure']))
+            ],
+        jobs
+        )
+
+def run_mixed_io(fio_output_json, outdir, output_file_prefix, annotation, jobs=1, no_cache=False,
+                 plot_format=DEFAULT_PLOT_FORMAT, results_db=None):
+    started = time.time()
+    outdir = make_output_directory(outdir)
+    cache_dir = None if no_cache else cache_dir_for(outdir)
+    summary = slurp_fio_output(fio_output_json, jobs, cache_dir)
+    print(summary)
+    if results_db is not None:
+        record_run(results_db, 'mixed-io', results_rows(summary), started)
+    make_plots(summary, outdir, output_file_prefix, annotation, plot_format, jobs)
+
+def generate_mixed_io_configs(bs, rwmixread, percentage_random, iodepth, ramp_time, runtime,
+                              numjobs, size, nrfiles, directory):
+    fio_configs = []
+    for blocksize in bs:
+        for read_pct in rwmixread:
+            for random_pct in percentage_random:
+                fio_configs.append(
+                    {
+                        "bs": blocksize,
+                        "rwmixread": read_pct,
+                        "percentage_random": random_pct,
+                        "iodepth": iodepth,
+                        "ramp_time": ramp_time,
+                        "runtime": runtime,
+                        "numjobs": numjobs,
+                        "size": size,
+                        "nrfiles": nrfiles,
+                        "directory": directory
+                    }
                 )
+    return fio_configs
+
+def order_cells(fio_configs):
+    """
+    Order cells from the most write-heavy to the most read-heavy, and
+    within each read mix from sequential to random: the device is
+    preconditioned by the heaviest writes once rather than flipping
+    between fresh and dirty states from one cell to the next, and the
+    read-heavy cells run last against settled media.
+    """
+    return sorted(
+        fio_configs,
+        key=lambda k: (k['rwmixread'], k['percentage_random'])
+        )
+
+def run_fio(fio_exe, hosts, fio_configs, cleanup, outdir, output_file_prefix):
+    """
+    Run every cell of the matrix, against all of hosts with fio --client
+    or locally if there are none, returning the output JSON files of the
+    cells that completed.
+    """
+    outputs = []
+    for idx, config in enumerate(fio_configs, 1):
+        name = "{prefix}-mixed-{bs}-{rwmixread}-{percentage_random}".format(
+            prefix=output_file_prefix,
+            **config
+            )
+        print("Cell {idx}/{cells}: bs={bs}, rwmixread={rwmixread}, percentage_random={percentage_random}".format(
+            idx=idx,
+            cells=len(fio_configs),
+            **config
             )
         )
+        output_fn = PurePath(outdir).joinpath("{name}.json".format(name=name))
+        fio_cmd = [
+            fio_exe,
+            "--output-format=json+",
+            "--output={output_fn}".format(output_fn=output_fn)
+            ]
+        config_fns = []
+        for host in hosts or [None]:
+            jobname = 'mixed-io' if host is None else client_jobname(host)
+            config_fn = PurePath(outdir).joinpath(
+                "{name}-{jobname}.fio".format(name=name, jobname=jobname)
+                )
+            with open(config_fn, "w") as f:
+                f.write(render_job_config(GLOBAL_CONFIG, config, jobname))
+            config_fns.append(config_fn)
+            if host is not None:
+                fio_cmd.append("--client={host}".format(host=host))
+            fio_cmd.append(str(config_fn))
 
-        p.save(PurePath(
-            outdir
-            ).joinpath(
-                '{prefix}.{measure}.mixed-io.png'.format(
-                    prefix=output_file_prefix, measure=measure
-                    )
-                    ),
-                    dpi=300, 
-                    width=12, 
-                    height=8
+        print("Running fio...")
+        print(" ".join(fio_cmd))
+        subprocess.run(
+            fio_cmd,
+            stderr = subprocess.DEVNULL,
+            stdout = subprocess.DEVNULL
             )
-def run_mixed_io(fio_output_json, outdir, output_file_prefix, annotation):
+
+        if cleanup:
+            for config_fn in config_fns:
+                Path(config_fn).unlink()
+        if not Path(output_fn).exists():
+            print("fio produced no output for {name}, skipping it".format(name=name))
+            continue
+        outputs.append(output_fn)
+
+    return outputs
+
+def run_mixed_io_fio(fio_exe, hosts, directory, cleanup, outdir, output_file_prefix, annotation,
+                     bs, rwmixread, percentage_random, cell_time, ramp_time, numjobs, iodepth,
+                     size, nrfiles, jobs=1, plot_format=DEFAULT_PLOT_FORMAT, results_db=None):
+    if ramp_time >= cell_time:
+        sys.exit("--ramp-time must be shorter than the --cell-time budget")
     outdir = make_output_directory(outdir)
-    summary = slurp_fio_output(fio_output_json)
-    print(summary)
-    make_plots(summary, outdir, output_file_prefix, annotation)
\ No newline at end of file
+    fio_configs = order_cells(
+        generate_mixed_io_configs(
+            bs, rwmixread, percentage_random, iodepth, ramp_time, cell_time - ramp_time,
+            numjobs, size, nrfiles, directory
+            )
+        )
+    print("{cells} cells, about {minutes:.1f} minutes".format(
+        cells=len(fio_configs),
+        minutes=len(fio_configs) * cell_time / 60
+        )
+    )
+    outputs = run_fio(fio_exe, hosts, fio_configs, cleanup, outdir, output_file_prefix)
+    if not outputs:
+        sys.exit("No cells completed, nothing to plot")
+    run_mixed_io(outputs, outdir, output_file_prefix, annotation, jobs, no_cache=True,
+                 plot_format=plot_format, results_db=results_db)
+    if cleanup:
+        for output_fn in outputs:
+            Path(output_fn).unlink()
@@ -0,0 +1,139 @@
+from pathlib import Path
+import socket
+from .fio_matrix import io_type
+from .results_db import query_results
+
+# Allowance per step on top of its runtime for process start-up, fio
+# file layout, teardown and parsing.
+STEP_OVERHEAD = 5
+
+def new_step(name, runtime, io, files=None, commands=None):
+    """
+    A planned step: runtime in seconds, io as (device, mode, bs, count,
+    seconds) for every device and workload it drives, the job files it
+    writes as (path, lines) and the commands it runs.
+    """
+    return {
+        'name': name,
+        'runtime': runtime,
+        'io': io,
+        'files': files or [],
+        'commands': commands or []
+        }
+
+def history_bw(results_db, subcommand):
+    """
+    Mean past bandwidth (MB/s) recorded by subcommand on this host, per
+    (target, mode, bs, count).
+    """
+    if results_db is None or not Path(results_db).exists():
+        return {}
+    columns, rows = query_results(results_db, subcommand=subcommand, host=socket.gethostname())
+    samples = {}
+    for row in rows:
+        row = dict(zip(columns, row))
+        if row['bw'] is not None:
+            samples.setdefault(
+                (row['target'], row['mode'], row['bs'], row['count']), []
+                ).append(row['bw'])
+    return {key: sum(value) / len(value) for key, value in samples.items()}
+
+def estimate_bw(history, device, mode, bs, count):
+    """
+    Past bandwidth of device at this step, or at any step with the same
+    mode and bs when this one has not been run before.
+    """
+    key = (device, mode, None if bs is None else str(bs), count)
+    if key in history:
+        return history[key]
+    nearby = [value for (target, m, b, _), value in history.items() if (target, m, b) == key[:3]]
+    if nearby:
+        return sum(nearby) / len(nearby)
+    return None
+
+def io_split(mode):
+    """
+    Read and write share of the bytes moved by mode.
+    """
+    if mode == 'sendfile' or io_type(mode) == 'read':
+        return 1.0, 0.0
+    if io_type(mode) == 'write':
+        return 0.0, 1.0
+    # rw/randrw default to fio's rwmixread=50
+    return 0.5, 0.5
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{hours}h{minutes:02d}m{seconds:02d}s'.format(hours=hours, minutes=minutes, seconds=seconds)
+
+def format_bytes(n):
+    for unit in ['B', 'kB', 'MB', 'GB', 'TB']:
+        if n < 1000 or unit == 'TB':
+            return '{n:.1f} {unit}'.format(n=n, unit=unit)
+        n /= 1000
+
+def print_plan(subcommand, steps, results_db=None, repeat=1, extra_steps=0, upper_bound=False):
+    """
+    Print the steps a sweep would run with their job files and commands,
+    and an estimate of its wall-clock time and of the bytes read and
+    written on each device from the results database, if it has past
+    results for them.
+
+    extra_steps are steps that may be added at run time (e.g. by an
+    adaptive search) and are only counted in the upper estimate, as are
+    repeated trials; upper_bound marks steps that may end early.
+    """
+    print("Planned steps for {subcommand}:".format(subcommand=subcommand))
+    for idx, step in enumerate(steps, 1):
+        print("\n{idx}. {name} ({runtime}s)".format(idx=idx, **step))
+        for command in step['commands']:
+            print("   $ {command}".format(command=command))
+        for fn, lines in step['files']:
+            print("   --- {fn}".format(fn=fn))
+            for line in lines:
+                print("   {line}".format(line=line))
+
+    step_time = sum(i['runtime'] + STEP_OVERHEAD for i in steps)
+    longest = max([i['runtime'] + STEP_OVERHEAD for i in steps], default=0)
+    high = (step_time + extra_steps * longest) * repeat
+    if upper_bound:
+        estimate = 'up to {high}'.format(high=format_duration(high))
+    elif high == step_time:
+        estimate = format_duration(step_time)
+    else:
+        estimate = '{low} to {high}'.format(low=format_duration(step_time), high=format_duration(high))
+    print("\nEstimated wall-clock time: {estimate}".format(estimate=estimate))
+    print("  ({steps} steps, {overhead}s overhead each{repeat})".format(
+        steps=len(steps) + extra_steps,
+        overhead=STEP_OVERHEAD,
+        repeat='' if repeat == 1 else ', up to {repeat} trials'.format(repeat=repeat)
+        )
+    )
+
+    history = history_bw(results_db, subcommand)
+    totals = {}
+    for step in steps:
+        for device, mode, bs, count, seconds in step['io']:
+            total = totals.setdefault(device, {'read': 0.0, 'write': 0.0, 'unknown': []})
+            bw = estimate_bw(history, device, mode, bs, count)
+            if bw is None:
+                workload = mode if bs is None else '{mode} {bs}'.format(mode=mode, bs=bs)
+                if workload not in total['unknown']:
+                    total['unknown'].append(workload)
+                continue
+            read, write = io_split(mode)
+            total['read'] += bw * 1000 * 1000 * seconds * read
+            total['write'] += bw * 1000 * 1000 * seconds * write
+
+    print("\nEstimated IO per device (one trial, from past results):")
+    for device, total in totals.items():
+        print("  {device}: {read} read, {write} written{unknown}".format(
+            device=device,
+            read=format_bytes(total['read']),
+            write=format_bytes(total['write']),
+            unknown='' if not total['unknown'] else ' + unknown for {workloads} (no past results)'.format(
+                workloads=', '.join(total['unknown'])
+                )
+            )
+        )
@@ -0,0 +1,50 @@
+from pathlib import PurePath
+
+# matplotlib and the process pool are imported inside the functions
+# below so that the CLI can import the format choices without paying
+# for them.
+
+PLOT_FORMATS = ['png', 'preview', 'svg', 'pdf']
+DEFAULT_PLOT_FORMAT = 'png'
+PREVIEW_DPI = 100
+
+def plot_output(output_fn, plot_format, dpi):
+    """
+    Output filename and dpi for plot_format: 'png' keeps the plot's own
+    dpi, 'preview' is a low-resolution png and 'svg'/'pdf' are vector
+    formats, which need no dpi.
+    """
+    if plot_format == 'png':
+        return PurePath(output_fn).with_suffix('.png'), dpi
+    if plot_format == 'preview':
+        return PurePath(output_fn).with_suffix('.png'), PREVIEW_DPI
+    return PurePath(output_fn).with_suffix('.' + plot_format), None
+
+def save_figure(fig, output_fn, plot_format=DEFAULT_PLOT_FORMAT, dpi=1000):
+    import matplotlib.pyplot as plt
+    output_fn, dpi = plot_output(output_fn, plot_format, dpi)
+    if dpi is None:
+        fig.savefig(output_fn, bbox_inches='tight')
+    else:
+        fig.savefig(output_fn, dpi=dpi, bbox_inches='tight')
+    # Free the figure straight away so memory doesn't build up over a sweep
+    plt.close(fig)
+
+def render_plots(calls, jobs=1):
+    """
+    Run each (func, args) plotting call, in jobs worker processes when
+    jobs > 1.
+    """
+    import matplotlib
+    # Plots are only ever written to file; a GUI backend is also unsafe
+    # in forked render workers.
+    matplotlib.use('Agg')
+    if jobs <= 1 or len(calls) <= 1:
+        for func, args in calls:
+            func(*args)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(func, *args) for func, args in calls]
+        for future in futures:
+            future.result()
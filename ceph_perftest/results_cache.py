@@ -0,0 +1,86 @@
+from pathlib import Path
+import gzip
+import hashlib
+import json
+import os
+
+# Parsed fio records are cached per input file under the output
+# directory, keyed by parser, path, size and mtime. Bump CACHE_VERSION
+# whenever a parser starts producing different records.
+CACHE_VERSION = 5
+CACHE_DIRNAME = '.ceph-perftest-cache'
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def cache_dir_for(outdir):
+    return Path(outdir).joinpath(CACHE_DIRNAME)
+
+def cache_key(namespace, jsonfile):
+    st = os.stat(jsonfile)
+    key = "{version}\0{namespace}\0{path}\0{size}\0{mtime}".format(
+        version=CACHE_VERSION,
+        namespace=namespace,
+        path=Path(jsonfile).resolve(),
+        size=st.st_size,
+        mtime=st.st_mtime_ns
+        )
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def to_columns(records):
+    """
+    Records as one list per column, over every key any record has. Keys
+    missing from some records are listed with the rows that lack them so
+    that from_columns gives back the same records.
+    """
+    columns = list(dict.fromkeys(column for record in records for column in record))
+    missing = {}
+    for column in columns:
+        rows = [idx for idx, record in enumerate(records) if column not in record]
+        if rows:
+            missing[column] = rows
+    return {
+        'columns': columns,
+        'data': [[record.get(column) for record in records] for column in columns],
+        'missing': missing
+        }
+
+def from_columns(table):
+    records = [dict(zip(table['columns'], row)) for row in zip(*table['data'])]
+    for column, rows in table['missing'].items():
+        for idx in rows:
+            del records[idx][column]
+    return records
+
+def cache_get(cache_dir, key):
+    entry = Path(cache_dir).joinpath(key + '.json.gz')
+    try:
+        with gzip.open(entry, 'rt') as f:
+            records = from_columns(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+    # Mark as recently used for eviction
+    os.utime(entry)
+    return records
+
+def cache_put(cache_dir, key, records):
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry = cache_dir.joinpath(key + '.json.gz')
+    tmp = cache_dir.joinpath(key + '.tmp')
+    with gzip.open(tmp, 'wt') as f:
+        json.dump(to_columns(records), f)
+    os.replace(tmp, entry)
+
+def cache_evict(cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """
+    Remove least recently used entries until the cache fits in max_bytes.
+    """
+    entries = sorted(
+        Path(cache_dir).glob('*.json.gz'),
+        key=lambda p: p.stat().st_mtime
+        )
+    total = sum(p.stat().st_size for p in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        entry.unlink()
@@ -0,0 +1,203 @@
+import csv
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import socket
+import sqlite3
+import sys
+import time
+import uuid
+
+# Every subcommand records its results here unless told otherwise, so
+# runs from commissioning onwards can be queried together.
+DEFAULT_RESULTS_DB = os.path.join(os.path.expanduser('~'), '.ceph-perftest', 'results.db')
+RESULTS_DB_ENV = 'CEPH_PERFTEST_DB'
+
+INSERT_BATCH = 1000
+
+# Latency percentile names ('p99.9') as column names ('p99_9')
+LATENCY_COLUMNS = ['p50', 'p99', 'p99_9', 'p99_99']
+
+RESULT_COLUMNS = [
+    'host', 'target', 'mode', 'bs', 'numjobs', 'iodepth', 'count',
+    'bw', 'iops'
+    ] + LATENCY_COLUMNS + ['timestamp', 'workload']
+
+EXPORT_FORMATS = ['table', 'csv', 'json']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    subcommand TEXT NOT NULL,
+    host TEXT NOT NULL,
+    command TEXT,
+    started REAL NOT NULL,
+    finished REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    host TEXT,
+    target TEXT,
+    mode TEXT,
+    bs TEXT,
+    numjobs INTEGER,
+    iodepth INTEGER,
+    count INTEGER,
+    bw REAL,
+    iops REAL,
+    p50 REAL,
+    p99 REAL,
+    p99_9 REAL,
+    p99_99 REAL,
+    timestamp REAL,
+    workload TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS runs_subcommand ON runs (subcommand);
+CREATE INDEX IF NOT EXISTS results_run_id ON results (run_id);
+CREATE INDEX IF NOT EXISTS results_host_target ON results (host, target);
+CREATE INDEX IF NOT EXISTS results_mode_bs ON results (mode, bs);
+CREATE INDEX IF NOT EXISTS results_timestamp ON results (timestamp);
+"""
+
+def connect(db_path, readonly=False):
+    """
+    Connection to the results database at db_path, creating it for
+    writing. Queries open it read-only and exit if there is none yet.
+    """
+    if readonly:
+        if not Path(db_path).exists():
+            sys.exit("No results database at {db_path}".format(db_path=db_path))
+        return sqlite3.connect('{uri}?mode=ro'.format(uri=Path(db_path).resolve().as_uri()), uri=True)
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path))
+    # Let queries run while a benchmark is writing
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def latency_columns(latency):
+    """
+    Latency percentiles keyed by column name from a latency summary
+    keyed by percentile name.
+    """
+    return {
+        name.replace('.', '_'): value
+        for name, value in latency.items()
+        if name.replace('.', '_') in LATENCY_COLUMNS
+        }
+
+def record_run(db_path, subcommand, rows, started):
+    """
+    Store one run of subcommand and its result rows (dicts keyed by
+    RESULT_COLUMNS, missing keys stored as NULL) in the results
+    database at db_path, inserting in batches of INSERT_BATCH rows in a
+    single transaction. Returns the new run id.
+    """
+    run_id = uuid.uuid4().hex
+    finished = time.time()
+    host = socket.gethostname()
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute(
+                'INSERT INTO runs (run_id, subcommand, host, command, started, finished) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (run_id, subcommand, host, ' '.join(sys.argv), started, finished)
+                )
+            insert = 'INSERT INTO results (run_id, {columns}) VALUES (?, {params})'.format(
+                columns=', '.join(RESULT_COLUMNS),
+                params=', '.join('?' * len(RESULT_COLUMNS))
+                )
+            batch = []
+            for row in rows:
+                row = dict(row)
+                row.setdefault('host', host)
+                # Older fio output carries no timestamp
+                if row.get('timestamp') is None:
+                    row['timestamp'] = finished
+                if row.get('bs') is not None:
+                    row['bs'] = str(row['bs'])
+                batch.append([run_id] + [row.get(i) for i in RESULT_COLUMNS])
+                if len(batch) >= INSERT_BATCH:
+                    conn.executemany(insert, batch)
+                    batch = []
+            if batch:
+                conn.executemany(insert, batch)
+    finally:
+        conn.close()
+    print("Recorded run {run_id} in {db_path}".format(run_id=run_id, db_path=db_path))
+    return run_id
+
+def query_results(db_path, run_id=None, subcommand=None, host=None, target=None,
+                  mode=None, bs=None, since=None, until=None, limit=None):
+    """
+    Result rows matching every filter given, oldest first, with their
+    run's subcommand. since/until are epoch seconds.
+    Returns the column names and the rows.
+    """
+    where = []
+    params = []
+    for column, value in [
+            ('results.run_id', run_id),
+            ('runs.subcommand', subcommand),
+            ('results.host', host),
+            ('results.target', target),
+            ('results.mode', mode),
+            ('results.bs', bs)]:
+        if value is not None:
+            where.append('{column} = ?'.format(column=column))
+            params.append(value)
+    if since is not None:
+        where.append('results.timestamp >= ?')
+        params.append(since)
+    if until is not None:
+        where.append('results.timestamp < ?')
+        params.append(until)
+
+    sql = 'SELECT results.run_id, runs.subcommand, {columns} FROM results ' \
+          'JOIN runs ON runs.run_id = results.run_id'.format(
+              columns=', '.join('results.' + i for i in RESULT_COLUMNS)
+              )
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY results.timestamp, results.id'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+    conn = connect(db_path, readonly=True)
+    try:
+        cursor = conn.execute(sql, params)
+        columns = [i[0] for i in cursor.description]
+        return columns, cursor.fetchall()
+    finally:
+        conn.close()
+
+def format_value(column, value):
+    if value is None:
+        return ''
+    if column == 'timestamp':
+        return datetime.fromtimestamp(value).isoformat(sep=' ', timespec='seconds')
+    if isinstance(value, float):
+        return '{value:.2f}'.format(value=value)
+    return str(value)
+
+def export_results(columns, rows, output_format, f):
+    if output_format == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    elif output_format == 'json':
+        json.dump([dict(zip(columns, row)) for row in rows], f, indent=2)
+        f.write('\n')
+    else:
+        cells = [columns] + [
+            [format_value(column, value) for column, value in zip(columns, row)]
+            for row in rows
+            ]
+        widths = [max(len(row[idx]) for row in cells) for idx in range(len(columns))]
+        for row in cells:
+            f.write('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() + '\n')
@@ -0,0 +1,181 @@
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+# Stream with iperf3 clients (-F), or with the built-in os.sendfile engine
+ENGINES = ['iperf3', 'sendfile']
+DEFAULT_ENGINE = 'iperf3'
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Per-stream bandwidth is reported over intervals of this many seconds,
+# like iperf3's default -i 1.
+REPORT_INTERVAL = 1
+
+CONNECT_TIMEOUT = 10
+
+# A stream that can send nothing for this many seconds (the receiver has
+# stalled or gone) is given up on as timed out.
+STALL_TIMEOUT = 30
+
+def interval_record(start, end, nbytes):
+    return {
+        'sum': {
+            'start': start,
+            'end': end,
+            'seconds': end - start,
+            'bytes': nbytes,
+            'bits_per_second': nbytes * 8 / (end - start) if end > start else 0
+            }
+        }
+
+def sendfile_stream(device, host, port, runtime, chunk_size=DEFAULT_CHUNK_SIZE,
+                    stall_timeout=STALL_TIMEOUT):
+    """
+    Stream device into a TCP connection to host:port with os.sendfile
+    for runtime seconds, wrapping round to the start of the device at
+    its end. Returns iperf3-shaped JSON results (per-interval and total
+    bytes and bits per second, or an error) and whether the stream
+    timed out after sending nothing for stall_timeout seconds.
+    """
+    intervals = []
+    total = 0
+    fd = None
+    try:
+        fd = os.open(device, os.O_RDONLY)
+        with socket.create_connection((host, port), timeout=CONNECT_TIMEOUT) as sock:
+            # os.sendfile needs a blocking socket; the kernel send timeout
+            # makes a blocked send fail with EAGAIN instead of hanging.
+            sock.settimeout(None)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack('ll', stall_timeout, 0))
+            start = time.monotonic()
+            deadline = start + runtime
+            interval_start = start
+            interval_bytes = 0
+            offset = 0
+            now = start
+            while now < deadline:
+                try:
+                    sent = os.sendfile(sock.fileno(), fd, offset, chunk_size)
+                except BlockingIOError:
+                    return {'error': "{device} to {host}:{port}: timed out, nothing sent for {stall_timeout}s".format(
+                        device=device,
+                        host=host,
+                        port=port,
+                        stall_timeout=stall_timeout
+                        )}, True
+                if sent == 0:
+                    if offset == 0:
+                        raise OSError("{device} is empty".format(device=device))
+                    offset = 0
+                    continue
+                offset += sent
+                interval_bytes += sent
+                now = time.monotonic()
+                if now - interval_start >= REPORT_INTERVAL or now >= deadline:
+                    intervals.append(interval_record(interval_start - start, now - start, interval_bytes))
+                    total += interval_bytes
+                    interval_start = now
+                    interval_bytes = 0
+            elapsed = now - start
+    except OSError as e:
+        return {'error': "{device} to {host}:{port}: {error}".format(
+            device=device,
+            host=host,
+            port=port,
+            error=e.strerror or str(e)
+            )}, False
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+    return {
+        'intervals': intervals,
+        'end': {
+            'sum_sent': {
+                'seconds': elapsed,
+                'bytes': total,
+                'bits_per_second': total * 8 / elapsed if elapsed > 0 else 0
+                }
+            }
+        }, False
+
+def run_sendfile_streams(streams, runtime, chunk_size=DEFAULT_CHUNK_SIZE, stall_timeout=STALL_TIMEOUT):
+    """
+    Run a sendfile stream per (device, host, port, output_fn) at once,
+    one thread each (sendfile runs without the GIL), writing each
+    stream's results to its output_fn. Returns a result per stream in
+    the form supervise.run_processes gives for iperf3 clients, streams
+    stalled for stall_timeout seconds being timed out.
+    """
+    results = [None] * len(streams)
+
+    def stream(idx, device, host, port, output_fn):
+        data, timed_out = sendfile_stream(device, host, port, runtime, chunk_size, stall_timeout)
+        with open(output_fn, 'w') as f:
+            json.dump(data, f)
+        results[idx] = {
+            'cmd': ['sendfile', device, '{host}:{port}'.format(host=host, port=port)],
+            'output_fn': output_fn,
+            'returncode': 0 if 'error' not in data else 1,
+            'timed_out': timed_out,
+            'stderr': ''
+            }
+
+    threads = [
+        threading.Thread(target=stream, args=(idx,) + tuple(i), daemon=True)
+        for idx, i in enumerate(streams)
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+class LoopbackSink:
+    """
+    Receivers for sendfile streams on 127.0.0.1, one listening socket and
+    draining thread per port, for testing without a remote host. Use as
+    a context manager around a sweep.
+    """
+    def __init__(self, ports, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.listeners = []
+        for port in ports:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(('127.0.0.1', port))
+            listener.listen()
+            self.listeners.append(listener)
+
+    def accept(self, listener):
+        buf = bytearray(self.chunk_size)
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                # Listener closed
+                return
+            with conn:
+                try:
+                    while conn.recv_into(buf):
+                        pass
+                except OSError:
+                    pass
+
+    def __enter__(self):
+        for listener in self.listeners:
+            threading.Thread(target=self.accept, args=(listener,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        for listener in self.listeners:
+            # shutdown wakes the thread blocked in accept, close alone does not
+            try:
+                listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            listener.close()
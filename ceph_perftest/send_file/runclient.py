@@ -1,12 +1,22 @@
+from contextlib import ExitStack
 from pathlib import Path, PurePath
 import json
 import os
 import shlex
 import socket
 import sys
-import subprocess
 import time
 import matplotlib.pyplot as plt
+from ..supervise import run_processes
+from .engine import DEFAULT_CHUNK_SIZE, DEFAULT_ENGINE, LoopbackSink, run_sendfile_streams
+from .sink import read_sink_summary
+from .timeline import plot_timeline, steady_state_bw, stream_intervals
+from ..checkpoint import Checkpoint, check_resume
+from ..planner import new_step, print_plan
+from ..aggregate import pivot, stack_bottoms
+from ..render import DEFAULT_PLOT_FORMAT, save_figure
+from ..telemetry import OVERLAY_LEGEND_X, TelemetrySampler, overlay_telemetry
+from ..results_db import record_run
 
 PLOTS = [
         {
@@ -17,63 +27,250 @@ PLOTS = [
 	    }
     ]
 
-def run_iperf(iperf_exe, iperf_server, devices, port_start, cleanup, outdir, runtime): 
+# Allowance on top of the iperf3 runtime for connection setup and
+# teardown before a client is considered hung and killed, and how long a
+# sendfile stream may send nothing before it is timed out.
+IPERF_TIMEOUT_GRACE = 30
+
+def iperf_output_fn(outdir, device, idx, engine=DEFAULT_ENGINE):
+    return PurePath(
+        outdir
+        ).joinpath('{prefix}-out-{device_name}-{idx}.json'.format(
+            prefix='iperf' if engine == 'iperf3' else engine,
+            device_name=os.path.basename(device),
+            idx=idx
+            )
+        )
+
+def iperf_command(iperf_exe, iperf_server, port, runtime, device):
+    return "{iperf_exe} -c {iperf_server} -p {iperf_server_port} -t {time} -F {device} -Z -T {device_name} -J".format(
+        iperf_exe = iperf_exe,
+        iperf_server = iperf_server,
+        iperf_server_port = port,
+        time = runtime,
+        device = device,
+        device_name = os.path.basename(device)
+        )
+
+def stream_command(engine, iperf_exe, iperf_server, port, runtime, device, chunk_size):
+    if engine == 'sendfile':
+        return "sendfile {device} -> {iperf_server}:{port} for {runtime}s in {chunk_size} byte chunks".format(
+            device=device,
+            iperf_server=iperf_server,
+            port=port,
+            runtime=runtime,
+            chunk_size=chunk_size
+            )
+    return iperf_command(iperf_exe, iperf_server, port, runtime, device)
+
+def plan_steps(iperf_exe, iperf_server, devices, port_start, runtime, engine=DEFAULT_ENGINE,
+               chunk_size=DEFAULT_CHUNK_SIZE):
+    return [
+        new_step(
+            'Device count {idx}'.format(idx=idx),
+            runtime,
+            [(device, 'sendfile', None, idx, runtime) for device in devices[:idx]],
+            commands=[
+                stream_command(engine, iperf_exe, iperf_server, port_start + dev_idx, runtime, device,
+                               chunk_size)
+                for dev_idx, device in enumerate(devices[:idx])
+                ]
+            )
+        for idx in range(1, 1 + len(devices))
+        ]
+
+def read_iperf_output(result):
+    """
+    Return the JSON output of a supervised iperf3 client, or None if the
+    stream failed.
+    """
+    error = None
+    data = None
+    try:
+        with open(result['output_fn'], 'r') as f:
+            data = json.load(f)
+    except ValueError:
+        error = "unreadable iperf3 JSON output"
+    except OSError as e:
+        # The stream died before writing any output
+        error = "no iperf3 output: {error}".format(error=e.strerror or e)
+
+    if data is not None and 'error' in data:
+        error = data['error']
+    elif result['timed_out']:
+        error = "timed out"
+    elif result['returncode'] != 0:
+        error = "exit code {returncode}".format(returncode=result['returncode'])
+
+    if error is not None:
+        print("Stream failed: {cmd}\n  {error}{stderr}".format(
+            cmd=" ".join(result['cmd']),
+            error=error,
+            stderr="\n  " + result['stderr'] if result['stderr'] else ""
+            )
+        )
+        return None
+
+    return data
+
+def stream_bw(data, omit=0):
+    """
+    Steady-state and whole-run sent bandwidth in bits/s of a stream's
+    output. The steady state leaves out the first omit seconds of
+    intervals, and is the whole-run figure without omit or intervals.
+    """
+    total = data['end']['sum_sent']['bits_per_second']
+    steady = None
+    if omit:
+        steady = steady_state_bw(stream_intervals(data), omit)
+        if steady is None:
+            print("No intervals after the {omit}s warm-up, using the whole-run bandwidth".format(omit=omit))
+    return total if steady is None else steady, total
+
+def save_sink_summary(iperf_server, sink_control, outdir, idx):
+    """
+    Read and reset the receive-side summary of the sink at iperf_server
+    after a device count, save it and print each port's bandwidth.
+    Returns the output file, or None if the sink could not be read.
+    """
+    try:
+        summary = read_sink_summary(iperf_server, sink_control)
+    except (OSError, ValueError) as e:
+        print("Could not read sink summary from {iperf_server}:{sink_control}: {error}".format(
+            iperf_server=iperf_server,
+            sink_control=sink_control,
+            error=e
+            )
+        )
+        return None
+    summary_fn = PurePath(outdir).joinpath('sink-summary-{idx}.json'.format(idx=idx))
+    with open(summary_fn, 'w') as f:
+        json.dump(summary, f)
+    for port, received in sorted(summary['ports'].items()):
+        print("  sink port {port}: {bw:.1f} MB/s received over {connections} connection(s)".format(
+            port=port,
+            bw=received['bits_per_second'] / 8000000,
+            connections=received['connections']
+            )
+        )
+    return summary_fn
+
+def run_iperf(iperf_exe, iperf_server, devices, port_start, cleanup, outdir, runtime, checkpoint=None,
+              engine=DEFAULT_ENGINE, chunk_size=DEFAULT_CHUNK_SIZE, sink_control=None, omit=0,
+              network_line_rate=None, plot_format=DEFAULT_PLOT_FORMAT):
+    """
+    Stream 1..N of devices to the iperf3 server, with iperf3 clients or
+    the built-in sendfile engine, skipping device counts already
+    completed in checkpoint and reading their results back from the
+    output files. With sink_control, the receive-side summary of a sink
+    server is saved after each device count.
+
+    Bandwidth is the steady state after omit seconds of warm-up (TCP slow
+    start, readahead ramp), and each device count's intervals are
+    plotted over time.
+    """
     summary_output = []
+    telemetry_output = []
     total_disks = len(devices)
     for idx in range(1, 1 + total_disks):
         devs_to_test = devices[:idx]
+        commands = []
+        stream_cmds = []
         for dev_idx,device in enumerate(devs_to_test):
-            device_name = os.path.basename(device)
-            output_fn = PurePath(
-                outdir
-                ).joinpath('iperf-out-{device_name}-{idx}.json'.format(
-                    device_name=device_name,
-                    idx=idx
-                    )
-                )
-            # iperf3 -c $target -p $((5201 + $j)) -F /dev/$hdd -Z -T $hdd -J > iperf3-$count-$hdd.json &
-            iperf_client_cmd = "{iperf_exe} -c {iperf_server} -p {iperf_server_port} -t {time} -F {device} -Z -T {device_name} -J".format(
-                iperf_exe = iperf_exe,
-                iperf_server = iperf_server,
-                iperf_server_port = port_start + dev_idx,
-                time = runtime,
-                device = device,
-                device_name = device_name
-                )
-            print(iperf_client_cmd)
-            with open(output_fn, 'w') as f:
-                cmd = shlex.split(iperf_client_cmd)
-                subprocess.Popen(cmd, stdout=f)
-        # This is a hack to ensure that our processes have 
-        # completed before moving onto the next tranche
-        time.sleep(runtime + 0.5 * len(devs_to_test))
+            output_fn = iperf_output_fn(outdir, device, idx, engine)
+            stream_cmd = stream_command(engine, iperf_exe, iperf_server, port_start + dev_idx, runtime, device,
+                                        chunk_size)
+            print(stream_cmd)
+            stream_cmds.append(shlex.split(stream_cmd))
+            if engine == 'sendfile':
+                commands.append((device, iperf_server, port_start + dev_idx, output_fn))
+            else:
+                # iperf3 -c $target -p $((5201 + $j)) -F /dev/$hdd -Z -T $hdd -J > iperf3-$count-$hdd.json &
+                commands.append((stream_cmds[-1], output_fn))
 
-    for idx in range(1, 1 + total_disks):
-        devs_to_test = devices[:idx]
-        for dev_idx,device in enumerate(devs_to_test):
-            device_name = os.path.basename(device)
-            output_fn = PurePath(
-                outdir
-                ).joinpath('iperf-out-{device_name}-{idx}.json'.format(
-                    device_name=device_name,
-                    idx=idx
+        key = 'iperf-{idx}'.format(idx=idx)
+        params = {
+            'devices': devs_to_test,
+            'iperf_server': iperf_server,
+            'port_start': port_start,
+            'runtime': runtime,
+            'engine': engine,
+            'chunk_size': chunk_size
+            }
+        telemetry_fn = PurePath(outdir).joinpath('iperf-telemetry-{idx}.json'.format(idx=idx))
+        telemetry = None
+        output_fns = [telemetry_fn]
+        if checkpoint is not None:
+            telemetry = checkpoint.completed(key, params)
+        resumed = telemetry is not None
+        if not resumed:
+            with TelemetrySampler() as sampler:
+                if engine == 'sendfile':
+                    results = run_sendfile_streams(commands, runtime, chunk_size, IPERF_TIMEOUT_GRACE)
+                else:
+                    results = run_processes(commands, runtime + IPERF_TIMEOUT_GRACE)
+            sampler.save(telemetry_fn)
+            telemetry = {'count': idx}
+            telemetry.update(sampler.summary())
+            if sink_control is not None:
+                sink_fn = save_sink_summary(iperf_server, sink_control, outdir, idx)
+                if sink_fn is not None:
+                    output_fns.append(sink_fn)
+        else:
+            results = [
+                {
+                    'cmd': cmd,
+                    'output_fn': i[-1],
+                    'returncode': 0,
+                    'timed_out': False,
+                    'stderr': ''
+                    }
+                for cmd, i in zip(stream_cmds, commands)
+                ]
+        telemetry_output.append(telemetry)
+
+        bws = []
+        device_intervals = {}
+        for device, result in zip(devs_to_test, results):
+            print("analysing: {output_fn}".format(output_fn=result['output_fn']))
+            data = read_iperf_output(result)
+            bw, total_bw = (None, None) if data is None else stream_bw(data, omit)
+            bws.append(bw)
+            if omit and bw is not None:
+                print("  {device}: {bw:.1f} MB/s steady state, {total_bw:.1f} MB/s over the whole run".format(
+                    device=device,
+                    bw=bw / 8000000,
+                    total_bw=total_bw / 8000000
                     )
                 )
-            print("analysing: {output_fn}".format(output_fn=output_fn))
-            f = open(output_fn, 'r')
-            data = json.load(f)
-
-            bw = data['end']['sum_sent']['bits_per_second']
+            if data is not None and stream_intervals(data):
+                device_intervals[device] = stream_intervals(data)
 
             summary_output.append(
                 {
                     'count': idx,
                     'device': device,
-                    'bw': bw / 8000000
+                    'bw': 0 if bw is None else bw / 8000000,
+                    'timestamp': time.time()
                 }
             )
             if cleanup:
-                Path(output_fn).unlink()
+                Path(result['output_fn']).unlink()
+
+        plateau = plot_timeline(device_intervals, idx, iperf_server, omit, outdir, network_line_rate, plot_format)
+        if plateau is not None:
+            print("Aggregate bandwidth with {idx} device(s) plateaus after {plateau:.1f}s{omitted}".format(
+                idx=idx,
+                plateau=plateau,
+                omitted='' if not omit else ' ({omit}s omitted)'.format(omit=omit)
+                )
+            )
+
+        # Steps with a failed stream are left out so that they run again
+        if checkpoint is not None and not resumed and None not in bws:
+            checkpoint.record(
+                key, params, [i['output_fn'] for i in results] + output_fns, telemetry
+                )
 
         for device in devices:
             if device not in devs_to_test:
@@ -85,19 +282,41 @@ def run_iperf(iperf_exe, iperf_server, devices, port_start, cleanup, outdir, run
                 }
             )
 
-    return summary_output
+    return summary_output, telemetry_output
         
-def plot_bar(summary, plot, iperf_server, devices, port_start, cleanup, outdir, runtime, network_line_rate):
+def results_rows(summary, iperf_server, engine=DEFAULT_ENGINE, omit=0):
+    """
+    Results database rows for the devices streamed at each device count.
+    """
+    return [
+        {
+            'target': i['device'],
+            'mode': 'sendfile',
+            'count': i['count'],
+            'bw': i['bw'],
+            'timestamp': i['timestamp'],
+            'workload': '{engine} server={iperf_server}{omit}'.format(
+                engine=engine,
+                iperf_server=iperf_server,
+                omit='' if not omit else ' omit={omit}s'.format(omit=omit)
+                )
+            }
+        # Inactive devices are padded in without a timestamp
+        for i in summary if 'timestamp' in i
+        ]
+
+def plot_bar(summary, plot, iperf_server, devices, port_start, cleanup, outdir, runtime, network_line_rate,
+             plot_format=DEFAULT_PLOT_FORMAT, telemetry=None):
     print("Making {name} plot".format(name=plot['name']))
-    labels = [ str(i) for i in range(1, len(devices) + 1) ]
+    counts, _, values = pivot(
+        summary, 'device', plot['varname'], devices,
+        list(range(1, len(devices) + 1))
+        )
+    labels = [ str(i) for i in counts ]
     fig, ax = plt.subplots()
-    cum_size = [0] * len(devices)
-    for device in devices:
-        values = [i[plot['varname']] for i in summary if i['device'] == device]
-        ax.bar(labels, values, bottom=cum_size, width=0.9, label=device)
-
-        for a,b in enumerate(cum_size):
-            cum_size[a] += values[a]
+    bottoms = stack_bottoms(values)
+    for idx, device in enumerate(devices):
+        ax.bar(labels, values[:, idx], bottom=bottoms[:, idx], width=0.9, label=device)
 
     if network_line_rate:
         lr_mb = network_line_rate * 125
@@ -108,6 +327,10 @@ def plot_bar(summary, plot, iperf_server, devices, port_start, cleanup, outdir,
                 network_line_rate=network_line_rate
                 )
             )
+    if telemetry:
+        overlay_telemetry(
+            ax, labels, sorted(telemetry, key=lambda k: k['count']), plot['varname'] == 'bw'
+            )
     ax.tick_params(axis='x', which='major', labelsize=4)
     ax.set_title(plot['title'].format(
         hostname=socket.gethostname(),
@@ -116,8 +339,11 @@ def plot_bar(summary, plot, iperf_server, devices, port_start, cleanup, outdir,
     )
     ax.set_ylabel(plot['y_label'])
     ax.set_xlabel('Devices active')
-    ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
-    fig.savefig(
+    ax.legend(
+        bbox_to_anchor=(OVERLAY_LEGEND_X if telemetry else 1.04, 1), loc="upper left"
+        )
+    save_figure(
+        fig,
         PurePath(
             outdir
             ).joinpath(
@@ -125,9 +351,8 @@ def plot_bar(summary, plot, iperf_server, devices, port_start, cleanup, outdir,
                 hostname=socket.gethostname(),
                 name=plot['name'],
                 )
-            ), 
-            dpi=1000, 
-            bbox_inches='tight'
+            ),
+        plot_format
         )
     
 def make_output_directory(outdir):
@@ -144,9 +369,52 @@ def check_block_devices(devices):
                 device=device)
                 )
 
-def run_sendfile_client(iperf_exe, iperf_server, devices, port_start, cleanup, outdir, runtime, network_line_rate):
+def run_sendfile_client(iperf_exe, iperf_server, devices, port_start, cleanup, outdir, runtime, network_line_rate,
+                        plot_format=DEFAULT_PLOT_FORMAT, results_db=None, resume=False, dry_run=False,
+                        engine=DEFAULT_ENGINE, chunk_size=DEFAULT_CHUNK_SIZE, loopback=False, sink_control=None,
+                        omit=0):
+    started = time.time()
     check_block_devices(devices)
+    check_resume(resume, cleanup)
+    if omit >= runtime:
+        sys.exit("--omit {omit}s leaves nothing of the {runtime}s runtime to measure".format(
+            omit=omit,
+            runtime=runtime
+            )
+        )
+    if loopback:
+        if engine != 'sendfile':
+            sys.exit("--loopback needs --engine sendfile")
+        iperf_server = '127.0.0.1'
+    if sink_control is not None and engine != 'sendfile':
+        # The sink only receives sendfile streams, iperf3 clients need iperf3 servers
+        sys.exit("--sink-control needs --engine sendfile")
+    if dry_run:
+        print_plan('send-file client', plan_steps(iperf_exe, iperf_server, devices, port_start, runtime,
+                                                  engine, chunk_size),
+                   results_db)
+        return
     outdir = make_output_directory(outdir)
-    summary = run_iperf(iperf_exe, iperf_server, devices, port_start, cleanup, outdir, runtime)
+    checkpoint = None if cleanup else Checkpoint(outdir, 'send-file-client', resume)
+    if sink_control is not None:
+        # Start from a clean summary, without connections from earlier runs
+        try:
+            read_sink_summary(iperf_server, sink_control)
+        except (OSError, ValueError) as e:
+            sys.exit("Could not reach the sink summary at {iperf_server}:{sink_control}: {error}".format(
+                iperf_server=iperf_server,
+                sink_control=sink_control,
+                error=e
+                )
+            )
+    with ExitStack() as stack:
+        if loopback:
+            stack.enter_context(LoopbackSink(range(port_start, port_start + len(devices)), chunk_size))
+        summary, telemetry = run_iperf(iperf_exe, iperf_server, devices, port_start, cleanup, outdir, runtime,
+                                       checkpoint, engine, chunk_size, sink_control, omit, network_line_rate,
+                                       plot_format)
+    if results_db is not None:
+        record_run(results_db, 'send-file client', results_rows(summary, iperf_server, engine, omit), started)
     for plot in PLOTS:
-   	    plot_bar(summary, plot, iperf_server, devices, port_start, cleanup, outdir, runtime, network_line_rate)
+   	    plot_bar(summary, plot, iperf_server, devices, port_start, cleanup, outdir, runtime, network_line_rate, plot_format,
+                 telemetry)
@@ -1,50 +1,223 @@
-from pathlib import Path, PurePath
+from pathlib import PurePath
+import json
 import os
 import psutil
 import shlex
-import signal
+import socket
 import subprocess
+import sys
 import tempfile
+import time
 
 PID_TEMPDIR = PurePath(
     tempfile.gettempdir()
     ).joinpath("tmp.fio_perftest")
 
-def run_sendfile_server(iperf_exe, device_count, port_start):
-    
+# port -> {pid, started} of every server in the pool
+STATE_FILE = PID_TEMPDIR.joinpath("iperf-servers.json")
+
+# How long servers get to start listening, and to exit on SIGTERM
+# before they are killed.
+READY_TIMEOUT = 10
+STOP_TIMEOUT = 5
+READY_POLL_INTERVAL = 0.1
+
+def load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return {int(port): server for port, server in json.load(f)['servers'].items()}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def save_state(servers):
     os.makedirs(PID_TEMPDIR, exist_ok = True)
-    
-    for port_idx in range(device_count):
-        
-        pid_tempfile = PID_TEMPDIR.joinpath("fio." + str(port_idx) + ".pid")    
-        
+    tmp_fn = "{state_file}.tmp".format(state_file=STATE_FILE)
+    with open(tmp_fn, 'w') as f:
+        json.dump({'servers': {str(port): server for port, server in sorted(servers.items())}}, f, indent=1)
+    os.replace(tmp_fn, STATE_FILE)
+
+def server_process(server):
+    """
+    The psutil process for a server in the state file, or None if it has
+    exited. The start time guards against the pid having been reused.
+    """
+    try:
+        proc = psutil.Process(server['pid'])
+        if abs(proc.create_time() - server['started']) > 1:
+            return None
+        return proc
+    except psutil.NoSuchProcess:
+        return None
+
+def port_in_use(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        # As the servers do, so that connections in TIME_WAIT do not count
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(('', port))
+        except OSError:
+            return True
+    return False
+
+def port_ready(port):
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=READY_POLL_INTERVAL):
+            return True
+    except OSError:
+        return False
+
+def wait_ready(procs, timeout=READY_TIMEOUT):
+    """
+    Wait for every {port: Popen} server to accept a local connection.
+    Returns the ports that exited or were still not listening at the
+    deadline.
+    """
+    pending = dict(procs)
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for port, proc in list(pending.items()):
+            if proc.poll() is not None:
+                print("Server on port {port} exited with code {returncode}".format(
+                    port=port,
+                    returncode=proc.returncode
+                    )
+                )
+                return list(pending)
+            if port_ready(port):
+                del pending[port]
+        if pending:
+            time.sleep(READY_POLL_INTERVAL)
+    return list(pending)
+
+def stop_servers(servers, timeout=STOP_TIMEOUT):
+    """
+    SIGTERM the {port: server} servers still running, then SIGKILL any
+    that have not exited after timeout.
+    """
+    # A sink serves several ports from one process
+    procs = {}
+    for server in servers.values():
+        proc = server_process(server)
+        if proc is not None:
+            procs[proc.pid] = proc
+    procs = list(procs.values())
+    for proc in procs:
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(procs, timeout=timeout)
+    for proc in alive:
+        print("Server {pid} ignored SIGTERM, killing it".format(pid=proc.pid))
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+    psutil.wait_procs(alive, timeout=timeout)
+
+def sink_command(port_start, device_count, control_port):
+    return [
+        sys.executable, '-m', 'ceph_perftest.send_file.sink',
+        str(port_start), str(device_count), str(control_port)
+        ]
+
+def run_sendfile_server(iperf_exe, device_count, port_start, sink=False, control_port=None):
+    """
+    Start device_count iperf3 servers on consecutive ports from
+    port_start or, with sink, one receiver process listening on all of
+    them plus control_port for its summary.
+    """
+    servers = {
+        port: server for port, server in load_state().items() if server_process(server) is not None
+        }
+    ports = list(range(port_start, port_start + device_count))
+    if sink:
+        if control_port is None:
+            control_port = port_start - 1
+        ports.append(control_port)
+
+    running = [i for i in ports if i in servers]
+    if running:
+        sys.exit("Servers already running on port(s) {ports}; stop them first".format(
+            ports=",".join(str(i) for i in running)
+            )
+        )
+    conflicts = [i for i in ports if port_in_use(i)]
+    if conflicts:
+        sys.exit("Port(s) {ports} already in use, quitting".format(
+            ports=",".join(str(i) for i in conflicts)
+            )
+        )
+
+    procs = {}
+    if sink:
+        print(" ".join(sink_command(port_start, device_count, control_port)))
+        proc = subprocess.Popen(
+            sink_command(port_start, device_count, control_port),
+            stdin = subprocess.DEVNULL,
+            stdout = subprocess.DEVNULL,
+            stderr = subprocess.DEVNULL,
+            start_new_session = True
+            )
+        procs = {port: proc for port in ports}
+    for port in ([] if sink else ports):
         # iperf3 -s -p $((5200 + $i)) &
-        iperf_server_cmd = "{iperf_exe} -s -D -p {iperf_server_port} -I {pidfile_path}".format(
+        iperf_server_cmd = "{iperf_exe} -s -p {iperf_server_port}".format(
             iperf_exe = iperf_exe,
-            iperf_server_port = port_start + port_idx,
-            pidfile_path = pid_tempfile
+            iperf_server_port = port
             )
-    
         print(iperf_server_cmd)
-    
-        subprocess.Popen(
+        # Own session so the servers outlive this command
+        procs[port] = subprocess.Popen(
             shlex.split(
-            iperf_server_cmd
+                iperf_server_cmd
+                ),
+            stdin = subprocess.DEVNULL,
+            stdout = subprocess.DEVNULL,
+            stderr = subprocess.DEVNULL,
+            start_new_session = True
             )
-        )
 
-def stop_sendfile_server():
-    
-    temp_pidfiles = sorted(
-        Path(PID_TEMPDIR).glob('*.pid')
-        )
+    started = {
+        port: {'pid': proc.pid, 'started': psutil.Process(proc.pid).create_time()}
+        for port, proc in procs.items()
+        if proc.poll() is None
+        }
+    servers.update(started)
+    save_state(servers)
 
-    for pidfile in temp_pidfiles:
-        with open(pidfile, 'r') as f:
-            pid = int(f.read().replace('\00', ''))
-            if psutil.pid_exists(pid):
-                if "iperf3" in psutil.Process(pid).exe():
-                    os.kill(pid, signal.SIGKILL)
+    failed = wait_ready(procs)
+    if failed:
+        stop_servers(started)
+        for port in started:
+            del servers[port]
+        save_state(servers)
+        sys.exit("Server(s) on port(s) {ports} did not start listening, stopped all {count}".format(
+            ports=",".join(str(i) for i in failed),
+            count=len(ports)
+            )
+        )
+    if sink:
+        print("Sink listening on ports {first}-{last}, summary on port {control_port}".format(
+            first=port_start,
+            last=port_start + device_count - 1,
+            control_port=control_port
+            )
+        )
+    else:
+        print("{count} iperf3 servers listening on ports {first}-{last}".format(
+            count=len(ports),
+            first=ports[0],
+            last=ports[-1]
+            )
+        )
 
-        os.unlink(pidfile)
-        print(pidfile)
+def stop_sendfile_server():
+    servers = load_state()
+    stop_servers(servers)
+    for port in sorted(servers):
+        print("Stopped server on port {port}".format(port=port))
+    try:
+        os.unlink(STATE_FILE)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,150 @@
+"""
+Single-process receiver for send-file streams.
+
+    python -m ceph_perftest.send_file.sink PORT_START COUNT CONTROL_PORT [BUFFER_SIZE]
+
+Listens on COUNT consecutive ports from PORT_START and discards what it
+receives, accounting bytes and time per port and per connection. A
+connection to CONTROL_PORT gets the JSON summary; sending "reset\n"
+first also clears it, so that each tranche of a sweep can be read on
+its own. Started by `send-file server start --sink`.
+"""
+import asyncio
+import json
+import signal
+import socket
+import sys
+import time
+
+DEFAULT_SINK_BUFFER = 1024 * 1024
+
+CONTROL_TIMEOUT = 1
+
+def conn_bits_per_second(conn):
+    # From the connection's first to last data, whether or not the sink
+    # has seen it close yet
+    if conn['first'] is None or conn['last'] <= conn['first']:
+        return 0
+    return conn['bytes'] * 8 / (conn['last'] - conn['first'])
+
+class Sink:
+    def __init__(self, buffer_size=DEFAULT_SINK_BUFFER):
+        self.buffer_size = buffer_size
+        self.buffers = {}
+        self.connections = []
+
+    def buffer(self, port):
+        # Received data is discarded, so every connection on a port
+        # reads into the same buffer
+        if port not in self.buffers:
+            self.buffers[port] = bytearray(self.buffer_size)
+        return self.buffers[port]
+
+    def summary(self):
+        # Leave out readiness probes, which connect and close without data
+        connections = [i for i in self.connections if i['bytes'] or i['closed'] is None]
+        ports = {}
+        for conn in connections:
+            port = ports.setdefault(str(conn['port']), {'connections': 0, 'bytes': 0, 'bits_per_second': 0})
+            port['connections'] += 1
+            port['bytes'] += conn['bytes']
+            port['bits_per_second'] += conn_bits_per_second(conn)
+        return {
+            'time': time.time(),
+            'ports': ports,
+            'connections': [dict(i, bits_per_second=conn_bits_per_second(i)) for i in connections]
+            }
+
+    async def handle_control(self, reader, writer):
+        try:
+            command = await asyncio.wait_for(reader.readline(), CONTROL_TIMEOUT)
+        except asyncio.TimeoutError:
+            command = b''
+        writer.write(json.dumps(self.summary()).encode())
+        if command.strip() == b'reset':
+            # Keep connections still open, they may yet receive data,
+            # but count only what arrives after this summary in the next
+            # one; a finished stream whose close hasn't been seen yet
+            # then drops out with the probes.
+            self.connections = [i for i in self.connections if i['closed'] is None]
+            for conn in self.connections:
+                conn.update(first=None, last=None, bytes=0)
+        await writer.drain()
+        writer.close()
+
+class SinkProtocol(asyncio.BufferedProtocol):
+    """
+    Drains one connection into its port's buffer, recording its bytes
+    and the times of its first and last data.
+    """
+    def __init__(self, sink, port):
+        self.sink = sink
+        self.port = port
+        self.buf = sink.buffer(port)
+        self.conn = None
+
+    def connection_made(self, transport):
+        peer = transport.get_extra_info('peername')
+        self.conn = {
+            'port': self.port,
+            'peer': '{host}:{port}'.format(host=peer[0], port=peer[1]) if peer else None,
+            'connected': time.time(),
+            'closed': None,
+            'first': None,
+            'last': None,
+            'bytes': 0
+            }
+        self.sink.connections.append(self.conn)
+
+    def get_buffer(self, sizehint):
+        return self.buf
+
+    def buffer_updated(self, nbytes):
+        now = time.time()
+        if self.conn['first'] is None:
+            self.conn['first'] = now
+        self.conn['last'] = now
+        self.conn['bytes'] += nbytes
+
+    def connection_lost(self, exc):
+        self.conn['closed'] = time.time()
+
+async def serve(port_start, count, control_port, buffer_size=DEFAULT_SINK_BUFFER):
+    sink = Sink(buffer_size)
+    loop = asyncio.get_running_loop()
+    servers = []
+    for port in range(port_start, port_start + count):
+        servers.append(await loop.create_server(
+            lambda port=port: SinkProtocol(sink, port), '', port, reuse_address=True
+            ))
+    servers.append(await asyncio.start_server(sink.handle_control, '', control_port, reuse_address=True))
+
+    stop = asyncio.Event()
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        loop.add_signal_handler(signum, stop.set)
+    await stop.wait()
+    for server in servers:
+        server.close()
+
+def read_sink_summary(host, control_port, reset=True):
+    """
+    The JSON summary of the sink at host, clearing its closed
+    connections if reset.
+    """
+    with socket.create_connection((host, control_port), timeout=CONTROL_TIMEOUT * 5) as sock:
+        sock.sendall(b'reset\n' if reset else b'\n')
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks))
+
+def main(argv):
+    port_start, count, control_port = [int(i) for i in argv[:3]]
+    buffer_size = int(argv[3]) if len(argv) > 3 else DEFAULT_SINK_BUFFER
+    asyncio.run(serve(port_start, count, control_port, buffer_size))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,128 @@
+import socket
+from pathlib import PurePath
+import matplotlib.pyplot as plt
+from ..render import DEFAULT_PLOT_FORMAT, save_figure
+
+# Aggregate bandwidth has plateaued once every later interval is within
+# this fraction of the mean of the second half of the run.
+PLATEAU_TOLERANCE = 0.1
+
+def stream_intervals(data):
+    """
+    (start, end, bytes) of each reporting interval in iperf3-shaped JSON
+    output, as written by iperf3 -J and the sendfile engine.
+    """
+    return [
+        (i['sum']['start'], i['sum']['end'], i['sum']['bytes'])
+        for i in data.get('intervals', [])
+        ]
+
+def steady_state_bw(intervals, omit):
+    """
+    Bits/s over the intervals after the first omit seconds of warm-up,
+    or None if there are none. An interval counts if its midpoint is past
+    omit, as interval boundaries drift slightly off whole seconds.
+    """
+    trimmed = [i for i in intervals if (i[0] + i[1]) / 2 >= omit]
+    seconds = sum(end - start for start, end, _ in trimmed)
+    if seconds <= 0:
+        return None
+    return sum(nbytes for _, _, nbytes in trimmed) * 8 / seconds
+
+def aggregate_timeline(device_intervals):
+    """
+    Interval start and end times and the summed MB/s of all streams in
+    each, with streams aligned by interval index as they all start
+    together.
+    """
+    length = max([len(i) for i in device_intervals.values()], default=0)
+    starts = []
+    ends = []
+    aggregate = []
+    for idx in range(length):
+        rows = [i[idx] for i in device_intervals.values() if idx < len(i)]
+        starts.append(min(start for start, _, _ in rows))
+        ends.append(max(end for _, end, _ in rows))
+        aggregate.append(sum(
+            nbytes / (end - start) / 1000000 for start, end, nbytes in rows if end > start
+            ))
+    return starts, ends, aggregate
+
+def plateau_time(starts, aggregate, tolerance=PLATEAU_TOLERANCE):
+    """
+    Start of the first interval from which aggregate bandwidth stays
+    within tolerance of its late-run level, or None for too short a run.
+    """
+    if len(aggregate) < 2:
+        return None
+    tail = aggregate[len(aggregate) // 2:]
+    level = sum(tail) / len(tail)
+    idx = len(aggregate)
+    while idx > 0 and abs(aggregate[idx - 1] - level) <= tolerance * level:
+        idx -= 1
+    if idx == len(aggregate):
+        return None
+    return starts[idx]
+
+def plot_timeline(device_intervals, idx, iperf_server, omit, outdir, network_line_rate=None,
+                  plot_format=DEFAULT_PLOT_FORMAT):
+    """
+    Per-device and aggregate bandwidth over time for one device count,
+    shading the omitted warm-up and marking where the aggregate
+    plateaus. Returns the plateau time.
+    """
+    starts, ends, aggregate = aggregate_timeline(device_intervals)
+    if not starts:
+        return None
+    plateau = plateau_time(starts, aggregate)
+    print("Making timeline plot for {idx} device(s)".format(idx=idx))
+    fig, ax = plt.subplots()
+    # Each interval's bandwidth is plotted at its midpoint
+    for device, intervals in device_intervals.items():
+        ax.plot(
+            [(start + end) / 2 for start, end, _ in intervals],
+            [nbytes / (end - start) / 1000000 if end > start else 0 for start, end, nbytes in intervals],
+            linewidth=0.8,
+            label=device
+            )
+    ax.plot(
+        [(start + end) / 2 for start, end in zip(starts, ends)],
+        aggregate,
+        color='black',
+        linewidth=1.5,
+        label='Aggregate'
+        )
+    if omit:
+        ax.axvspan(0, omit, color='grey', alpha=0.2, label='Omitted warm-up ({omit}s)'.format(omit=omit))
+    if plateau is not None:
+        ax.axvline(plateau, color='black', linestyle='--', linewidth=0.8,
+                   label='Plateau ({plateau:.1f}s)'.format(plateau=plateau))
+    if network_line_rate:
+        ax.axhline(network_line_rate * 125, color='red', linewidth=0.8,
+                   label="Network Line Rate ({network_line_rate} Gbps)".format(
+                       network_line_rate=network_line_rate
+                       ))
+    ax.set_title("{idx} disk(s) bandwidth over time\nClient: {hostname} | Server: {iperf_server}".format(
+        idx=idx,
+        hostname=socket.gethostname(),
+        iperf_server=iperf_server
+        )
+    )
+    ax.set_ylabel('Bandwidth (MB/s)')
+    ax.set_xlabel('Time (s)')
+    ax.set_xlim(left=0)
+    ax.set_ylim(bottom=0)
+    ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
+    save_figure(
+        fig,
+        PurePath(
+            outdir
+            ).joinpath(
+            '{hostname}-network-timeline-{idx}.png'.format(
+                hostname=socket.gethostname(),
+                idx=idx
+                )
+            ),
+        plot_format
+        )
+    return plateau
@@ -2,11 +2,24 @@ from binary import BinaryUnits, DecimalUnits, convert_units
 from pathlib import Path, PurePath
 import json
 import os
-import shlex
 import socket
 import sys
-import subprocess
+import time
 import matplotlib.pyplot as plt
+from ..fio_json import load_fio_output
+from ..fio_stream import STEADY_TOLERANCE, STEADY_WINDOW, run_fio_streaming
+from ..fio_job import fio_command, format_command, job_text, render_section, write_job_file
+from ..latency import PERCENTILES, clat_percentiles, percentile_name, plot_latency, stats_bins
+from ..aggregate import pivot, stack_bottoms
+from ..render import DEFAULT_PLOT_FORMAT, render_plots, save_figure
+from ..telemetry import OVERLAY_LEGEND_X, TELEMETRY_LINES, TelemetrySampler, overlay_telemetry
+from ..results_db import latency_columns, record_run
+from ..checkpoint import Checkpoint, check_resume
+from ..planner import new_step, print_plan
+from ..fio_matrix import check_matrix, combinations, io_type, matrix_name, section_name, \
+                         section_options
+from ..trials import DEFAULT_ERROR_BARS, REPEAT_CV_THRESHOLD, draw_error_bars, mean_record, \
+                     repeat_step, run_trials, trial_stats
 
 GLOBAL_CONFIG = [
         '[global]',
@@ -41,82 +54,291 @@ PLOTS = [
 	    }
     ]
 
-def run_fio(fio_exe, device, max_numjobs, cleanup, outdir, bs, mode, runtime, filesize):
-    summary_output = []
+# Minimum relative IOPS gain from adding jobs that still counts as
+# scaling when searching for the saturation point.
+SATURATION_THRESHOLD = 0.05
+
+SATURATION_TITLE = "\nSaturation: {saturation} jobs"
+
+LATENCY_TITLE = "Single Disk, Multiple Jobs\nCompletion Latency\nMode: {mode},BS: {bs} | Device: {device} | Host: {hostname}"
+
+def fio_config_fn(outdir, numjobs, combos, trial=1, repeat=1):
+    return PurePath(
+        outdir
+        ).joinpath(
+            "{hostname}-single-{mode}-{bs}-{numjobs}{trial}.fio".format(
+                hostname=socket.gethostname(),
+                mode=matrix_name(i[1] for i in combos),
+                bs=matrix_name(i[0] for i in combos),
+                numjobs=numjobs,
+                trial='' if repeat == 1 else '-trial{trial}'.format(trial=trial)
+                )
+            )
+
+def render_fio_config(device, combos, runtime, filesize):
+    """
+    Job file lines for one step against device (numjobs is given on the
+    fio command line), and the combo each job name in fio's output
+    belongs to.
+    """
     device_name = os.path.basename(device)
-    for numjobs in range(1, max_numjobs + 1):
-        config_fn = PurePath(
-            outdir
-            ).joinpath(
-                "{hostname}-single-{mode}-{bs}-{numjobs}.fio".format(
-                    hostname=socket.gethostname(),
-                    mode=mode,
-                    bs=bs,
-                    numjobs=numjobs
-                    )
+    config = render_section(GLOBAL_CONFIG, bs=combos[0][0], runtime=runtime, filesize=filesize)
+    jobnames = {}
+    for combo_idx, combo in enumerate(combos):
+        section = section_name(device_name, combo, combos)
+        jobnames["single-disk-write-{section}".format(section=section)] = combo
+        config.extend(render_section(DEVICE_CONFIG, mode=combo[1], device_name=section, device=device))
+        config.extend(section_options(combos, combo_idx))
+    return config, jobnames
+
+def run_fio_step(fio_exe, device, numjobs, cleanup, outdir, combos, runtime, filesize,
+                 steady_state=False, steady_window=STEADY_WINDOW, steady_tolerance=STEADY_TOLERANCE,
+                 trial=1, repeat=1, checkpoint=None):
+    """
+    Run fio once with numjobs jobs for every (bs, mode) combination in
+    combos, each a stonewall-separated section of one job file. Returns
+    {combo: (jobs, latency, series, telemetry)}, where series is the
+    status series and telemetry the telemetry summary of the whole step.
+
+    The job is piped to fio on stdin and its output parsed as it
+    arrives; the job and output files are only written to outdir when
+    not cleaning up. A step already completed in checkpoint is not run
+    again; its results are read back from its output files.
+    """
+    config_fn = fio_config_fn(outdir, numjobs, combos, trial, repeat)
+    config, jobnames = render_fio_config(device, combos, runtime, filesize)
+
+    params = {
+        'device': device,
+        'numjobs': numjobs,
+        'combos': combos,
+        'runtime': runtime,
+        'filesize': filesize,
+        'steady_state': steady_state
+        }
+    output_fn = "{config_fn}.output.json".format(config_fn=config_fn)
+    telemetry = None
+    if checkpoint is not None:
+        telemetry = checkpoint.completed(config_fn.name, params)
+    if telemetry is None:
+        if not cleanup:
+            # Kept for reference and re-running by hand; fio itself
+            # reads the job from stdin
+            write_job_file(config_fn, config)
+
+        fio_cmd = fio_command(fio_exe, ['--numjobs={numjobs}'.format(numjobs=numjobs)])
+        print("Running fio...")
+        print(format_command(fio_cmd, None if cleanup else config_fn))
+        with TelemetrySampler() as sampler:
+            series, _, data = run_fio_streaming(
+                fio_cmd,
+                None if cleanup else output_fn,
+                list(dict.fromkeys(io_type(i[1]) for i in combos)),
+                steady_state, steady_window, steady_tolerance,
+                job_text(config)
                 )
-        config = []
-        for line in DEVICE_CONFIG:
-            config.append(
-                line.format(
-                    mode=mode,
-                    device_name=device_name,
-                    device=device
-                    )
+        if data is None:
+            sys.exit("fio gave no output for {config_fn}".format(config_fn=config_fn.name))
+        telemetry = {'count': numjobs}
+        telemetry.update(sampler.summary())
+        if not cleanup:
+            with open("{config_fn}.status.json".format(config_fn=config_fn), "w") as f:
+                json.dump(series, f)
+            sampler.save("{config_fn}.telemetry.json".format(config_fn=config_fn))
+
+        if checkpoint is not None:
+            checkpoint.record(
+                config_fn.name, params,
+                ["{config_fn}.{suffix}.json".format(config_fn=config_fn, suffix=i)
+                 for i in ['output', 'status', 'telemetry']],
+                telemetry
                 )
-            with open(config_fn, "w") as f:
-                for line in GLOBAL_CONFIG:
-                    line = line.format(
-                        bs=bs,
-                        runtime=runtime,
-                        filesize=filesize
-                    )
-                    f.write(line+'\n')
-                for line in config:
-                    f.write(line+'\n')
+    else:
+        with open("{config_fn}.status.json".format(config_fn=config_fn)) as f:
+            series = json.load(f)
+        data = load_fio_output(output_fn, latency_bins=True)
 
-        fio_cmd = "{fio_exe} --numjobs={numjobs} --output={config_fn}.output.json {config_fn} --output-format=json+".format(
-                fio_exe=fio_exe,
-                numjobs=numjobs,
-                config_fn=config_fn
+    step = {}
+    for combo in combos:
+        _mode = io_type(combo[1])
+        combo_jobs = [i for i in data['jobs'] if jobnames.get(i['jobname']) == combo]
+        latency = {'count': numjobs, 'timestamp': data.get('timestamp') or time.time()}
+        latency.update(clat_percentiles(stats_bins(combo_jobs, _mode)))
+        step[combo] = ([i[_mode] for i in combo_jobs], latency, series, telemetry)
+
+    return step
+
+def plan_steps(fio_exe, device, numjobs_values, outdir, combos, runtime, filesize):
+    steps = []
+    for numjobs in numjobs_values:
+        config_fn = fio_config_fn(outdir, numjobs, combos)
+        config, _ = render_fio_config(device, combos, runtime, filesize)
+        steps.append(new_step(
+            'numjobs {numjobs}'.format(numjobs=numjobs),
+            int(runtime) * len(combos),
+            [(device, combo_mode, combo_bs, numjobs, int(runtime)) for combo_bs, combo_mode in combos],
+            files=[(config_fn, config)],
+            commands=[format_command(
+                fio_command(fio_exe, ['--numjobs={numjobs}'.format(numjobs=numjobs)]), config_fn
+                )]
+            ))
+    return steps
+
+def geometric_grid(max_numjobs):
+    grid = []
+    numjobs = 1
+    while numjobs < max_numjobs:
+        grid.append(numjobs)
+        numjobs *= 2
+    grid.append(max_numjobs)
+    return grid
+
+def find_saturation(probe, max_numjobs, threshold):
+    """
+    Find the smallest numjobs after which adding jobs gains less than
+    threshold (relative) in performance, calling probe(numjobs) for each
+    point tested. Probes a geometric grid until scaling stops, then
+    bisects between the last two grid points. Returns None if
+    performance is still scaling at max_numjobs.
+    """
+    perf = {}
+    grid = geometric_grid(max_numjobs)
+    lo = None
+    hi = grid[0]
+    perf[hi] = probe(hi)
+    for numjobs in grid[1:]:
+        perf[numjobs] = probe(numjobs)
+        if perf[numjobs] < perf[hi] * (1 + threshold):
+            break
+        lo = hi
+        hi = numjobs
+    else:
+        return None
+
+    plateau = perf[hi]
+    while lo is not None and hi - lo > 1:
+        mid = (lo + hi) // 2
+        perf[mid] = probe(mid)
+        if plateau < perf[mid] * (1 + threshold):
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+def total_iops(result):
+    """
+    Total IOPS over all jobs of each combination in a step's result.
+    """
+    return [sum(i['iops'] for i in jobs) for jobs, _, _, _ in result.values()]
+
+def run_fio(fio_exe, device, max_numjobs, cleanup, outdir, bs, mode, runtime, filesize,
+            adaptive=False, saturation_threshold=SATURATION_THRESHOLD,
+            steady_state=False, steady_window=STEADY_WINDOW, steady_tolerance=STEADY_TOLERANCE,
+            repeat=1, shuffle=False, cv_threshold=REPEAT_CV_THRESHOLD, checkpoint=None):
+    """
+    Run every numjobs value (or the adaptive search) for every
+    combination of bs and mode (each a value or a list), returning
+    ({(bs, mode): (summary, latency, telemetry, trials)}, saturation).
+    """
+    combos = combinations(bs, mode)
+    results = {}
+
+    def run_step(numjobs, trial):
+        return run_fio_step(fio_exe, device, numjobs, cleanup,
+                            outdir, combos, runtime, filesize,
+                            steady_state, steady_window, steady_tolerance,
+                            trial, repeat, checkpoint)
+
+    def probe(numjobs):
+        results[numjobs] = repeat_step(numjobs, run_step, total_iops, repeat, cv_threshold)
+        return trial_stats([total_iops(i)[0] for i in results[numjobs]])['mean']
+
+    saturation = None
+    if adaptive:
+        saturation = find_saturation(probe, max_numjobs, saturation_threshold)
+        if saturation is None:
+            print("No saturation point found up to {max_numjobs} jobs".format(
+                max_numjobs=max_numjobs
+                )
             )
-        print("Running fio...")
-        print(fio_cmd)
-        subprocess.run(
-            shlex.split(
-                fio_cmd
-                ), 
-                stderr = subprocess.DEVNULL, stdout = subprocess.DEVNULL
+        else:
+            print("Saturation point: {saturation} jobs".format(
+                saturation=saturation
+                )
             )
-        
-        f = open("{config_fn}.output.json".format(
-            config_fn=config_fn
+    else:
+        results.update(
+            run_trials(list(range(1, max_numjobs + 1)), run_step, total_iops,
+                       repeat, shuffle, cv_threshold)
             )
-        )
-        
-        data = json.load(f)
-        _mode = mode
-        if _mode == 'randread':
-            _mode = 'read'
-        elif _mode == 'randwrite':
-            _mode = 'write'
-        jobs = [i[mode] for i in data['jobs']]
-
-        if cleanup:
-            Path(config_fn).unlink()
-            Path(
-                "{config_fn}.output.json".format(
-                    config_fn=config_fn
+
+    outputs = {}
+    for combo in combos:
+        outputs[combo] = summarise_trials(
+            {numjobs: [i[combo] for i in trials] for numjobs, trials in results.items()},
+            max_numjobs
+            )
+    return outputs, saturation
+
+def summarise_trials(results, max_numjobs):
+    """
+    Per-job summary, mean latency and telemetry and per-trial totals of
+    one combination from {numjobs: [(jobs, latency, series, telemetry), ...]}.
+    """
+    summary_output = []
+    latency_output = []
+    telemetry_output = []
+    trials_output = []
+
+    for numjobs in range(1, max_numjobs + 1):
+        if numjobs not in results:
+            # Skipped by the adaptive search, shown as a gap in the plots
+            for job_idx in range(1, max_numjobs + 1):
+                summary_output.append(
+                    {
+                        'count': numjobs,
+                        'job': job_idx,
+                        'bw' : float('nan'),
+                        'iops': float('nan')
+                    }
+                )
+            latency = {'count': numjobs}
+            latency.update(
+                {percentile_name(p): float('nan') for p in PERCENTILES}
+                )
+            latency_output.append(latency)
+            telemetry = {'count': numjobs}
+            telemetry.update({i['varname']: float('nan') for i in TELEMETRY_LINES})
+            telemetry_output.append(telemetry)
+            continue
+
+        trials = results[numjobs]
+        latency_output.append(mean_record([i[1] for i in trials]))
+        telemetry_output.append(mean_record([i[3] for i in trials]))
+        for trial, (jobs, latency, _, _) in enumerate(trials, 1):
+            bw, _ = convert_units(
+                    sum(i['bw'] for i in jobs),
+                    unit=BinaryUnits.KB,
+                    to=DecimalUnits.MB
                     )
-                ).unlink()
+            trials_output.append(
+                {
+                    'count': numjobs,
+                    'trial': trial,
+                    'bw': bw,
+                    'iops': sum(i['iops'] for i in jobs),
+                    'latency': latency
+                }
+            )
 
         for job_idx in range(1, max_numjobs + 1):
             # job_idx is one-based for display purposes
-            if job_idx <= numjobs:                
+            if job_idx <= numjobs:
+                # Back to zero-based to get the list element
+                job_trials = [i[0][job_idx - 1] for i in trials]
                 bw, _ = convert_units(
-                        # Back to zero-based to get the list element
-                        jobs[job_idx - 1]['bw'], 
-                        unit=BinaryUnits.KB, 
+                        trial_stats([i['bw'] for i in job_trials])['mean'],
+                        unit=BinaryUnits.KB,
                         to=DecimalUnits.MB
                         )
                 summary_output.append(
@@ -124,8 +346,7 @@ def run_fio(fio_exe, device, max_numjobs, cleanup, outdir, bs, mode, runtime, fi
                         'count': numjobs,
                         'job': job_idx,
                         'bw' : bw,
-                        # Back to zero-based to get the list element
-                        'iops': jobs[job_idx - 1]['iops']
+                        'iops': trial_stats([i['iops'] for i in job_trials])['mean']
                     }
                 )
             else:
@@ -137,34 +358,75 @@ def run_fio(fio_exe, device, max_numjobs, cleanup, outdir, bs, mode, runtime, fi
                         'iops': 0
                     }
                 )
-    
-    return summary_output
-        
-def plot_bar(plot, summary, device, max_numjobs, outdir, bs, mode):
+
+    return summary_output, latency_output, telemetry_output, trials_output
+
+def results_rows(trials, device, bs, mode):
+    """
+    Results database rows, one per trial of each numjobs value tested
+    with the total over all jobs.
+    """
+    rows = []
+    for trial in trials:
+        row = {
+            'target': device,
+            'mode': mode,
+            'bs': bs,
+            'numjobs': trial['count'],
+            'iodepth': 1,
+            'count': trial['count'],
+            'bw': trial['bw'],
+            'iops': trial['iops'],
+            'timestamp': trial['latency']['timestamp'],
+            'workload': 'trial={trial}'.format(trial=trial['trial'])
+            }
+        row.update(latency_columns(trial['latency']))
+        rows.append(row)
+    return rows
+
+def plot_bar(plot, summary, device, max_numjobs, outdir, bs, mode, saturation=None,
+             plot_format=DEFAULT_PLOT_FORMAT, trials=None, error_bars=DEFAULT_ERROR_BARS,
+             telemetry=None):
     print("Making {name} plot".format(name=plot['name']))
     device_name = os.path.basename(device)
-    labels = [ str(i) for i in range(1, max_numjobs + 1) ]
+    counts, job_idxs, values = pivot(
+        summary, 'job', plot['varname'],
+        list(range(1, max_numjobs + 1)),
+        list(range(1, max_numjobs + 1))
+        )
+    labels = [ str(i) for i in counts ]
     fig, ax = plt.subplots()
-    cum_size = [0] * max_numjobs
-    for numjobs in range(1, max_numjobs + 1):
-        values = [i[plot['varname']] for i in summary if i['job'] == numjobs]
-        ax.bar(labels, values, bottom=cum_size, width=0.9, label=numjobs)
-
-        for a,b in enumerate(cum_size):
-            cum_size[a] += values[a]
+    bottoms = stack_bottoms(values)
+    for idx, job_idx in enumerate(job_idxs):
+        ax.bar(labels, values[:, idx], bottom=bottoms[:, idx], width=0.9, label=job_idx)
+    if trials and any(i['trial'] > 1 for i in trials):
+        draw_error_bars(
+            ax, labels,
+            [[i[plot['varname']] for i in trials if i['count'] == count] for count in counts],
+            error_bars
+            )
+    if telemetry:
+        overlay_telemetry(ax, labels, sorted(telemetry, key=lambda k: k['count']))
 
+    title = plot['title']
+    if saturation is not None:
+        title += SATURATION_TITLE
     ax.tick_params(axis='x', which='major', labelsize=4)
-    ax.set_title(plot['title'].format(
+    ax.set_title(title.format(
         device=device,
         bs=bs,
         hostname=socket.gethostname(),
-        mode=mode
+        mode=mode,
+        saturation=saturation
         )
     )
     ax.set_ylabel(plot['y_label'])
     ax.set_xlabel('Jobs active')
-    ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
-    fig.savefig(
+    ax.legend(
+        bbox_to_anchor=(OVERLAY_LEGEND_X if telemetry else 1.04, 1), loc="upper left"
+        )
+    save_figure(
+        fig,
         PurePath(
             outdir
             ).joinpath(
@@ -175,9 +437,8 @@ def plot_bar(plot, summary, device, max_numjobs, outdir, bs, mode):
                 name=plot['name'],
                 bs=bs
                 )
-            ), 
-            dpi=1000, 
-            bbox_inches='tight'
+            ),
+        plot_format
         )
     
 def make_output_directory(outdir):
@@ -195,10 +456,75 @@ def check_block_devices(device):
         )
 
 def run_single_device(fio_exe, device, max_numjobs, cleanup, 
-                      outdir, bs, mode, runtime, filesize):
+                      outdir, bs, mode, runtime, filesize,
+                      adaptive=False, saturation_threshold=SATURATION_THRESHOLD,
+                      plot_format=DEFAULT_PLOT_FORMAT, jobs=1, steady_state=False,
+                      steady_window=STEADY_WINDOW, steady_tolerance=STEADY_TOLERANCE,
+                      results_db=None, repeat=1, shuffle=False, cv_threshold=REPEAT_CV_THRESHOLD,
+                      error_bars=DEFAULT_ERROR_BARS, resume=False, dry_run=False):
+    started = time.time()
     check_block_devices(device)
+    combos = combinations(bs, mode)
+    check_matrix(combos, adaptive=adaptive, steady_state=steady_state)
+    check_resume(resume, cleanup)
+    if dry_run:
+        if adaptive:
+            # The grid is always probed; bisection adds at most one step
+            # per halving of the widest gap between grid points
+            grid = geometric_grid(max_numjobs)
+            gap = max([j - i for i, j in zip(grid, grid[1:])], default=1)
+            steps = plan_steps(fio_exe, device, grid, Path(outdir).resolve(), combos, runtime, filesize)
+            extra_steps = max(gap - 1, 0).bit_length()
+        else:
+            steps = plan_steps(fio_exe, device, range(1, max_numjobs + 1), Path(outdir).resolve(), combos,
+                               runtime, filesize)
+            extra_steps = 0
+        print_plan('single-device', steps, results_db, repeat, extra_steps, steady_state)
+        return
     outdir = make_output_directory(outdir)
-    summary = run_fio(fio_exe, device, max_numjobs, cleanup, 
-                      outdir, bs, mode, runtime, filesize)
-    for plot in PLOTS:
-   	    plot_bar(plot, summary, device, max_numjobs, outdir, bs, mode)
+    checkpoint = None if cleanup else Checkpoint(outdir, 'single-device', resume)
+    outputs, saturation = run_fio(fio_exe, device, max_numjobs, cleanup,
+                                  outdir, bs, mode, runtime, filesize,
+                                  adaptive, saturation_threshold,
+                                  steady_state, steady_window, steady_tolerance,
+                                  repeat, shuffle, cv_threshold, checkpoint)
+    if results_db is not None:
+        rows = []
+        for (combo_bs, combo_mode), (_, _, _, trials) in outputs.items():
+            rows.extend(results_rows(trials, device, combo_bs, combo_mode))
+        record_run(results_db, 'single-device', rows, started)
+    latency_title = LATENCY_TITLE
+    if saturation is not None:
+        latency_title += SATURATION_TITLE
+    calls = []
+    for (combo_bs, combo_mode), (summary, latency, telemetry, trials) in outputs.items():
+        # A matrix step's telemetry covers every combination, so it is
+        # only overlaid when there is just the one
+        if len(outputs) > 1:
+            telemetry = None
+        calls.extend(
+            (plot_bar, (plot, summary, device, max_numjobs, outdir, combo_bs, combo_mode,
+                        saturation, plot_format, trials, error_bars, telemetry))
+            for plot in PLOTS
+            )
+        calls.append((plot_latency, (
+            latency,
+            latency_title.format(
+                device=device,
+                bs=combo_bs,
+                hostname=socket.gethostname(),
+                mode=combo_mode,
+                saturation=saturation
+                ),
+            'Jobs active',
+            PurePath(outdir).joinpath(
+                '{hostname}-single-disk-{device_name}-{mode}-{bs}-latency.png'.format(
+                    hostname=socket.gethostname(),
+                    device_name=os.path.basename(device),
+                    mode=combo_mode,
+                    bs=combo_bs
+                    )
+                ),
+            plot_format
+            )))
+    render_plots(calls, jobs)
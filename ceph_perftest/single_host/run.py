@@ -2,11 +2,25 @@ import json
 import matplotlib.pyplot as plt
 import os
 from pathlib import Path, PurePath
-import shlex
 import socket
-import subprocess
 import sys
+import time
 from binary import BinaryUnits, DecimalUnits, convert_units
+from ..fio_json import load_fio_output
+from ..fio_stream import STEADY_TOLERANCE, STEADY_WINDOW, run_fio_streaming
+from ..fio_job import fio_command, format_command, job_text, render_section, write_job_file
+from ..affinity import DEFAULT_AFFINITY, SYSFS_ROOT, affinity_runs, affinity_tag, device_placement
+from ..latency import clat_percentiles, plot_latency, stats_bins
+from ..aggregate import pivot, stack_bottoms
+from ..render import DEFAULT_PLOT_FORMAT, render_plots, save_figure
+from ..telemetry import OVERLAY_LEGEND_X, TelemetrySampler, overlay_telemetry
+from ..results_db import latency_columns, record_run
+from ..checkpoint import Checkpoint, check_resume
+from ..planner import new_step, print_plan
+from ..fio_matrix import check_matrix, combinations, io_type, matrix_name, section_name, \
+                         section_options
+from ..trials import DEFAULT_ERROR_BARS, REPEAT_CV_THRESHOLD, draw_error_bars, mean_record, \
+                     run_trials, trial_stats
 
 GLOBAL_CONFIG = [
         '[global]',
@@ -43,6 +57,12 @@ PLOTS = [
 	}
         ]
 
+LATENCY_TITLE = "Multiple Disks\nCompletion Latency\nmode: {mode},BS: {bs} | {hostname}"
+
+AFFINITY_TITLE = " | NUMA pinned"
+
+AFFINITY_PLOT_TITLE = "Multiple Disks\nUnpinned vs NUMA pinned {name}\nmode: {mode},BS: {bs} | {hostname}"
+
 def check_block_devices(devices):
     for device in devices:
         if not Path(device).is_block_device():
@@ -50,138 +70,335 @@ def check_block_devices(devices):
                 device=device)
                 )
 
-def run_fio(fio_exe, input_devices, cleanup, outdir, bs, mode, runtime, filesize):
-    summary_output = []
-    total_disks = len(input_devices)
-    for idx in range(1, 1 + total_disks):
-        count_output = {}
-        devices = input_devices[:idx]
-        config_fn = PurePath(
-            outdir
-            ).joinpath(
-            "{hostname}-aggregate-{mode}-{bs}-{idx}.fio".format(
-                hostname=socket.gethostname(),
-                mode=mode,
-                bs=bs,
-                idx=idx
-            )
+def fio_config_fn(outdir, idx, combos, trial=1, repeat=1, affinity=DEFAULT_AFFINITY):
+    return PurePath(
+        outdir
+        ).joinpath(
+        "{hostname}-aggregate-{mode}-{bs}{affinity}-{idx}{trial}.fio".format(
+            hostname=socket.gethostname(),
+            mode=matrix_name(i[1] for i in combos),
+            bs=matrix_name(i[0] for i in combos),
+            affinity=affinity_tag(affinity),
+            idx=idx,
+            trial='' if repeat == 1 else '-trial{trial}'.format(trial=trial)
         )
-        config = []
+    )
 
-        print("Device count: {count}\nDevices included: {devices}".format(
-            count=idx,
-            devices=",".join(devices)
-            )
+def render_fio_config(devices, idx, combos, runtime, filesize, placement=None):
+    """
+    Job file lines for one step against devices, and the (combo, device)
+    each job name in fio's output belongs to. placement gives the
+    affinity options of each device's sections, if they are pinned.
+    """
+    config = render_section(GLOBAL_CONFIG, bs=combos[0][0], runtime=runtime, filesize=filesize)
+    jobnames = {}
+    for combo_idx, combo in enumerate(combos):
+        for device_idx, device in enumerate(devices):
+            device_name = section_name(os.path.basename(device), combo, combos)
+            jobnames[device_name] = (combo, device)
+            config.extend(render_section(
+                DEVICE_CONFIG,
+                device=device,
+                idx=idx,
+                device_name=device_name,
+                mode=combo[1]
+                ))
+            config.extend(section_options(combos, combo_idx, device_idx))
+            if placement is not None:
+                config.extend(placement[device])
+    return config, jobnames
+
+def run_fio_step(fio_exe, input_devices, idx, trial, repeat, cleanup, outdir, combos, runtime, filesize,
+                 steady_state=False, steady_window=STEADY_WINDOW, steady_tolerance=STEADY_TOLERANCE,
+                 checkpoint=None, placement=None):
+    """
+    Run fio once against the first idx of input_devices for every
+    (bs, mode) combination in combos, each a stonewall-separated group
+    of sections in one job file. Returns the per-device results and
+    latency of each combination, and the telemetry summary of the step.
+
+    The job is piped to fio on stdin and its output parsed as it
+    arrives; the job and output files are only written to outdir when
+    not cleaning up. A step already completed in checkpoint is not run
+    again; its results are read back from its output files.
+    """
+    devices = input_devices[:idx]
+    config_fn = fio_config_fn(outdir, idx, combos, trial, repeat, 'off' if placement is None else 'numa')
+    config, jobnames = render_fio_config(devices, idx, combos, runtime, filesize, placement)
+
+    print("Device count: {count}{trial}\nDevices included: {devices}".format(
+        count=idx,
+        trial='' if repeat == 1 else ', trial {trial}'.format(trial=trial),
+        devices=",".join(devices)
         )
-        for device in devices:
-            device_name = os.path.basename(device)
-            for line in DEVICE_CONFIG:
-                config.append(
-                        line.format(
-                            device=device,
-                            idx=idx,
-                            device_name=device_name,
-                            mode=mode
-                            )
-                        )
-        with open(config_fn, "w") as f:
-            for line in GLOBAL_CONFIG:
-                line = line.format(
-                        bs=bs,
-                        runtime=runtime,
-                        filesize=filesize,
-                        )
-                f.write(line+'\n')
-            for line in config:
-                f.write(line+'\n')
-        
-        fio_cmd = "{fio_exe} --output={config_fn}.output.json {config_fn} --output-format=json+".format(
-                fio_exe=fio_exe,
-                config_fn=config_fn,
-                )
+    )
+
+    params = {
+        'devices': devices,
+        'combos': combos,
+        'runtime': runtime,
+        'filesize': filesize,
+        'steady_state': steady_state
+        }
+    if placement is not None:
+        params['placement'] = {i: placement[i] for i in devices}
+    output_fn = "{config_fn}.output.json".format(config_fn=config_fn)
+    telemetry = None
+    if checkpoint is not None:
+        telemetry = checkpoint.completed(config_fn.name, params)
+    if telemetry is None:
+        if not cleanup:
+            # Kept for reference and re-running by hand; fio itself
+            # reads the job from stdin
+            write_job_file(config_fn, config)
+
+        fio_cmd = fio_command(fio_exe)
         print("Running fio...")
-        print(fio_cmd)        
-        subprocess.run(
-                shlex.split(
-                    fio_cmd
-                    ), 
-                stderr = subprocess.DEVNULL, 
-                stdout = subprocess.DEVNULL
-                )
-        
-        f = open("{config_fn}.output.json".format(
-            config_fn=config_fn
-            )
-        )
-        
-        data = json.load(f)
-
-        if cleanup:
-            Path(config_fn).unlink()
-            Path(
-                "{config_fn}.output.json".format(
-                    config_fn=config_fn
+        print(format_command(fio_cmd, None if cleanup else config_fn))
+        with TelemetrySampler() as sampler:
+            series, _, data = run_fio_streaming(
+                    fio_cmd,
+                    None if cleanup else output_fn,
+                    list(dict.fromkeys(io_type(i[1]) for i in combos)),
+                    steady_state, steady_window, steady_tolerance,
+                    job_text(config)
                     )
-                ).unlink()
+        if data is None:
+            sys.exit("fio gave no output for {config_fn}".format(config_fn=config_fn.name))
+        telemetry = {'count': idx}
+        telemetry.update(sampler.summary())
+        if not cleanup:
+            with open("{config_fn}.status.json".format(config_fn=config_fn), "w") as f:
+                json.dump(series, f)
+            sampler.save("{config_fn}.telemetry.json".format(config_fn=config_fn))
+        if checkpoint is not None:
+            checkpoint.record(
+                config_fn.name, params,
+                ["{config_fn}.{suffix}.json".format(config_fn=config_fn, suffix=i)
+                 for i in ['output', 'status', 'telemetry']],
+                telemetry
+                )
+    else:
+        data = load_fio_output(output_fn, latency_bins=True)
+
+    step = {combo: {'devices': {}, 'latency': None} for combo in combos}
+    for combo in combos:
+        _mode = io_type(combo[1])
+        jobs = [i for i in data['jobs'] if jobnames.get(i['jobname'], (None,))[0] == combo]
+        latency = {'count': idx, 'timestamp': data.get('timestamp') or time.time()}
+        latency.update(clat_percentiles(stats_bins(jobs, _mode)))
+        step[combo]['latency'] = latency
 
-        for dev_idx,device in enumerate(devices, 1):
-            device_name = os.path.basename(device)
-            print("Parsing output for {device}".format(
-                device=device
+        for job in jobs:
+            device = jobnames[job['jobname']][1]
+            print("Parsing output for {device}{combo}".format(
+                device=device,
+                combo='' if len(combos) == 1 else ' ({1}, {0})'.format(*combo)
                 )
             )
-            _mode = mode
-            if _mode == 'randread':
-                _mode = 'read'
-            elif _mode == 'randwrite':
-                _mode = 'write'
-            dev_data = [i[_mode] for i in data['jobs'] if i['jobname'] == device_name][0]
-            count_output.update(
-                    {
-                        device: {
-                            'bw': dev_data['bw'], 
-                            'iops':  dev_data['iops']
-                            }
-                        }
+            bw, _ = convert_units(
+                    job[_mode]['bw'],
+                    unit=BinaryUnits.KB,
+                    to=DecimalUnits.MB
                     )
+            step[combo]['devices'][device] = {
+                'bw': bw,
+                'iops': job[_mode]['iops']
+                }
+
+    return {'combos': step, 'telemetry': telemetry}
 
-        for device in input_devices:
-            if device in count_output:
-                bw, _ = convert_units(
-                        count_output[device]['bw'], 
-                        unit=BinaryUnits.KB, 
-                        to=DecimalUnits.MB
+def plan_steps(devices, outdir, combos, runtime, filesize, placement=None):
+    steps = []
+    affinity = 'off' if placement is None else 'numa'
+    for idx in range(1, 1 + len(devices)):
+        config, _ = render_fio_config(devices[:idx], idx, combos, runtime, filesize, placement)
+        steps.append(new_step(
+            'Device count {idx}{pinned}'.format(idx=idx, pinned='' if placement is None else ', NUMA pinned'),
+            int(runtime) * len(combos),
+            [(device, combo_mode, combo_bs, idx, int(runtime))
+             for combo_bs, combo_mode in combos for device in devices[:idx]],
+            files=[(fio_config_fn(outdir, idx, combos, affinity=affinity), config)]
+            ))
+    return steps
+
+def run_fio(fio_exe, input_devices, cleanup, outdir, bs, mode, runtime, filesize,
+            steady_state=False, steady_window=STEADY_WINDOW, steady_tolerance=STEADY_TOLERANCE,
+            repeat=1, shuffle=False, cv_threshold=REPEAT_CV_THRESHOLD, checkpoint=None, placement=None):
+    """
+    Run every device count for every combination of bs and mode (each a
+    value or a list), with each device's jobs pinned as in placement if
+    given, returning {(bs, mode): (summary, latency, telemetry,
+    trials)}.
+    """
+    combos = combinations(bs, mode)
+    counts = list(range(1, 1 + len(input_devices)))
+
+    results = run_trials(
+        counts,
+        lambda idx, trial: run_fio_step(fio_exe, input_devices, idx, trial, repeat,
+                                        cleanup, outdir, combos, runtime, filesize,
+                                        steady_state, steady_window, steady_tolerance,
+                                        checkpoint, placement),
+        lambda result: [
+            sum(i['iops'] for i in result['combos'][combo]['devices'].values())
+            for combo in combos
+            ],
+        repeat, shuffle, cv_threshold
+        )
+
+    outputs = {}
+    for combo in combos:
+        summary_output = []
+        latency_output = []
+        telemetry_output = []
+        trials_output = []
+        for idx in counts:
+            trials = [
+                dict(i['combos'][combo], telemetry=i['telemetry']) for i in results[idx]
+                ]
+            latency_output.append(mean_record([i['latency'] for i in trials]))
+            telemetry_output.append(mean_record([i['telemetry'] for i in trials]))
+
+            for trial, result in enumerate(trials, 1):
+                for device, dev_result in result['devices'].items():
+                    trials_output.append(
+                        {
+                            'count': idx,
+                            'device': device,
+                            'trial': trial,
+                            'bw': dev_result['bw'],
+                            'iops': dev_result['iops'],
+                            'latency': result['latency']
+                            }
                         )
-                iops = count_output[device]['iops']
-
-            else:
-                bw = iops = 0
-            
-            summary_output.append(
-                    {
-                        'count': idx,
-                        'device': device,
-                        'bw': bw,
-                        'iops': iops
-                        }
-                    )
 
-    return summary_output
+            for device in input_devices:
+                if device in trials[0]['devices']:
+                    bw = trial_stats([i['devices'][device]['bw'] for i in trials])['mean']
+                    iops = trial_stats([i['devices'][device]['iops'] for i in trials])['mean']
+                else:
+                    bw = iops = 0
 
-def plot_bar(summary, plot, devices, outdir, bs, mode):
+                summary_output.append(
+                        {
+                            'count': idx,
+                            'device': device,
+                            'bw': bw,
+                            'iops': iops
+                            }
+                        )
+        outputs[combo] = (summary_output, latency_output, telemetry_output, trials_output)
+
+    return outputs
+
+def results_rows(trials, bs, mode, affinity=DEFAULT_AFFINITY):
+    """
+    Results database rows for every trial of every active device at
+    each device count, with that trial's latency percentiles.
+    """
+    rows = []
+    for trial in trials:
+        row = {
+            'target': trial['device'],
+            'mode': mode,
+            'bs': bs,
+            'numjobs': 1,
+            'iodepth': 16,
+            'count': trial['count'],
+            'bw': trial['bw'],
+            'iops': trial['iops'],
+            'timestamp': trial['latency']['timestamp'],
+            'workload': 'trial={trial}{affinity}'.format(
+                trial=trial['trial'],
+                affinity='' if affinity == 'off' else ' affinity={affinity}'.format(affinity=affinity)
+                )
+            }
+        row.update(latency_columns(trial['latency']))
+        rows.append(row)
+    return rows
+
+def trial_totals(trials, varname, counts):
+    """
+    Per-trial total of varname over all devices for each count.
+    """
+    totals = {}
+    for i in trials:
+        totals.setdefault(i['count'], {}).setdefault(i['trial'], 0)
+        totals[i['count']][i['trial']] += i[varname]
+    return [list(totals.get(count, {}).values()) for count in counts]
+
+def plot_bar(summary, plot, devices, outdir, bs, mode, plot_format=DEFAULT_PLOT_FORMAT,
+             telemetry=None, trials=None, error_bars=DEFAULT_ERROR_BARS, affinity=DEFAULT_AFFINITY):
     print("Making {name} plot".format(name=plot['name']))
-    labels = [str(i) for i in range(1, len(devices) + 1)]
+    counts, _, values = pivot(
+        summary, 'device', plot['varname'], devices,
+        list(range(1, len(devices) + 1))
+        )
+    labels = [str(i) for i in counts]
     fig, ax = plt.subplots()
-    cum_size = [0] * len(devices)
-    for device in devices:
-        values = [i[plot['varname']] for i in summary if i['device'] == device]
-        ax.bar(labels, values, bottom=cum_size, width=0.9, label=device)
-
-        for a,_ in enumerate(cum_size):
-            cum_size[a] += values[a]
+    bottoms = stack_bottoms(values)
+    for idx, device in enumerate(devices):
+        ax.bar(labels, values[:, idx], bottom=bottoms[:, idx], width=0.9, label=device)
+    if trials and any(i['trial'] > 1 for i in trials):
+        draw_error_bars(ax, labels, trial_totals(trials, plot['varname'], counts), error_bars)
+    if telemetry:
+        overlay_telemetry(
+            ax, labels, sorted(telemetry, key=lambda k: k['count']), plot['varname'] == 'bw'
+            )
 
     ax.tick_params(axis='x', which='major', labelsize=4)
     ax.set_title(plot['title'].format(
+        bs=bs,
+        hostname=socket.gethostname(),
+        mode=mode
+        ) + ('' if affinity == 'off' else AFFINITY_TITLE)
+    )
+    ax.set_ylabel(plot['y_label'])
+    ax.set_xlabel('Devices active')
+    ax.legend(
+        bbox_to_anchor=(OVERLAY_LEGEND_X if telemetry else 1.04, 1), loc="upper left"
+        )
+    save_figure(
+        fig,
+        PurePath(
+            outdir
+            ).joinpath(
+            '{hostname}-aggregate-{mode}-{bs}{affinity}-{name}.png'.format(
+                hostname=socket.gethostname(),
+                mode=mode,
+                name=plot['name'],
+                bs=bs,
+                affinity=affinity_tag(affinity)
+                )
+            ),
+        plot_format
+        )
+
+def plot_affinity(summaries, plot, devices, outdir, bs, mode, plot_format=DEFAULT_PLOT_FORMAT):
+    """
+    Aggregate varname of the unpinned and NUMA pinned runs side by side
+    at each device count, from {affinity: summary}.
+    """
+    print("Making affinity {name} plot".format(name=plot['name']))
+    fig, ax = plt.subplots()
+    width = 0.9 / len(summaries)
+    for run_idx, (affinity, summary) in enumerate(summaries.items()):
+        counts, _, values = pivot(
+            summary, 'device', plot['varname'], devices,
+            list(range(1, len(devices) + 1))
+            )
+        ax.bar(
+            [i - 0.45 + width * (run_idx + 0.5) for i in range(len(counts))],
+            values.sum(axis=1),
+            width=width,
+            label='unpinned' if affinity == 'off' else 'NUMA pinned'
+            )
+    ax.set_xticks(range(len(counts)))
+    ax.set_xticklabels([str(i) for i in counts])
+    ax.tick_params(axis='x', which='major', labelsize=4)
+    ax.set_title(AFFINITY_PLOT_TITLE.format(
+        name=plot['name'],
         bs=bs,
         hostname=socket.gethostname(),
         mode=mode
@@ -190,19 +407,19 @@ def plot_bar(summary, plot, devices, outdir, bs, mode):
     ax.set_ylabel(plot['y_label'])
     ax.set_xlabel('Devices active')
     ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
-    fig.savefig(
+    save_figure(
+        fig,
         PurePath(
             outdir
             ).joinpath(
-            '{hostname}-aggregate-{mode}-{bs}-{name}.png'.format(
+            '{hostname}-aggregate-{mode}-{bs}-affinity-{name}.png'.format(
                 hostname=socket.gethostname(),
                 mode=mode,
                 name=plot['name'],
                 bs=bs
                 )
-            ), 
-            dpi=1000, 
-            bbox_inches='tight'
+            ),
+        plot_format
         )
 
 def make_output_directory(outdir):
@@ -212,9 +429,77 @@ def make_output_directory(outdir):
 
     return p
 
-def run_single_host(fio_exe, devices, cleanup, outdir, bs, mode, runtime, filesize):
+def run_single_host(fio_exe, devices, cleanup, outdir, bs, mode, runtime, filesize,
+                    plot_format=DEFAULT_PLOT_FORMAT, jobs=1, steady_state=False,
+                    steady_window=STEADY_WINDOW, steady_tolerance=STEADY_TOLERANCE,
+                    results_db=None, repeat=1, shuffle=False, cv_threshold=REPEAT_CV_THRESHOLD,
+                    error_bars=DEFAULT_ERROR_BARS, resume=False, dry_run=False,
+                    affinity=DEFAULT_AFFINITY, sysfs_root=SYSFS_ROOT):
+    started = time.time()
     check_block_devices(devices)
+    combos = combinations(bs, mode)
+    check_matrix(combos, steady_state=steady_state)
+    check_resume(resume, cleanup)
+    placement = None if affinity == 'off' else device_placement(devices, sysfs_root)
+    runs = affinity_runs(affinity)
+    if dry_run:
+        steps = []
+        for run_affinity in runs:
+            steps.extend(plan_steps(devices, Path(outdir).resolve(), combos, runtime, filesize,
+                                    None if run_affinity == 'off' else placement))
+        print_plan('single-host', steps, results_db, repeat, upper_bound=steady_state)
+        return
     outdir = make_output_directory(outdir)
-    summary = run_fio(fio_exe, devices, cleanup, outdir, bs, mode, runtime, filesize)
-    for plot in PLOTS:
-    	plot_bar(summary, plot, devices, outdir, bs, mode)
+    checkpoint = None if cleanup else Checkpoint(outdir, 'single-host', resume)
+    outputs = {}
+    for run_affinity in runs:
+        if len(runs) > 1:
+            print("Running {run}".format(run='unpinned' if run_affinity == 'off' else 'NUMA pinned'))
+        outputs[run_affinity] = run_fio(fio_exe, devices, cleanup, outdir, bs, mode, runtime, filesize,
+                                        steady_state, steady_window, steady_tolerance,
+                                        repeat, shuffle, cv_threshold, checkpoint,
+                                        None if run_affinity == 'off' else placement)
+    if results_db is not None:
+        rows = []
+        for run_affinity, run_outputs in outputs.items():
+            for (combo_bs, combo_mode), (_, _, _, trials) in run_outputs.items():
+                rows.extend(results_rows(trials, combo_bs, combo_mode, run_affinity))
+        record_run(results_db, 'single-host', rows, started)
+    calls = []
+    for run_affinity, run_outputs in outputs.items():
+        for (combo_bs, combo_mode), (summary, latency, telemetry, trials) in run_outputs.items():
+            # A matrix step's telemetry covers every combination, so it is
+            # only overlaid when there is just the one
+            if len(combos) > 1:
+                telemetry = None
+            calls.extend(
+                (plot_bar, (summary, plot, devices, outdir, combo_bs, combo_mode, plot_format,
+                            telemetry, trials, error_bars, run_affinity))
+                for plot in PLOTS
+                )
+            calls.append((plot_latency, (
+                latency,
+                LATENCY_TITLE.format(
+                    bs=combo_bs,
+                    hostname=socket.gethostname(),
+                    mode=combo_mode
+                    ) + ('' if run_affinity == 'off' else AFFINITY_TITLE),
+                'Devices active',
+                PurePath(outdir).joinpath(
+                    '{hostname}-aggregate-{mode}-{bs}{affinity}-latency.png'.format(
+                        hostname=socket.gethostname(),
+                        mode=combo_mode,
+                        bs=combo_bs,
+                        affinity=affinity_tag(run_affinity)
+                        )
+                    ),
+                plot_format
+                )))
+    if len(runs) > 1:
+        for combo in combos:
+            calls.extend(
+                (plot_affinity, ({i: outputs[i][combo][0] for i in runs}, plot, devices, outdir,
+                                 combo[0], combo[1], plot_format))
+                for plot in PLOTS
+                )
+    render_plots(calls, jobs)
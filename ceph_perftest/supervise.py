@@ -0,0 +1,56 @@
+import asyncio
+import os
+import signal
+
+# How long to wait for stderr to drain once a hung process is killed
+KILL_DRAIN_TIMEOUT = 5
+
+async def _run_process(cmd, output_fn, timeout):
+    with open(output_fn, 'wb') as f:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=f,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True
+            )
+        stderr = asyncio.ensure_future(proc.stderr.read())
+        timed_out = False
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            # Kill the whole session so no stray children keep stderr open
+            os.killpg(proc.pid, signal.SIGKILL)
+            await proc.wait()
+
+    if timed_out:
+        try:
+            stderr_data = await asyncio.wait_for(stderr, KILL_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            stderr_data = b''
+    else:
+        stderr_data = await stderr
+
+    return {
+        'cmd': cmd,
+        'output_fn': output_fn,
+        'returncode': proc.returncode,
+        'timed_out': timed_out,
+        'stderr': stderr_data.decode(errors='replace').strip()
+        }
+
+async def _run_processes(commands, timeout):
+    return await asyncio.gather(
+        *[_run_process(cmd, output_fn, timeout) for cmd, output_fn in commands]
+        )
+
+def run_processes(commands, timeout=None):
+    """
+    Start every (cmd, output_fn) pair concurrently, writing each process's
+    stdout to output_fn, and wait until all have exited. Processes still
+    running after timeout seconds are killed.
+
+    Returns one result per command, in order, with the returncode,
+    whether it timed out and its stderr.
+    """
+    return asyncio.run(_run_processes(commands, timeout))
@@ -0,0 +1,174 @@
+from array import array
+import json
+import threading
+import time
+import psutil
+
+TELEMETRY_INTERVAL = 0.5
+
+TELEMETRY_LINES = [
+    {'varname': 'cpu', 'label': 'CPU (mean)'},
+    {'varname': 'cpu_max', 'label': 'CPU (busiest core)'},
+    {'varname': 'softirq', 'label': 'softirq'},
+    {'varname': 'disk_busy', 'label': 'Disk busy (busiest)'},
+    ]
+
+# Legend x anchor for plots with an overlay, clear of the secondary axis
+OVERLAY_LEGEND_X = 1.15
+
+def is_loopback(nic, stats):
+    # flags are only reported by psutil 5.9.3 and later
+    flags = getattr(stats.get(nic), 'flags', '')
+    return 'loopback' in flags.split(',') or nic == 'lo'
+
+class TelemetrySampler(threading.Thread):
+    """
+    Background sampler of host CPU, disk and NIC counters.
+
+    Use as a context manager around a benchmark step. Each sample is one
+    row of len(columns) values appended to a flat array: the time, per-CPU
+    utilisation (%) and cumulative softirq seconds, and cumulative
+    per-disk and per-NIC counters.
+    """
+    def __init__(self, interval=TELEMETRY_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.cpus = psutil.cpu_count()
+        self.disks = sorted(psutil.disk_io_counters(perdisk=True) or {})
+        self.nics = sorted(psutil.net_io_counters(pernic=True))
+        # Loopback traffic (send-file --loopback, a local sink) is counted
+        # on both ends and never reaches the network, so it is recorded
+        # but left out of the throughput summary
+        stats = psutil.net_if_stats()
+        self.net_nics = [i for i in self.nics if not is_loopback(i, stats)]
+        self.columns = (
+            ['time']
+            + ['cpu{idx}'.format(idx=i) for i in range(self.cpus)]
+            + ['softirq{idx}'.format(idx=i) for i in range(self.cpus)]
+            + ['{disk}.{counter}'.format(disk=disk, counter=counter)
+               for disk in self.disks
+               for counter in ['read_bytes', 'write_bytes', 'busy_time']]
+            + ['{nic}.{counter}'.format(nic=nic, counter=counter)
+               for nic in self.nics
+               for counter in ['bytes_sent', 'bytes_recv']]
+            )
+        self.data = array('d')
+        self._start = None
+        self._stopped = threading.Event()
+
+    def sample(self):
+        row = [time.monotonic() - self._start]
+        row += psutil.cpu_percent(percpu=True)
+        row += [getattr(i, 'softirq', 0.0) for i in psutil.cpu_times(percpu=True)]
+        disks = psutil.disk_io_counters(perdisk=True) or {}
+        for disk in self.disks:
+            counters = disks.get(disk)
+            row += [
+                getattr(counters, 'read_bytes', 0),
+                getattr(counters, 'write_bytes', 0),
+                getattr(counters, 'busy_time', 0)
+                ]
+        nics = psutil.net_io_counters(pernic=True)
+        for nic in self.nics:
+            counters = nics.get(nic)
+            row += [
+                getattr(counters, 'bytes_sent', 0),
+                getattr(counters, 'bytes_recv', 0)
+                ]
+        self.data.extend(row)
+
+    def run(self):
+        self._start = time.monotonic()
+        # Prime cpu_percent so the first sample covers a real interval
+        psutil.cpu_percent(percpu=True)
+        self.sample()
+        while not self._stopped.wait(self.interval):
+            self.sample()
+        self.sample()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def rows(self):
+        width = len(self.columns)
+        return [self.data[i:i + width] for i in range(0, len(self.data), width)]
+
+    def column(self, name):
+        idx = self.columns.index(name)
+        return self.data[idx::len(self.columns)]
+
+    def save(self, output_fn):
+        with open(output_fn, 'w') as f:
+            json.dump(
+                {
+                    'interval': self.interval,
+                    'columns': self.columns,
+                    'data': list(self.data)
+                },
+                f
+            )
+
+    def summary(self):
+        """
+        Per-step figures for plot overlays: mean and busiest-core CPU
+        utilisation, softirq share of CPU time and busiest disk
+        utilisation (all %), and total throughput in MB/s of the NICs
+        other than loopback.
+        """
+        rows = self.rows()
+        if len(rows) < 2:
+            return {'cpu': 0, 'cpu_max': 0, 'softirq': 0, 'disk_busy': 0, 'net': 0}
+        first, last = rows[0], rows[-1]
+        elapsed = (last[0] - first[0]) or self.interval
+        cpu = [row[1:1 + self.cpus] for row in rows[1:]]
+        delta = lambda name: last[self.columns.index(name)] - first[self.columns.index(name)]
+        softirq = sum(delta('softirq{idx}'.format(idx=i)) for i in range(self.cpus))
+        return {
+            'cpu': sum(sum(i) / len(i) for i in cpu) / len(cpu),
+            'cpu_max': sum(max(i) for i in cpu) / len(cpu),
+            'softirq': softirq / (elapsed * self.cpus) * 100,
+            'disk_busy': max(
+                [delta(disk + '.busy_time') / (elapsed * 1000) * 100 for disk in self.disks],
+                default=0
+                ),
+            'net': sum(
+                delta(nic + '.bytes_sent') + delta(nic + '.bytes_recv') for nic in self.net_nics
+                ) / elapsed / 1000 / 1000
+            }
+
+def overlay_telemetry(ax, labels, telemetry, show_net=False):
+    """
+    Overlay per-step telemetry summaries (one per bar, in label order) on
+    a bar plot: utilisation on a secondary 0-100% axis and, if show_net,
+    NIC throughput on the plot's own MB/s axis.
+    """
+    util_ax = ax.twinx()
+    for line in TELEMETRY_LINES:
+        util_ax.plot(
+            labels,
+            [i[line['varname']] for i in telemetry],
+            linestyle=':',
+            marker='.',
+            label=line['label']
+            )
+    util_ax.set_ylim(0, 100)
+    util_ax.set_ylabel('Utilisation (%)')
+    util_ax.legend(
+        bbox_to_anchor=(0.5, -0.15), loc="upper center", ncol=2, fontsize='small'
+        )
+    if show_net:
+        ax.plot(
+            labels,
+            [i['net'] for i in telemetry],
+            linestyle='--',
+            color='black',
+            label='NIC throughput (MB/s)'
+            )
@@ -0,0 +1,116 @@
+import random
+import statistics
+
+# Stop repeating a step once the coefficient of variation of its
+# measure across trials drops below this.
+REPEAT_CV_THRESHOLD = 0.05
+
+ERROR_BARS = ['std', 'minmax']
+DEFAULT_ERROR_BARS = 'std'
+
+def coefficient_of_variation(values):
+    if len(values) < 2:
+        return float('inf')
+    mean = statistics.mean(values)
+    if mean == 0:
+        return 0.0
+    return statistics.stdev(values) / mean
+
+def measure_cv(measures):
+    """
+    Coefficient of variation of per-trial measures, each a number or a
+    list of numbers (one per combination of a matrix step); the worst
+    element decides.
+    """
+    if measures and isinstance(measures[0], (list, tuple)):
+        return max(coefficient_of_variation(list(i)) for i in zip(*measures))
+    return coefficient_of_variation(measures)
+
+def run_trials(steps, run_step, measure, repeat=1, shuffle=False,
+               cv_threshold=REPEAT_CV_THRESHOLD):
+    """
+    Run every step up to repeat times, calling run_step(step, trial) with
+    a one-based trial number. Each round runs the steps still being
+    repeated, in random order if shuffle is set, so slow drift (SSD
+    garbage collection, a background scrub) is spread over all steps
+    rather than landing on a few. A step stops being repeated once
+    measure(result) has a coefficient of variation under cv_threshold
+    across its trials.
+
+    Returns {step: [result, ...]} in trial order.
+    """
+    results = {step: [] for step in steps}
+    pending = list(steps)
+    for trial in range(1, repeat + 1):
+        order = list(pending)
+        if shuffle:
+            random.shuffle(order)
+        for step in order:
+            results[step].append(run_step(step, trial))
+        if trial == 1:
+            continue
+        for step in order:
+            cv = measure_cv([measure(i) for i in results[step]])
+            if cv < cv_threshold:
+                print("Step {step} stable after {trials} trials (CV {cv:.1%})".format(
+                    step=step,
+                    trials=trial,
+                    cv=cv
+                    )
+                )
+                pending.remove(step)
+        if not pending:
+            break
+    return results
+
+def repeat_step(step, run_step, measure, repeat=1, cv_threshold=REPEAT_CV_THRESHOLD):
+    """
+    Run a single step up to repeat times with the same stopping rule as
+    run_trials, for callers that must choose the next step from this
+    one's result.
+    """
+    return run_trials([step], run_step, measure, repeat, False, cv_threshold)[step]
+
+def trial_stats(values):
+    """
+    Mean, standard deviation, min and max over trials, ignoring NaN
+    (untested) values.
+    """
+    values = [i for i in values if i == i]
+    if not values:
+        nan = float('nan')
+        return {'mean': nan, 'std': nan, 'min': nan, 'max': nan}
+    return {
+        'mean': statistics.mean(values),
+        'std': statistics.stdev(values) if len(values) > 1 else 0.0,
+        'min': min(values),
+        'max': max(values)
+        }
+
+def draw_error_bars(ax, labels, totals, error_bars=DEFAULT_ERROR_BARS):
+    """
+    Error bars on top of stacked bars from the per-trial stack totals of
+    each label: one standard deviation either side of the mean, or the
+    min-max range.
+    """
+    stats = [trial_stats(i) for i in totals]
+    means = [i['mean'] for i in stats]
+    if error_bars == 'minmax':
+        yerr = [
+            [i['mean'] - i['min'] for i in stats],
+            [i['max'] - i['mean'] for i in stats]
+            ]
+    else:
+        yerr = [i['std'] for i in stats]
+    ax.errorbar(labels, means, yerr=yerr, fmt='none', ecolor='black', capsize=2, linewidth=0.8)
+
+def mean_record(records):
+    """
+    Field-by-field mean of per-trial records such as latency or
+    telemetry summaries; non-numeric fields are taken from the last.
+    """
+    mean = dict(records[-1])
+    for key, value in mean.items():
+        if key != 'count' and isinstance(value, (int, float)):
+            mean[key] = trial_stats([i[key] for i in records])['mean']
+    return mean
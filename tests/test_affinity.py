@@ -0,0 +1,85 @@
+import os
+from ceph_perftest.affinity import affinity_options, device_locality, device_placement, disk_name
+from ceph_perftest.single_host.run import render_fio_config
+
+def add_disk(sysfs_root, name, bus_device, numa_node=None, local_cpulist=None, partitions=()):
+    """
+    block/<name> of a disk whose device link points below the bus device
+    (an HBA or NVMe controller) that carries its NUMA locality.
+    """
+    bus = sysfs_root.joinpath('devices', 'pci0000:00', bus_device)
+    device = bus.joinpath('host0', 'target0:0:0', '0:0:0:0')
+    device.mkdir(parents=True)
+    if numa_node is not None:
+        bus.joinpath('numa_node').write_text('{numa_node}\n'.format(numa_node=numa_node))
+    if local_cpulist is not None:
+        bus.joinpath('local_cpulist').write_text(local_cpulist + '\n')
+    disk = sysfs_root.joinpath('block', name)
+    disk.mkdir(parents=True)
+    disk.joinpath('device').symlink_to(os.path.relpath(device, disk))
+    for partition in partitions:
+        disk.joinpath(partition).mkdir()
+
+def add_node(sysfs_root, node, cpulist):
+    path = sysfs_root.joinpath('devices', 'system', 'node', 'node{node}'.format(node=node))
+    path.mkdir(parents=True)
+    path.joinpath('cpulist').write_text(cpulist + '\n')
+
+def dev(tmp_path, name):
+    # Device nodes are only looked at by name
+    return str(tmp_path.joinpath('dev', name))
+
+def test_disk_name(tmp_path):
+    add_disk(tmp_path, 'sda', '0000:00:17.0', partitions=['sda1'])
+    add_disk(tmp_path, 'nvme0n1', '0000:01:00.0', partitions=['nvme0n1p1'])
+    assert disk_name(dev(tmp_path, 'sda'), tmp_path) == 'sda'
+    assert disk_name(dev(tmp_path, 'sda1'), tmp_path) == 'sda'
+    assert disk_name(dev(tmp_path, 'nvme0n1p1'), tmp_path) == 'nvme0n1'
+    assert disk_name(dev(tmp_path, 'sdz'), tmp_path) is None
+
+def test_device_locality_walks_up_to_numa_node(tmp_path):
+    add_disk(tmp_path, 'sda', '0000:00:17.0', numa_node=1, local_cpulist='8-15,24-31', partitions=['sda1'])
+    assert device_locality(dev(tmp_path, 'sda1'), tmp_path) == {'numa_node': 1, 'cpus': '8-15,24-31'}
+
+def test_device_locality_falls_back_to_node_cpulist(tmp_path):
+    add_disk(tmp_path, 'sda', '0000:00:17.0', numa_node=0)
+    add_node(tmp_path, 0, '0-7')
+    assert device_locality(dev(tmp_path, 'sda'), tmp_path) == {'numa_node': 0, 'cpus': '0-7'}
+
+def test_device_locality_without_numa(tmp_path):
+    # numa_node is -1 on hosts (or slots) without NUMA
+    add_disk(tmp_path, 'sda', '0000:00:17.0', numa_node=-1, local_cpulist='0-3')
+    add_disk(tmp_path, 'sdb', '0000:00:18.0', numa_node=-1)
+    assert device_locality(dev(tmp_path, 'sda'), tmp_path) == {'numa_node': None, 'cpus': '0-3'}
+    assert device_locality(dev(tmp_path, 'sdb'), tmp_path) == {'numa_node': None, 'cpus': None}
+
+def test_unknown_device_is_left_unpinned(tmp_path):
+    add_disk(tmp_path, 'sda', '0000:00:17.0')
+    assert device_locality(dev(tmp_path, 'sda'), tmp_path) == {'numa_node': None, 'cpus': None}
+    assert device_locality(dev(tmp_path, 'sdz'), tmp_path) == {'numa_node': None, 'cpus': None}
+    assert device_placement([dev(tmp_path, 'sdz')], tmp_path) == {dev(tmp_path, 'sdz'): []}
+
+def test_affinity_options():
+    assert affinity_options({'numa_node': 1, 'cpus': '8-15'}) == ['cpus_allowed=8-15', 'numa_cpu_nodes=1']
+    assert affinity_options({'numa_node': None, 'cpus': '0-3'}) == ['cpus_allowed=0-3']
+
+def test_render_fio_config_pins_each_device(tmp_path):
+    add_disk(tmp_path, 'sda', '0000:00:17.0', numa_node=0, local_cpulist='0-7')
+    add_disk(tmp_path, 'sdb', '0000:80:17.0', numa_node=1, local_cpulist='8-15')
+    devices = [dev(tmp_path, 'sda'), dev(tmp_path, 'sdb'), dev(tmp_path, 'sdz')]
+    placement = device_placement(devices, tmp_path)
+    config, _ = render_fio_config(devices, 3, [('4k', 'randread')], 10, '1G', placement)
+    sections = {}
+    for line in config:
+        if line.startswith('['):
+            section = sections.setdefault(line.strip('[]'), [])
+        else:
+            section.append(line)
+    assert 'cpus_allowed=0-7' in sections['sda'] and 'numa_cpu_nodes=0' in sections['sda']
+    assert 'cpus_allowed=8-15' in sections['sdb'] and 'numa_cpu_nodes=1' in sections['sdb']
+    assert not [i for i in sections['sdz'] if i.startswith(('cpus_allowed', 'numa_cpu_nodes'))]
+    assert not [i for i in sections['global'] if i.startswith(('cpus_allowed', 'numa_cpu_nodes'))]
+
+def test_render_fio_config_unpinned(tmp_path):
+    config, _ = render_fio_config([dev(tmp_path, 'sda')], 1, [('4k', 'randread')], 10, '1G')
+    assert not [i for i in config if i.startswith(('cpus_allowed', 'numa_cpu_nodes'))]
@@ -0,0 +1,49 @@
+import pytest
+from ceph_perftest.checkpoint import Checkpoint, check_resume
+
+def run_step(outdir, name='step.json', content='{}'):
+    output_fn = outdir / name
+    output_fn.write_text(content)
+    return output_fn
+
+def test_completed_step_is_skipped_on_resume(tmp_path):
+    checkpoint = Checkpoint(tmp_path, 'sweep')
+    checkpoint.record('step', {'bs': '4k', 'devices': ('a', 'b')}, [run_step(tmp_path)], {'bw': 1.0})
+    resumed = Checkpoint(tmp_path, 'sweep', resume=True)
+    assert resumed.completed('step', {'bs': '4k', 'devices': ('a', 'b')}) == {'bw': 1.0}
+    assert resumed.completed('other', {'bs': '4k'}) is None
+
+def test_without_resume_every_step_runs(tmp_path):
+    Checkpoint(tmp_path, 'sweep').record('step', {}, [run_step(tmp_path)])
+    assert Checkpoint(tmp_path, 'sweep').completed('step', {}) is None
+
+def test_changed_params_rerun(tmp_path):
+    Checkpoint(tmp_path, 'sweep').record('step', {'bs': '4k'}, [run_step(tmp_path)])
+    assert Checkpoint(tmp_path, 'sweep', resume=True).completed('step', {'bs': '64k'}) is None
+
+def test_missing_or_corrupt_output_reruns(tmp_path):
+    checkpoint = Checkpoint(tmp_path, 'sweep')
+    checkpoint.record('a', {}, [run_step(tmp_path, 'a.json')])
+    checkpoint.record('b', {}, [run_step(tmp_path, 'b.json')])
+    (tmp_path / 'a.json').unlink()
+    (tmp_path / 'b.json').write_text('{"truncated"')
+    resumed = Checkpoint(tmp_path, 'sweep', resume=True)
+    assert resumed.completed('a', {}) is None
+    assert resumed.completed('b', {}) is None
+
+def test_unusable_manifest_runs_every_step(tmp_path):
+    (tmp_path / 'checkpoint-sweep.json').write_text('{"steps": ')
+    assert Checkpoint(tmp_path, 'sweep', resume=True).steps == {}
+
+def test_outputs_are_relative_to_the_output_directory(tmp_path):
+    outdir = tmp_path / 'run'
+    outdir.mkdir()
+    Checkpoint(outdir, 'sweep').record('step', {}, [run_step(outdir)], 1)
+    moved = tmp_path / 'moved'
+    outdir.rename(moved)
+    assert Checkpoint(moved, 'sweep', resume=True).completed('step', {}) == 1
+
+def test_resume_needs_outputs():
+    check_resume(True, False)
+    with pytest.raises(SystemExit):
+        check_resume(True, True)
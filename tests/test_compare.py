@@ -0,0 +1,62 @@
+import json
+from ceph_perftest.compare import load_directory, output_type
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return path
+
+def fio_output(bw):
+    return {
+        'fio version': 'fio-3.28',
+        'timestamp': 1700000000,
+        'global options': {'bs': '4k'},
+        'jobs': [{'jobname': 'job', 'read': {'bw': bw, 'iops': bw / 4}, 'write': {'bw': 0, 'iops': 0}}]
+        }
+
+def iperf_output(bits_per_second):
+    return {
+        'start': {},
+        'intervals': [{'sum': {'start': 0, 'end': 1, 'bytes': 1, 'bits_per_second': bits_per_second}}],
+        'end': {'sum_sent': {'bits_per_second': bits_per_second}}
+        }
+
+def test_output_type(tmp_path):
+    assert output_type(write_json(tmp_path / 'fio.json', fio_output(1000))) == 'fio'
+    assert output_type(write_json(tmp_path / 'iperf.json', iperf_output(8e6))) == 'iperf3'
+    failed = dict(iperf_output(8e6), error='unable to connect')
+    assert output_type(write_json(tmp_path / 'failed.json', failed)) is None
+    assert output_type(write_json(tmp_path / 'list.json', [1, 2])) is None
+    (tmp_path / 'broken.json').write_text('{"start": {')
+    assert output_type(tmp_path / 'broken.json') is None
+
+def test_output_type_stops_at_fio_stats(tmp_path):
+    # Anything after the stats start is never read
+    (tmp_path / 'fio.json').write_text('{"timestamp": 1, "jobs": [ not json')
+    assert output_type(tmp_path / 'fio.json') == 'fio'
+
+def test_load_directory(tmp_path):
+    write_json(tmp_path / 'fio.json', fio_output(1000))
+    write_json(tmp_path / 'iperf.json', iperf_output(8e6))
+    write_json(tmp_path / 'fio.telemetry.json', fio_output(1000))
+    (tmp_path / 'notes.json').write_text('not json')
+    (tmp_path / 'truncated.json').write_text('{"jobs": [{"jobname": "job", ')
+    steps = load_directory(tmp_path)
+    assert sorted(steps) == ['fio.json', 'iperf.json']
+    assert steps['fio.json']['samples']['bw'] == [1.024]
+    assert steps['iperf.json']['samples']['bw'] == [1.0]
+
+def test_load_directory_pools_trials(tmp_path):
+    for trial, (bw, bins) in enumerate([(1000, {'1000': 2}), (2000, {'1000': 1, '2000': 1})], 1):
+        data = fio_output(bw)
+        data['jobs'][0]['read']['clat_ns'] = {'bins': bins}
+        write_json(tmp_path / 'host-aggregate-randread-4k-1-trial{trial}.fio.output.json'.format(trial=trial), data)
+    write_json(tmp_path / 'host-aggregate-randread-4k-2.fio.output.json', fio_output(3000))
+    steps = load_directory(tmp_path)
+    assert sorted(steps) == ['host-aggregate-randread-4k-1.fio.output.json',
+                             'host-aggregate-randread-4k-2.fio.output.json']
+    pooled = steps['host-aggregate-randread-4k-1.fio.output.json']
+    assert pooled['samples']['bw'] == [1.024, 2.048]
+    assert pooled['samples']['iops'] == [250, 500]
+    latencies, counts = pooled['bins']
+    assert latencies.tolist() == [1.0, 2.0] and counts.tolist() == [3, 1]
@@ -0,0 +1,42 @@
+import json
+import socket
+from ceph_perftest.send_file.engine import LoopbackSink, run_sendfile_streams
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def device_file(tmp_path, size=1024 * 1024):
+    device = tmp_path / 'device'
+    device.write_bytes(b'\0' * size)
+    return device
+
+def test_stream_to_loopback_sink(tmp_path):
+    port = free_port()
+    output_fn = tmp_path / 'out.json'
+    with LoopbackSink([port]):
+        [result] = run_sendfile_streams([(str(device_file(tmp_path)), '127.0.0.1', port, output_fn)], 1)
+    assert result['returncode'] == 0 and not result['timed_out']
+    data = json.loads(output_fn.read_text())
+    assert data['end']['sum_sent']['bytes'] > 0
+    assert sum(i['sum']['bytes'] for i in data['intervals']) == data['end']['sum_sent']['bytes']
+
+def test_unreadable_device_is_an_error(tmp_path):
+    output_fn = tmp_path / 'out.json'
+    [result] = run_sendfile_streams([(str(tmp_path / 'missing'), '127.0.0.1', free_port(), output_fn)], 1)
+    assert result['returncode'] == 1 and result['output_fn'] == output_fn
+    assert 'error' in json.loads(output_fn.read_text())
+
+def test_stalled_receiver_times_out(tmp_path):
+    output_fn = tmp_path / 'out.json'
+    with socket.socket() as listener:
+        # Accepts the connection but never reads from it
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        [result] = run_sendfile_streams(
+            [(str(device_file(tmp_path)), '127.0.0.1', port, output_fn)], 60, stall_timeout=1
+            )
+    assert result['timed_out'] and result['returncode'] == 1
+    assert 'timed out' in json.loads(output_fn.read_text())['error']
@@ -0,0 +1,54 @@
+import io
+import json
+from ceph_perftest.fio_stream import iter_json_stream, is_steady, status_totals
+
+class ChunkedStream:
+    """
+    A binary stream returning at most size bytes per read1, like a pipe.
+    """
+    def __init__(self, data, size):
+        self.data = io.BytesIO(data)
+        self.size = size
+
+    def read1(self, n=-1):
+        return self.data.read(min(n, self.size) if n > 0 else self.size)
+
+def fio_report(idx):
+    # fio pretty-prints its reports
+    return json.dumps({'jobs': [{'jobname': 'job', 'idx': idx}]}, indent=2).encode() + b'\n'
+
+def test_iter_json_stream_yields_each_report():
+    data = b''.join(fio_report(i) for i in range(3))
+    assert [i['jobs'][0]['idx'] for i in iter_json_stream(ChunkedStream(data, 65536))] == [0, 1, 2]
+
+def test_iter_json_stream_across_small_reads():
+    # Splits objects and the end-of-object marker over reads
+    data = b''.join(fio_report(i) for i in range(3))
+    for size in [1, 2, 3, 7]:
+        assert [i['jobs'][0]['idx'] for i in iter_json_stream(ChunkedStream(data, size))] == [0, 1, 2]
+
+def test_iter_json_stream_skips_other_output():
+    data = b'fio: some warning\n' + fio_report(0) + b'noise line\n' + fio_report(1)
+    assert [i['jobs'][0]['idx'] for i in iter_json_stream(ChunkedStream(data, 5))] == [0, 1]
+
+def test_iter_json_stream_skips_invalid_json():
+    data = b'{\n  "jobs": [\n}\n' + fio_report(1)
+    assert [i['jobs'][0]['idx'] for i in iter_json_stream(ChunkedStream(data, 4))] == [1]
+
+def test_iter_json_stream_ignores_incomplete_report():
+    data = fio_report(0) + fio_report(1)[:-3]
+    assert len(list(iter_json_stream(ChunkedStream(data, 16)))) == 1
+
+def test_status_totals_sums_io_types():
+    data = {'jobs': [
+        {'read': {'io_bytes': 10, 'total_ios': 1}, 'write': {'io_bytes': 20, 'total_ios': 2}},
+        {'read': {'io_bytes': 30, 'total_ios': 3}, 'write': {'io_bytes': 40, 'total_ios': 4}}
+        ]}
+    assert status_totals(data, 'read') == (40, 4)
+    assert status_totals(data, ['read', 'write']) == (100, 10)
+
+def test_is_steady():
+    assert not is_steady([100, 100, 100], window=5)
+    assert is_steady([10, 100, 101, 99, 100, 100], window=5, tolerance=0.05)
+    assert not is_steady([100, 100, 100, 100, 150], window=5, tolerance=0.05)
+    assert not is_steady([0, 0, 0, 0, 0], window=5)
@@ -0,0 +1,47 @@
+import json
+import stat
+from ceph_perftest.fs_aggregate.run import generate_fio_configs, run_fio
+
+# Fails like fio --client does when a client is unreachable, and exits
+# cleanly without output for a client named "silent"
+FAKE_FIO = """#!/bin/sh
+output=
+for arg in "$@"; do
+    case "$arg" in
+        --output=*) output="${arg#--output=}" ;;
+        --client=down) echo "fio: connect: Connection refused" >&2; exit 1 ;;
+        --client=silent) exit 0 ;;
+    esac
+done
+echo '{"client_stats": []}' > "$output"
+"""
+
+def fake_fio(tmp_path):
+    fio = tmp_path / 'fio'
+    fio.write_text(FAKE_FIO)
+    fio.chmod(fio.stat().st_mode | stat.S_IEXEC)
+    return str(fio)
+
+def configs(tmp_path):
+    return generate_fio_configs(['4k', '64k'], 16, 1, 'libaio', 10, 1, ['randread'], '1G', 1, str(tmp_path))
+
+def test_run_fio_per_client_count(tmp_path):
+    outputs = run_fio(fake_fio(tmp_path), ['host1', 'host2'], configs(tmp_path), False, tmp_path, 'test')
+    assert [[i.name for i in config_outputs] for config_outputs in outputs] == [
+        ['test-aggregate-randread-4k-1.json', 'test-aggregate-randread-4k-2.json'],
+        ['test-aggregate-randread-64k-1.json', 'test-aggregate-randread-64k-2.json']
+        ]
+    with open(outputs[0][0]) as f:
+        assert json.load(f) == {'client_stats': []}
+
+def test_run_fio_skips_failed_counts(tmp_path, capsys):
+    outputs = run_fio(fake_fio(tmp_path), ['host1', 'down'], configs(tmp_path)[:1], True, tmp_path, 'test')
+    assert [[i.name for i in config_outputs] for config_outputs in outputs] == [['test-aggregate-randread-4k-1.json']]
+    out = capsys.readouterr().out
+    assert 'fio failed with 2 client(s)' in out and 'Connection refused' in out
+    # Job files are cleaned up whether or not fio succeeded
+    assert not list(tmp_path.glob('*.fio'))
+
+def test_run_fio_without_output(tmp_path, capsys):
+    assert run_fio(fake_fio(tmp_path), ['silent'], configs(tmp_path)[:1], False, tmp_path, 'test') == []
+    assert 'no output' in capsys.readouterr().out
@@ -0,0 +1,35 @@
+from ceph_perftest.latency import clat_percentiles, merge_bins, percentile_name, stats_bins
+
+def test_merge_bins_sums_shared_latencies():
+    # fio json+ bins are keyed by latency in ns, as strings once parsed
+    latencies, counts = merge_bins([{'3000': 1, '1000': 2}, {}, {'1000': 1, '2000': 4}])
+    assert latencies.tolist() == [1000, 2000, 3000]
+    assert counts.tolist() == [3, 4, 1]
+
+def test_merge_bins_empty():
+    latencies, counts = merge_bins([{}, {}])
+    assert len(latencies) == 0 and len(counts) == 0
+
+def test_clat_percentiles():
+    # 98 completions at 1us, one at 2us and one at 100us
+    percentiles = clat_percentiles([{'1000': 98, '2000': 1}, {'100000': 1}])
+    assert percentiles == {'p50': 1.0, 'p99': 2.0, 'p99.9': 100.0, 'p99.99': 100.0}
+
+def test_clat_percentiles_across_jobs():
+    # Percentiles of the merged histogram, not of each job's
+    percentiles = clat_percentiles([{'1000': 50}, {'5000': 50}], [25, 75])
+    assert percentiles == {'p25': 1.0, 'p75': 5.0}
+
+def test_clat_percentiles_without_completions():
+    assert clat_percentiles([{}]) == {'p50': 0, 'p99': 0, 'p99.9': 0, 'p99.99': 0}
+
+def test_stats_bins():
+    stats = [
+        {'read': {'clat_ns': {'bins': {'1000': 1}}}, 'write': {}},
+        {'read': {'clat_ns': {}}, 'write': {}}
+        ]
+    assert stats_bins(stats, 'read') == [{'1000': 1}, {}]
+    assert stats_bins(stats, 'write') == [{}, {}]
+
+def test_percentile_name():
+    assert [percentile_name(i) for i in [50, 99.9]] == ['p50', 'p99.9']
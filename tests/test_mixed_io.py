@@ -0,0 +1,16 @@
+from ceph_perftest.mixed_io.run import bs_bytes, order_bs_categories
+
+def test_bs_bytes():
+    assert bs_bytes('4k') == 4096
+    assert bs_bytes('4KiB') == 4096
+    assert bs_bytes('64kb') == 65536
+    assert bs_bytes('1M') == 1024 * 1024
+    assert bs_bytes('512b') == 512
+    assert bs_bytes('4096') == 4096
+    # The read size of a read/write pair
+    assert bs_bytes('1M/4k') == 1024 * 1024
+    assert bs_bytes('default') is None
+
+def test_order_bs_categories():
+    assert order_bs_categories(['1m', 'other', '4k', '64KiB', '4k', '512b']) == \
+        ['512b', '4k', '64KiB', '1m', 'other']
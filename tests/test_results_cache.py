@@ -0,0 +1,104 @@
+import gzip
+import json
+import os
+from ceph_perftest import results_cache
+from ceph_perftest.fio_json import load_fio_output, map_fio_outputs
+from ceph_perftest.results_cache import cache_evict, cache_get, cache_key, cache_put, from_columns, \
+                                        to_columns
+
+FIO_OUTPUT = {
+    'fio version': 'fio-3.28',
+    'timestamp': 1700000000,
+    'global options': {'bs': '4k', 'rw': 'randread'},
+    'client_stats': [
+        {
+            'jobname': 'All clients',
+            'hostname': 'host1',
+            'job options': {'rw': 'randread'},
+            'read': {'bw': 1000, 'iops': 250.0, 'clat_ns': {'mean': 1.5, 'bins': {'1000': 3}}},
+            'write': {'bw': 0, 'iops': 0.0},
+            'usr_cpu': 1.0
+            }
+        ],
+    'disk_util': [{'name': 'sda'}]
+    }
+
+def write_output(path, data=FIO_OUTPUT):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return path
+
+def parse_rows(jsonfile):
+    # Module level so that worker processes can unpickle it
+    data = load_fio_output(jsonfile)
+    return [{'file': os.path.basename(jsonfile), 'bw': i['read']['bw']} for i in data['client_stats']]
+
+def test_columns_round_trip_keys_of_later_records():
+    records = [{'a': 1, 'b': 2}, {'a': 3, 'c': None}, {'c': 4}]
+    table = to_columns(records)
+    assert table['columns'] == ['a', 'b', 'c']
+    assert from_columns(json.loads(json.dumps(table))) == records
+    assert from_columns(to_columns([])) == []
+
+def test_cache_hit(tmp_path):
+    jsonfile = write_output(tmp_path / 'out.json')
+    key = cache_key('parser', jsonfile)
+    assert cache_get(tmp_path / 'cache', key) is None
+    cache_put(tmp_path / 'cache', key, [{'bw': 1000, 'p99': 5.0}, {'bw': 2000}])
+    assert cache_get(tmp_path / 'cache', key) == [{'bw': 1000, 'p99': 5.0}, {'bw': 2000}]
+
+def test_cache_key_changes(tmp_path, monkeypatch):
+    jsonfile = write_output(tmp_path / 'out.json')
+    key = cache_key('parser', jsonfile)
+    assert cache_key('other', jsonfile) != key
+    monkeypatch.setattr(results_cache, 'CACHE_VERSION', results_cache.CACHE_VERSION + 1)
+    assert cache_key('parser', jsonfile) != key
+    monkeypatch.undo()
+    os.utime(jsonfile, ns=(0, 0))
+    assert cache_key('parser', jsonfile) != key
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+    with gzip.open(tmp_path / 'key.json.gz', 'wt') as f:
+        f.write('{"columns": ["a"]')
+    assert cache_get(tmp_path, 'key') is None
+
+def test_evict_least_recently_used(tmp_path):
+    for idx, key in enumerate(['old', 'mid', 'new']):
+        cache_put(tmp_path, key, [{'value': 'x' * 1000}])
+        os.utime(tmp_path / (key + '.json.gz'), (idx, idx))
+    # A hit marks the entry as recently used. Keys are all one length
+    # since gzip stores the file name, so entries are all one size.
+    assert cache_get(tmp_path, 'mid') is not None
+    entry_size = (tmp_path / 'new.json.gz').stat().st_size
+    cache_evict(tmp_path, max_bytes=2 * entry_size)
+    assert sorted(i.name for i in tmp_path.glob('*.json.gz')) == ['mid.json.gz', 'new.json.gz']
+
+def test_load_fio_output_keeps_only_what_is_read(tmp_path):
+    data = load_fio_output(write_output(tmp_path / 'out.json'))
+    assert sorted(data) == ['client_stats', 'global options', 'timestamp']
+    [client] = data['client_stats']
+    assert sorted(client) == ['hostname', 'jobname', 'read', 'write']
+    assert client['read'] == {'bw': 1000, 'iops': 250.0, 'clat_ns': {'mean': 1.5}}
+
+def test_load_fio_output_latency_bins(tmp_path):
+    data = load_fio_output(write_output(tmp_path / 'out.json'), latency_bins=True)
+    assert data['client_stats'][0]['read']['clat_ns']['bins'] == {'1000': 3}
+
+def test_map_fio_outputs_in_order(tmp_path):
+    files = []
+    for idx in range(5):
+        data = json.loads(json.dumps(FIO_OUTPUT))
+        data['client_stats'][0]['read']['bw'] = idx
+        files.append(write_output(tmp_path / 'out{idx}.json'.format(idx=idx), data))
+    expected = [[{'file': 'out{idx}.json'.format(idx=idx), 'bw': idx}] for idx in range(5)]
+    assert map_fio_outputs(parse_rows, files) == expected
+    assert map_fio_outputs(parse_rows, files, jobs=2) == expected
+
+def test_map_fio_outputs_uses_the_cache(tmp_path):
+    jsonfile = write_output(tmp_path / 'out.json')
+    cache_dir = tmp_path / 'cache'
+    assert map_fio_outputs(parse_rows, [jsonfile], cache_dir=cache_dir) == [[{'file': 'out.json', 'bw': 1000}]]
+    # A hit is served from the cache, not by parsing the file again
+    [entry] = cache_dir.glob('*.json.gz')
+    cache_put(cache_dir, entry.name[:-len('.json.gz')], [{'file': 'cached', 'bw': 0}])
+    assert map_fio_outputs(parse_rows, [jsonfile], cache_dir=cache_dir) == [[{'file': 'cached', 'bw': 0}]]
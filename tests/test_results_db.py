@@ -0,0 +1,91 @@
+import io
+import json
+import sqlite3
+import pytest
+from ceph_perftest import results_db
+from ceph_perftest.results_db import connect, export_results, latency_columns, query_results, record_run
+
+def row(**values):
+    values.setdefault('target', '/dev/sda')
+    values.setdefault('mode', 'randread')
+    values.setdefault('bs', '4k')
+    values.setdefault('bw', 100.0)
+    return values
+
+def test_record_run_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(results_db, 'INSERT_BATCH', 2)
+    db_path = tmp_path / 'results.db'
+    run_id = record_run(db_path, 'single-device', [row(count=i) for i in range(5)], started=1.0)
+    columns, rows = query_results(db_path, run_id=run_id)
+    rows = [dict(zip(columns, i)) for i in rows]
+    assert [i['count'] for i in rows] == [0, 1, 2, 3, 4]
+    assert {i['subcommand'] for i in rows} == {'single-device'}
+
+def test_record_run_defaults(tmp_path):
+    db_path = tmp_path / 'nested' / 'results.db'
+    run_id = record_run(db_path, 'single-host', [row(bs=4096, timestamp=None, host='node1'), row()], started=1.0)
+    columns, rows = query_results(db_path, run_id=run_id)
+    rows = [dict(zip(columns, i)) for i in rows]
+    # bs is always stored as text; rows without a timestamp get the run's end
+    assert rows[0]['bs'] == '4096'
+    assert rows[0]['timestamp'] is not None
+    assert rows[0]['host'] == 'node1' and rows[1]['host'] is not None
+    assert rows[0]['p99'] is None
+
+def test_query_filters(tmp_path):
+    db_path = tmp_path / 'results.db'
+    first = record_run(db_path, 'single-device', [
+        row(mode='randread', timestamp=100), row(mode='randwrite', timestamp=200)
+        ], started=1.0)
+    second = record_run(db_path, 'single-host', [
+        row(target='/dev/sdb', bs='64k', timestamp=300)
+        ], started=2.0)
+    count = lambda **filters: len(query_results(db_path, **filters)[1])
+    assert count() == 3
+    assert count(run_id=first) == 2 and count(run_id=second) == 1
+    assert count(subcommand='single-host') == 1
+    assert count(target='/dev/sdb') == 1
+    assert count(mode='randwrite') == 1
+    assert count(bs='64k') == 1
+    assert count(since=200) == 2 and count(until=200) == 1
+    assert count(since=100, until=300) == 2
+    assert count(limit=2) == 2
+    # Oldest first
+    assert [i[-2] for i in query_results(db_path)[1]] == [100, 200, 300]
+
+def test_query_missing_database(tmp_path):
+    with pytest.raises(SystemExit):
+        query_results(tmp_path / 'missing' / 'results.db')
+    assert not (tmp_path / 'missing').exists()
+
+def test_read_only_connection(tmp_path):
+    db_path = tmp_path / 'results.db'
+    record_run(db_path, 'single-device', [row()], started=1.0)
+    conn = connect(db_path, readonly=True)
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute('DELETE FROM results')
+    finally:
+        conn.close()
+
+def test_latency_columns():
+    assert latency_columns({'p50': 1.0, 'p99.9': 2.0, 'p90': 3.0}) == {'p50': 1.0, 'p99_9': 2.0}
+
+def test_export_results():
+    columns = ['run_id', 'bw', 'timestamp']
+    rows = [('abc', 1.5, 0.0), ('def', None, None)]
+    f = io.StringIO()
+    export_results(columns, rows, 'csv', f)
+    assert f.getvalue().splitlines() == ['run_id,bw,timestamp', 'abc,1.5,0.0', 'def,,']
+    f = io.StringIO()
+    export_results(columns, rows, 'json', f)
+    assert json.loads(f.getvalue()) == [
+        {'run_id': 'abc', 'bw': 1.5, 'timestamp': 0.0},
+        {'run_id': 'def', 'bw': None, 'timestamp': None}
+        ]
+    f = io.StringIO()
+    export_results(columns, rows, 'table', f)
+    header, first, second = f.getvalue().splitlines()
+    assert header.split() == columns
+    assert first.split()[:2] == ['abc', '1.50']
+    assert second.split() == ['def']
@@ -0,0 +1,40 @@
+from ceph_perftest.single_device.run import find_saturation, geometric_grid
+
+def saturating(knee, calls):
+    """
+    A probe whose performance scales linearly up to knee jobs and stays
+    flat after, recording the numjobs it is called with.
+    """
+    def probe(numjobs):
+        calls.append(numjobs)
+        return min(numjobs, knee) * 100
+    return probe
+
+def test_geometric_grid():
+    assert geometric_grid(1) == [1]
+    assert geometric_grid(8) == [1, 2, 4, 8]
+    assert geometric_grid(12) == [1, 2, 4, 8, 12]
+
+def test_find_saturation_bisects_to_the_knee():
+    calls = []
+    assert find_saturation(saturating(10, calls), 64, 0.05) == 10
+    # Grid up to the first point without gain, then bisection, each once
+    assert calls == [1, 2, 4, 8, 16, 32, 12, 10, 9]
+
+def test_find_saturation_on_a_grid_point():
+    assert find_saturation(saturating(8, []), 64, 0.05) == 8
+
+def test_find_saturation_flat_from_the_start():
+    assert find_saturation(saturating(1, []), 64, 0.05) == 1
+
+def test_find_saturation_still_scaling():
+    calls = []
+    assert find_saturation(saturating(100, calls), 16, 0.05) is None
+    assert calls == [1, 2, 4, 8, 16]
+
+def test_find_saturation_threshold():
+    # A 10% gain counts as scaling at a 5% threshold but not at 20%
+    def probe(numjobs):
+        return 1000 * 1.1 ** numjobs
+    assert find_saturation(probe, 4, 0.05) is None
+    assert find_saturation(probe, 4, 0.2) == 1
@@ -0,0 +1,64 @@
+import asyncio
+import json
+from ceph_perftest.send_file.sink import Sink, SinkProtocol
+
+class Writer:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+class Transport:
+    def get_extra_info(self, name):
+        return ('192.0.2.1', 40000)
+
+def control(sink, command):
+    async def handle():
+        reader = asyncio.StreamReader()
+        reader.feed_data(command)
+        reader.feed_eof()
+        writer = Writer()
+        await sink.handle_control(reader, writer)
+        return json.loads(writer.data)
+    return asyncio.run(handle())
+
+def connect(sink, port):
+    protocol = SinkProtocol(sink, port)
+    protocol.connection_made(Transport())
+    return protocol
+
+def test_summary_leaves_out_probes():
+    sink = Sink(16)
+    connect(sink, 5201).connection_lost(None)
+    stream = connect(sink, 5202)
+    stream.buffer_updated(16)
+    summary = control(sink, b'\n')
+    assert summary['ports'] == {'5202': {'connections': 1, 'bytes': 16, 'bits_per_second': 0}}
+
+def test_reset_counts_each_tranche_once():
+    sink = Sink(16)
+    done = connect(sink, 5201)
+    done.buffer_updated(16)
+    done.connection_lost(None)
+    # Finished sending, but the sink has not seen it close yet
+    lingering = connect(sink, 5202)
+    lingering.buffer_updated(16)
+    summary = control(sink, b'reset\n')
+    assert {port: i['bytes'] for port, i in summary['ports'].items()} == {'5201': 16, '5202': 16}
+
+    lingering.connection_lost(None)
+    ongoing = connect(sink, 5203)
+    ongoing.buffer_updated(8)
+    summary = control(sink, b'reset\n')
+    assert {port: i['bytes'] for port, i in summary['ports'].items()} == {'5203': 8}
+
+    ongoing.buffer_updated(4)
+    summary = control(sink, b'\n')
+    assert {port: i['bytes'] for port, i in summary['ports'].items()} == {'5203': 4}
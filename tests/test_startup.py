@@ -0,0 +1,54 @@
+import subprocess
+import sys
+import pytest
+
+# Runner modules import these; the CLI must not pay for them just to
+# parse arguments or print help.
+HEAVY_MODULES = ['matplotlib', 'pandas', 'plotnine', 'numpy']
+
+# Seconds. Importing the CLI takes around a fifth of this, importing
+# pandas, plotnine or matplotlib alone more than all of it.
+IMPORT_BUDGET = 0.25
+
+PROBE = """
+import sys
+from ceph_perftest.cli import cli
+try:
+    cli(sys.argv[1:])
+except SystemExit:
+    pass
+print('heavy:', *[m for m in {heavy} if m in sys.modules], file=sys.stderr)
+"""
+
+@pytest.mark.parametrize('args', [
+    ['--help'],
+    ['send-file', 'server', '--help'],
+    ['single-host', '--help'],
+    ])
+def test_help_imports_no_heavy_modules(args):
+    # A fresh interpreter, as modules imported by other tests would
+    # otherwise show up
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE.format(heavy=HEAVY_MODULES)] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True
+        )
+    heavy = [i for i in result.stderr.splitlines() if i.startswith('heavy:')]
+    assert heavy == ['heavy:']
+
+def test_cli_import_time():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ceph_perftest.cli'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True
+        )
+    # "import time: self [us] | cumulative | module" per imported module
+    [cumulative] = [
+        int(line.split('|')[1]) for line in result.stderr.splitlines()
+        if line.split('|')[-1].strip() == 'ceph_perftest.cli'
+        ]
+    assert cumulative / 1000000 < IMPORT_BUDGET
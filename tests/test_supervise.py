@@ -0,0 +1,62 @@
+import json
+import time
+from ceph_perftest.supervise import run_processes
+from ceph_perftest.send_file.runclient import read_iperf_output, run_iperf
+
+def sh(script):
+    return ['sh', '-c', script]
+
+def test_output_exit_code_and_stderr(tmp_path):
+    ok, failed = run_processes([
+        (sh('echo \'{"end": {}}\''), tmp_path / 'ok.json'),
+        (sh('echo oops >&2; exit 3'), tmp_path / 'failed.json')
+        ])
+    assert ok['returncode'] == 0 and not ok['timed_out'] and ok['stderr'] == ''
+    assert json.loads((tmp_path / 'ok.json').read_text()) == {'end': {}}
+    assert failed['returncode'] == 3 and failed['stderr'] == 'oops'
+    assert failed['cmd'] == sh('echo oops >&2; exit 3')
+
+def test_processes_run_concurrently(tmp_path):
+    started = time.monotonic()
+    run_processes([(sh('sleep 1'), tmp_path / 'out{idx}'.format(idx=idx)) for idx in range(4)])
+    assert time.monotonic() - started < 3
+
+def test_timeout_kills_the_whole_session(tmp_path):
+    started = time.monotonic()
+    # The background child holds stderr open; it must be killed too
+    [result] = run_processes([(sh('echo started >&2; sleep 60 & sleep 60'), tmp_path / 'out')], timeout=0.5)
+    assert time.monotonic() - started < 5
+    assert result['timed_out'] and result['returncode'] != 0
+    assert result['stderr'] == 'started'
+
+def result(output_fn, returncode=0, timed_out=False):
+    return {'cmd': ['iperf3'], 'output_fn': output_fn, 'returncode': returncode,
+            'timed_out': timed_out, 'stderr': ''}
+
+def test_read_iperf_output(tmp_path):
+    (tmp_path / 'ok.json').write_text('{"end": {}}')
+    (tmp_path / 'error.json').write_text('{"error": "unable to connect"}')
+    (tmp_path / 'garbled.json').write_text('{"end"')
+    assert read_iperf_output(result(tmp_path / 'ok.json')) == {'end': {}}
+    assert read_iperf_output(result(tmp_path / 'ok.json', returncode=1)) is None
+    assert read_iperf_output(result(tmp_path / 'ok.json', timed_out=True)) is None
+    assert read_iperf_output(result(tmp_path / 'error.json')) is None
+    assert read_iperf_output(result(tmp_path / 'garbled.json')) is None
+
+def test_read_iperf_output_without_output_file(tmp_path, capsys):
+    assert read_iperf_output(result(tmp_path / 'missing.json')) is None
+    assert 'no iperf3 output' in capsys.readouterr().out
+
+class CompletedSteps:
+    def completed(self, key, params):
+        return {'count': 1}
+
+def test_resumed_stream_failure_names_the_command(tmp_path, capsys):
+    # A resumed step whose output since went bad is reported by command,
+    # for the sendfile engine as for iperf3
+    (tmp_path / 'sendfile-1-sdb.json').write_text('{"error": "connection reset"}')
+    (tmp_path / 'iperf3-1-sdb.json').write_text('{"error": "connection reset"}')
+    commands = {'sendfile': 'sendfile /dev/sdb -> host1:5201', 'iperf3': 'iperf3 -c host1 -p 5201'}
+    for engine, command in commands.items():
+        run_iperf('iperf3', 'host1', ['/dev/sdb'], 5201, False, str(tmp_path), 10, CompletedSteps(), engine)
+        assert 'Stream failed: ' + command in capsys.readouterr().out
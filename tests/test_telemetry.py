@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+import pytest
+from ceph_perftest import telemetry
+from ceph_perftest.telemetry import TelemetrySampler, is_loopback
+
+@pytest.fixture
+def host(monkeypatch):
+    # Two CPUs, one disk, a NIC and loopback
+    monkeypatch.setattr(telemetry.psutil, 'cpu_count', lambda: 2)
+    monkeypatch.setattr(telemetry.psutil, 'disk_io_counters', lambda perdisk: {'sda': None})
+    monkeypatch.setattr(telemetry.psutil, 'net_io_counters', lambda pernic: {'lo': None, 'eth0': None})
+    monkeypatch.setattr(telemetry.psutil, 'net_if_stats', lambda: {
+        'lo': SimpleNamespace(flags='up,loopback,running'),
+        'eth0': SimpleNamespace(flags='up,broadcast,running')
+        })
+
+def test_is_loopback():
+    assert is_loopback('lo', {})
+    assert is_loopback('lo0', {'lo0': SimpleNamespace(flags='up,loopback')})
+    assert not is_loopback('eth0', {'eth0': SimpleNamespace(flags='up,broadcast')})
+
+def test_columns(host):
+    sampler = TelemetrySampler()
+    assert sampler.columns == [
+        'time', 'cpu0', 'cpu1', 'softirq0', 'softirq1',
+        'sda.read_bytes', 'sda.write_bytes', 'sda.busy_time',
+        'eth0.bytes_sent', 'eth0.bytes_recv', 'lo.bytes_sent', 'lo.bytes_recv'
+        ]
+    assert sampler.net_nics == ['eth0']
+
+def test_summary(host):
+    sampler = TelemetrySampler()
+    # time, cpu0-1 (%), softirq0-1 (s), sda bytes and busy ms, eth0 and lo bytes
+    for row in [
+            [0, 0, 0, 0.0, 0.0, 0, 0, 0, 0, 0, 0, 0],
+            [1, 20, 60, 0.1, 0.1, 0, 0, 500, 1e6, 1e6, 5e6, 5e6],
+            [2, 40, 80, 0.2, 0.2, 0, 0, 1000, 2e6, 2e6, 1e7, 1e7]]:
+        sampler.data.extend(row)
+    assert sampler.column('cpu1').tolist() == [0, 60, 80]
+    summary = sampler.summary()
+    # The first row's CPU figures cover no interval and are left out
+    assert summary['cpu'] == pytest.approx(50)
+    assert summary['cpu_max'] == pytest.approx(70)
+    assert summary['softirq'] == pytest.approx(10)
+    assert summary['disk_busy'] == pytest.approx(50)
+    # Loopback traffic is left out
+    assert summary['net'] == pytest.approx(2)
+
+def test_summary_of_too_few_samples(host):
+    sampler = TelemetrySampler()
+    sampler.data.extend([0] * len(sampler.columns))
+    assert sampler.summary() == {'cpu': 0, 'cpu_max': 0, 'softirq': 0, 'disk_busy': 0, 'net': 0}
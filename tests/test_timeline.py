@@ -0,0 +1,42 @@
+import pytest
+from ceph_perftest.send_file.timeline import aggregate_timeline, plateau_time, steady_state_bw, stream_intervals
+
+def test_steady_state_bw_omits_warm_up():
+    intervals = [(0, 1, 100), (1, 2, 200), (2, 3, 300), (3, 4, 300)]
+    assert steady_state_bw(intervals, 0) == (100 + 200 + 300 + 300) * 8 / 4
+    assert steady_state_bw(intervals, 2) == 600 * 8 / 2
+
+def test_steady_state_bw_tolerates_drifting_boundaries():
+    # An interval ending just past omit is warm-up, one starting just
+    # before it is not
+    intervals = [(0, 1.0002, 100), (1.0002, 1.9998, 200), (1.9998, 3.0001, 300)]
+    assert steady_state_bw(intervals, 2) == pytest.approx(300 * 8 / (3.0001 - 1.9998))
+
+def test_steady_state_bw_nothing_left():
+    assert steady_state_bw([(0, 1, 100)], 5) is None
+    assert steady_state_bw([], 0) is None
+
+def test_stream_intervals():
+    data = {'intervals': [{'sum': {'start': 0, 'end': 1, 'bytes': 10}}]}
+    assert stream_intervals(data) == [(0, 1, 10)]
+    assert stream_intervals({'error': 'failed'}) == []
+
+def test_aggregate_timeline_sums_streams():
+    starts, ends, aggregate = aggregate_timeline({
+        'a': [(0, 1, 1000000), (1, 2, 2000000)],
+        'b': [(0.1, 1, 900000)]
+        })
+    assert starts == [0, 1]
+    assert ends == [1, 2]
+    assert aggregate == pytest.approx([2, 2])
+
+def test_plateau_time():
+    starts = [0, 1, 2, 3, 4, 5]
+    assert plateau_time(starts, [10, 50, 95, 100, 100, 105]) == 2
+    # Steady from the start
+    assert plateau_time(starts, [100] * 6) == 0
+
+def test_plateau_time_without_a_plateau():
+    assert plateau_time([0], [100]) is None
+    # Still moving at the end of the run
+    assert plateau_time([0, 1, 2, 3], [100, 100, 100, 200]) is None